@@ -1,9 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import pandas as pd
 import yaml
 from datetime import datetime
 import os
+import multiprocessing
+import queue
+import threading
+import time
+
+import app_config
+import startup
+from history_panel import HistoryPanel
+from preview_grid import PreviewPanel, result_frames
+
+
+def import_engine():
+    """Import the processing code (pandas, openpyxl, xlsxwriter)"""
+    import proposal_engine
+    return proposal_engine
+
+
+class ProcessingCancelled(Exception):
+    """Raised on the worker thread when the user cancels a run"""
+
 
 class DynamicInvoiceProcessor:
     def __init__(self, root):
@@ -14,55 +33,45 @@ class DynamicInvoiceProcessor:
         # Initialize config
         self.config = self.load_default_config()
         
+        # Worker thread state; the worker reports back through self.events
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+        
         # GUI Setup
         self.setup_ui()
+        self.root.after(100, self.poll_events)
+
+        # pandas and openpyxl load in the background while the user picks files
+        self.update_status("Loading libraries...")
+        self.engine_loader = startup.BackgroundLoader(import_engine, self.engine_loaded).start()
         
     def load_default_config(self):
         """Load or create default configuration"""
-        default_config = {
-            "filters": {
-                "exclude_gl_texts": [
-                    "Intercompany payable", 
-                    "IOU manager", 
-                    "IOU staff",
-                    "Short Term loan",
-                    "Trade creditors-Foreign",
-                    "Vendors bills of exchange", 
-                    "Transport Creditors"
-                ],
-                "payment_method": "T",
-                "currency": "NGN",
-                "exclude_suppliers_with_balance": True,
-                "exclude_payment_block": True,
-                "exclude_ntc_vendor": True,
-                "exclude_blank_suppliers": True,
-                "exclude_blank_bank_accounts": True,
-                "additional_exclusions": []
-            },
-            "grouping": {
-                "by": ["Supplier"],
-                "aggregations": {
-                    "Name": "first",
-                    "WHT availability": "first",
-                    "Diageo/Tolaram": "first",
-                    "Document Currency Value": "sum",
-                    "Payable after WHT": "sum"
-                }
-            },
-            "output": {
-                "output_folder": "processed_results",
-                "file_prefix": datetime.now().strftime("%Y%m%d")
-            }
-        }
-        
-        # Create config file if doesn't exist
-        if not os.path.exists("config.yaml"):
-            with open("config.yaml", "w") as f:
-                yaml.dump(default_config, f)
-            return default_config
+        return app_config.load_config(create=True)
+
+    def engine_loaded(self, error):
+        """Report the end of the background imports (runs on the loader thread)"""
+        if error is not None:
+            self.log_message(f"ERROR: could not load the processing libraries: {error}")
+            self.update_status("Error occurred")
         else:
-            with open("config.yaml", "r") as f:
-                return yaml.safe_load(f)
+            self.update_status("Ready")
+
+    def engine(self):
+        """The proposal_engine module, waiting for the background import if needed"""
+        return self.engine_loader.get()
+
+    def open_history(self):
+        """The HistoryStore from the config, or None if history is disabled"""
+        self.engine()
+        from history_store import history_store_from_config
+        return history_store_from_config(self.config)
+
+    def currency_text(self):
+        """Currency filter as shown in the entry: one code, several, or ALL"""
+        currency = self.config["filters"]["currency"]
+        return ", ".join(currency) if isinstance(currency, list) else currency
     
     def setup_ui(self):
         """Setup the main user interface"""
@@ -102,7 +111,7 @@ class DynamicInvoiceProcessor:
         
         # Currency - Row 2
         ttk.Label(config_frame, text="Currency:").grid(row=2, column=0, sticky="e")
-        self.currency = tk.StringVar(value=self.config["filters"]["currency"])
+        self.currency = tk.StringVar(value=self.currency_text())
         ttk.Entry(config_frame, textvariable=self.currency, width=10).grid(row=2, column=1, sticky="w")
         
         # Checkboxes for additional filters - Row 3
@@ -135,16 +144,28 @@ class DynamicInvoiceProcessor:
         self.file_prefix = tk.StringVar(value=self.config["output"]["file_prefix"])
         ttk.Entry(output_frame, textvariable=self.file_prefix, width=30).grid(row=1, column=1, sticky="w")
         
-        # Process Button
-        process_btn = ttk.Button(main_frame, text="Process Files", command=self.process_files)
-        process_btn.pack(pady=10)
-        
-        # Logging Area
-        log_frame = ttk.LabelFrame(main_frame, text="Processing Log", padding="10")
-        log_frame.pack(fill=tk.BOTH, expand=True)
-        
+        # Process / Cancel Buttons
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(pady=10)
+        self.process_btn = ttk.Button(button_frame, text="Process Files", command=self.process_files)
+        self.process_btn.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = ttk.Button(button_frame, text="Cancel", command=self.cancel_processing, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Logging Area and Results Preview, one tab each
+        self.results_tabs = ttk.Notebook(main_frame)
+        self.results_tabs.pack(fill=tk.BOTH, expand=True)
+
+        log_frame = ttk.Frame(self.results_tabs, padding="10")
+        self.results_tabs.add(log_frame, text="Processing Log")
         self.log_area = scrolledtext.ScrolledText(log_frame, height=15, wrap=tk.WORD)
         self.log_area.pack(fill=tk.BOTH, expand=True)
+
+        self.preview = PreviewPanel(self.results_tabs, padding="10")
+        self.results_tabs.add(self.preview, text="Results Preview")
+
+        self.history = HistoryPanel(self.results_tabs, self.open_history, padding="10")
+        self.results_tabs.add(self.history, text="History")
         
         # Status Bar
         self.status_var = tk.StringVar(value="Ready")
@@ -171,16 +192,13 @@ class DynamicInvoiceProcessor:
             self.output_folder.set(folder_path)
     
     def log_message(self, message):
-        """Add message to log area"""
+        """Queue a message for the log area (safe from the worker thread)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_area.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_area.see(tk.END)
-        self.root.update()
+        self.events.put(("log", f"[{timestamp}] {message}"))
     
     def update_status(self, message):
-        """Update status bar"""
-        self.status_var.set(message)
-        self.root.update()
+        """Queue a status bar update (safe from the worker thread)"""
+        self.events.put(("status", message))
     
     def validate_inputs(self):
         """Check if required inputs are provided"""
@@ -219,209 +237,111 @@ class DynamicInvoiceProcessor:
     
 
     def process_files(self):
-        """Main processing function"""
+        """Start processing on a background worker thread"""
+        if self.worker is not None and self.worker.is_alive():
+            return
         if not self.validate_inputs():
             return
-        
+
+        # Read the Tk variables here; the worker must not touch widgets
+        self.update_config()
+        self.cancel_event.clear()
+        self.process_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.worker = threading.Thread(
+            target=self.run_pipeline,
+            args=(self.invoice_path.get(), self.supplier_path.get()),
+            daemon=True
+        )
+        self.worker.start()
+
+    def cancel_processing(self):
+        """Ask the worker to stop; the load is stopped mid-parse, other steps at their end"""
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.log_message("Cancelling...")
+
+    def check_cancelled(self):
+        """Raise ProcessingCancelled if the user pressed Cancel"""
+        if self.cancel_event.is_set():
+            raise ProcessingCancelled()
+
+    def poll_events(self):
+        """Apply queued worker events to the widgets, then reschedule"""
         try:
-            self.update_status("Processing...")
-            self.log_message("Starting invoice processing")
-            self.update_config()
-            
-            # Create output folder if not exists
-            os.makedirs(self.config["output"]["output_folder"], exist_ok=True)
-            
-            # Load data
-            self.log_message("Loading invoice data...")
-            invoice_df = pd.read_excel(self.invoice_path.get(), header=1)
-            invoice_df.columns = invoice_df.columns.str.strip()
-            
-            self.log_message("Loading supplier data...")
-            supplier_df = pd.read_excel(self.supplier_path.get())
-            supplier_df.columns = supplier_df.columns.str.strip()
-            
-            # Apply filters
-            self.log_message("Applying filters...")
-            filtered_df = self.apply_filters(invoice_df, supplier_df)
-            
-            # Group data
-            self.log_message("Grouping data...")
-            grouped_df = self.apply_grouping(filtered_df)
-            
-            # Save outputs
-            prefix = self.config["output"]["file_prefix"]
-            output_folder = self.config["output"]["output_folder"]
-            
-            filtered_path = os.path.join(output_folder, f"{prefix}_filtered.xlsx")
-            summary_path = os.path.join(output_folder, f"{prefix}_summary.xlsx")
+            while True:
+                kind, payload = self.events.get_nowait()
+                if kind == "log":
+                    self.log_area.insert(tk.END, payload + "\n")
+                    self.log_area.see(tk.END)
+                elif kind == "status":
+                    self.status_var.set(payload)
+                elif kind == "preview":
+                    self.preview.load(payload)
+                    self.results_tabs.select(self.preview)
+                elif kind == "done":
+                    self.finish_run()
+                    messagebox.showinfo("Success", "Files processed successfully!")
+                    # Open output folder (Windows only)
+                    try:
+                        os.startfile(payload)
+                    except Exception as e:
+                        self.log_message(f"Could not open {payload}: {e}")
+                elif kind == "cancelled":
+                    self.finish_run()
+                elif kind == "error":
+                    self.finish_run()
+                    messagebox.showerror("Processing Error", payload)
+        except queue.Empty:
+            pass
+        finally:
+            # Keep polling even if applying an event failed
+            self.root.after(100, self.poll_events)
 
-            # Function to save with proper number formatting
-            def save_with_accounting_format(df, file_path):
-                with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Sheet1')
-                    
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-                    
-                    # Create accounting number format
-                    accounting_format = '_(* #,##0.00_);_(* (#,##0.00);_(* "-"??_);_(@_)'
-                    
-                    # Apply to all numeric columns
-                    for col in df.select_dtypes(include=['int64', 'float64']).columns:
-                        col_idx = df.columns.get_loc(col) + 1  # +1 because Excel is 1-based
-                        
-                        # Apply to all cells in column
-                        for row in range(2, len(df)+2):  # +2 for header and 1-based index
-                            cell = worksheet.cell(row=row, column=col_idx)
-                            if pd.api.types.is_numeric_dtype(df[col]):
-                                cell.number_format = accounting_format
-            
-            self.log_message(f"Saving filtered data to: {filtered_path}")
-            save_with_accounting_format(filtered_df, filtered_path)
-            
-            self.log_message(f"Saving summary data to: {summary_path}")
-            save_with_accounting_format(grouped_df, summary_path)
-            
-            self.log_message("Processing completed successfully!")
-            self.update_status("Ready")
-            messagebox.showinfo("Success", "Files processed successfully!")
-            
-            # Open output folder
-            os.startfile(output_folder)
-            
-        except Exception as e:
-            self.log_message(f"ERROR: {str(e)}")
-            self.update_status("Error occurred")
-            messagebox.showerror("Processing Error", str(e))
+    def finish_run(self):
+        """Re-enable the Process button once the worker has stopped"""
+        self.process_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
 
-            
-            # Custom Excel writer function with formatting
-            def save_with_formatting(df, path):
-                with pd.ExcelWriter(path, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False)
-                    
-                    # Get the workbook and worksheet
-                    workbook = writer.book
-                    worksheet = writer.sheets['Sheet1']
-                    
-                    # Define accounting format (negative numbers in brackets)
-                    accounting_format = '#,##0.00_);(#,##0.00)'
-                    
-                    # Apply formatting to all numeric columns
-                    for col_num, col_name in enumerate(df.columns, 1):
-                        if pd.api.types.is_numeric_dtype(df[col_name]):
-                            for row_num in range(2, len(df) + 2):  # +2 because Excel is 1-based and we have header
-                                worksheet.cell(row=row_num, column=col_num).number_format = accounting_format
-            
-            self.log_message(f"Saving filtered data to: {filtered_path}")
-            save_with_formatting(filtered_df, filtered_path)
-            
-            self.log_message(f"Saving summary data to: {summary_path}")
-            save_with_formatting(grouped_df, summary_path)
-            
+    def run_pipeline(self, invoice_path, supplier_path):
+        """Load, filter, group and save (runs on the worker thread)"""
+        try:
+            if not self.engine_loader.ready():
+                self.log_message("Waiting for libraries to finish loading...")
+            engine = self.engine()
+            self.update_status("Processing...")
+            self.log_message("Starting invoice processing")
+            result = engine.run_pipeline(
+                invoice_path, supplier_path, self.config,
+                log=self.log_message, check_cancelled=self.check_cancelled
+            )
+            self.log_message(f"Stage profile saved to: {result['profile_path']}")
             self.log_message("Processing completed successfully!")
             self.update_status("Ready")
-            messagebox.showinfo("Success", "Files processed successfully!")
-            
-            # Open output folder
-            os.startfile(output_folder)
+            self.events.put(("preview", result_frames(result)))
+            self.events.put(("done", result["output_folder"]))
             
+        except ProcessingCancelled:
+            self.log_message("Processing cancelled")
+            self.update_status("Cancelled")
+            self.events.put(("cancelled", None))
         except Exception as e:
             self.log_message(f"ERROR: {str(e)}")
             self.update_status("Error occurred")
-            messagebox.showerror("Processing Error", str(e))    
-    def apply_filters(self, invoice_df, supplier_df):
-        """Apply all configured filters"""
-        filters = self.config["filters"]
-        text_columns = ["G/L Account: Long Text", "Payment Method", "Currency", 
-                    "Payment block", "Diageo", "Supplier", "Bank account", "Due/Not"]
-        for col in text_columns:
-            if col in invoice_df.columns:
-                invoice_df[col] = invoice_df[col].astype(str).str.strip()
-        # Convert columns to string and strip whitespace for consistent comparison
-        #invoice_df = invoice_df.apply(lambda x: x.astype(str)).apply(lambda x: x.str.strip())
-        
-        # Exclude GL texts
-        if "exclude_gl_texts" in filters and filters["exclude_gl_texts"]:
-            self.log_message(f"Excluding GL texts: {', '.join(filters['exclude_gl_texts'])}")
-            invoice_df = invoice_df[~invoice_df["G/L Account: Long Text"].isin(filters["exclude_gl_texts"])]
-        
-        # Payment method filter
-        if "payment_method" in filters:
-            self.log_message(f"Filtering for payment method: {filters['payment_method']}")
-            invoice_df = invoice_df[invoice_df["Payment Method"] == filters["payment_method"]]
-        
-        # Currency filter
-        if "currency" in filters:
-            self.log_message(f"Filtering for currency: {filters['currency']}")
-            invoice_df = invoice_df[invoice_df["Currency"] == filters["currency"]]
-        
-        # Exclude payment blocked items
-        if filters.get("exclude_payment_block", False):
-            self.log_message("Excluding payment blocked items (A, B, R, V)")
-            invoice_df = invoice_df[~invoice_df["Payment block"].isin(["A", "B", "R", "V"])]
-        
-        # Exclude NTC-VENDOR items
-        if filters.get("exclude_ntc_vendor", False):
-            self.log_message("Excluding NTC-VENDOR items")
-            invoice_df = invoice_df[~invoice_df["Diageo"].str.contains("NTC- VENDOR", case=False, na=False)]
-        
-        # Exclude blank suppliers
-        if filters.get("exclude_blank_suppliers", False):
-            self.log_message("Excluding blank suppliers")
-            invoice_df = invoice_df[invoice_df["Supplier"].notna() & (invoice_df["Supplier"] != "")]
-        
-        # Exclude blank bank accounts
-        if filters.get("exclude_blank_bank_accounts", False):
-            self.log_message("Excluding blank bank accounts")
-            invoice_df = invoice_df[~invoice_df["Bank account"].isin(["", "nan", "None"]) & invoice_df["Bank account"].notna()]
-        
-        # Additional validation checks
-        self.log_message("Applying additional validations...")
-        invoice_df = invoice_df[
-            (invoice_df["Net Due Date"].notna()) &
-            (invoice_df["Due/Not"].str.strip().str.lower() == "due")
-        ]
-        
-        # Exclude suppliers with balance
-        if filters.get("exclude_suppliers_with_balance", False):
-            self.log_message("Excluding suppliers with outstanding balances")
-            suppliers_with_balance = self.get_suppliers_with_balance(supplier_df)
-            invoice_df = invoice_df[~invoice_df["Supplier"].isin(suppliers_with_balance)]
-        
-        return invoice_df
-
-
-
-    def apply_grouping(self, df):
-        """Apply grouping and aggregation"""
-        grouping = self.config["grouping"]
-        self.log_message(f"Grouping by: {', '.join(grouping['by'])}")
-        return df.groupby(grouping["by"], as_index=False).agg(grouping["aggregations"])
-    
-
-
-
-    def get_suppliers_with_balance(self, supplier_df):
-        """Identify suppliers where sum of (Debit + Credit) > 0"""
-        supplier_df = supplier_df[supplier_df["Supplier"].notna()].copy()
-        
-        # Convert to numeric (if not already)
-        supplier_df["Clsng Blns Debit"] = pd.to_numeric(supplier_df["Clsng Blns Debit"], errors="coerce").fillna(0)
-        supplier_df["Clsng Blns Credit"] = pd.to_numeric(supplier_df["Clsng Blns Credit"], errors="coerce").fillna(0)
-        
-        # Calculate Net_value (Debit + Credit)
-        supplier_df["Net_value"] = supplier_df["Clsng Blns Debit"] + supplier_df["Clsng Blns Credit"]
-        
-        # Group by Supplier and sum Net_value
-        grouped = supplier_df.groupby("Supplier", as_index=False)["Net_value"].sum()
-        
-        # Filter suppliers where sum(Net_value) > 0
-        suppliers_with_balance = grouped[grouped["Net_value"] > 0]["Supplier"].astype(str).str.strip().unique()
-        return suppliers_with_balance       
+            self.events.put(("error", str(e)))
     
 
 if __name__ == "__main__":
+    # Needed for the workbook loader's process pool in the frozen exe
+    multiprocessing.freeze_support()
+    imported_at = None
+    if startup.eager_imports():
+        import_engine()
+        imported_at = time.time()
     root = tk.Tk()
     app = DynamicInvoiceProcessor(root)
+    benchmark = startup.benchmark_path()
+    if benchmark:
+        startup.run_startup_benchmark(root, app.engine_loader, benchmark, imported_at)
     root.mainloop()
\ No newline at end of file
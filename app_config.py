@@ -0,0 +1,147 @@
+"""Configuration defaults and config.yaml loading.
+
+Kept apart from proposal_engine so the GUIs can read their settings and draw
+the window without importing pandas.
+"""
+import os
+from datetime import datetime
+
+import yaml
+
+CONFIG_PATH = "config.yaml"
+
+
+def default_config():
+    """Return the default configuration"""
+    return {
+        "filters": {
+            "exclude_gl_texts": [
+                "Intercompany payable",
+                "IOU manager",
+                "IOU staff",
+                "Short Term loan",
+                "Trade creditors-Foreign",
+                "Vendors bills of exchange",
+                "Transport Creditors"
+            ],
+            "payment_method": "T",
+            "currency": "NGN",
+            "exclude_suppliers_with_balance": True,
+            "exclude_payment_block": True,
+            "exclude_ntc_vendor": True,
+            "exclude_blank_suppliers": True,
+            "exclude_blank_bank_accounts": True,
+            "additional_exclusions": []
+        },
+        "duplicates": {
+            "enabled": False,
+            "keys": ["Supplier", "Reference", "Document Currency Value", "Document Date"],
+            "near_keys": ["Supplier", "Reference"],
+            "amount_column": "Document Currency Value",
+            "amount_tolerance": 1.0,
+            "relative_tolerance": 0.001,
+            "hold": False
+        },
+        "priority": {
+            "enabled": False,
+            "available_cash": 0,
+            "amount_column": "Payable after WHT",
+            "strict": False,
+            "critical_suppliers": [],
+            "keys": [
+                {"column": "Supplier", "first": "critical_suppliers"},
+                {"column": "Net Due Date", "order": "ascending"},
+                {"column": "Diageo/Tolaram", "first": ["Diageo", "Tolaram"]}
+            ]
+        },
+        "batches": {
+            "enabled": False,
+            "max_lines": 500,
+            "max_value": 0,
+            "amount_column": "Payable after WHT",
+            "split_by": ["Diageo/Tolaram"],
+            "format": "csv"
+        },
+        "grouping": {
+            "by": ["Supplier"],
+            "aggregations": {
+                "Name": "first",
+                "WHT availability": "first",
+                "Diageo/Tolaram": "first",
+                "Document Currency Value": "sum",
+                "Payable after WHT": "sum"
+            }
+        },
+        "output": {
+            "output_folder": "processed_results",
+            "file_prefix": datetime.now().strftime("%Y%m%d"),
+            "constant_memory": True,
+            "rejected_rows": False,
+            "parallel_currencies": True,
+            "formats": ["xlsx"],
+            "single_workbook": False
+        },
+        "input": {
+            "project_columns": False,
+            "extra_columns": [],
+            "parallel_load": True,
+            "streaming": False,
+            "chunk_rows": 50000
+        },
+        "cache": {
+            "enabled": True,
+            "folder": ".excel_cache",
+            "max_size_mb": 500
+        },
+        "compute": {
+            "backend": "pandas",
+            "threads": None
+        },
+        "balance_index": {
+            "enabled": True,
+            "path": "supplier_balances.sqlite",
+            "max_snapshots": 30
+        },
+        "history": {
+            "enabled": True,
+            "path": "proposal_history.sqlite"
+        },
+        "watch": {
+            "folder": "incoming",
+            "workings_pattern": "*workings*.xls*",
+            "tb_pattern": "*sub tb*.xls*",
+            "poll_seconds": 5,
+            "settle_seconds": 10,
+            "state_file": "watch_state.json"
+        },
+        "service": {
+            "host": "127.0.0.1",
+            "port": 8765,
+            "workers": 2,
+            "max_upload_mb": 200,
+            "metrics_window": 1000
+        }
+    }
+
+
+def load_config(path=CONFIG_PATH, create=False):
+    """Load config.yaml, falling back to the defaults if it does not exist"""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return yaml.safe_load(f)
+    config = default_config()
+    if create:
+        with open(path, "w") as f:
+            yaml.dump(config, f)
+    return config
+
+
+def merge_config(base, override):
+    """Return a copy of base with the nested dict override laid over it"""
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -0,0 +1,221 @@
+"""Persistent supplier balance index backed by SQLite.
+
+Each trial balance file is indexed once under its content hash. Re-running
+with the same Sub TB skips loading and aggregating it.
+
+Net closing balances (Clsng Blns Debit + Clsng Blns Credit) are stored per
+(supplier, row digest) pair and shared between snapshots. When a new Sub TB
+only differs in some suppliers, only those suppliers get new balance rows;
+the snapshot itself is just a list of (supplier, digest) members.
+"""
+import contextlib
+import os
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from workbook_cache import file_hash
+
+DEFAULT_INDEX_PATH = "supplier_balances.sqlite"
+DEFAULT_MAX_SNAPSHOTS = 30
+# Between a supplier key's type tag and its text
+KEY_SEPARATOR = "\x1f"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    file_hash TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS supplier_balances (
+    supplier TEXT NOT NULL,
+    digest INTEGER NOT NULL,
+    net_value REAL NOT NULL,
+    PRIMARY KEY (supplier, digest)
+);
+CREATE TABLE IF NOT EXISTS snapshot_suppliers (
+    file_hash TEXT NOT NULL,
+    supplier TEXT NOT NULL,
+    digest INTEGER NOT NULL,
+    PRIMARY KEY (file_hash, supplier)
+);
+"""
+
+
+def supplier_key(value):
+    """Index key of a raw Supplier value: whether it is text, and its text"""
+    return f"{'s' if isinstance(value, str) else 'v'}{KEY_SEPARATOR}{value}"
+
+
+def supplier_label(key):
+    """The stripped supplier text the filters compare, from an index key"""
+    return key.split(KEY_SEPARATOR, 1)[-1].strip()
+
+
+def supplier_digests(supplier_df):
+    """Return a frame of supplier key, row digest and net value per supplier.
+
+    Suppliers are grouped on their raw values, as get_suppliers_with_balance
+    does, so "1005093" and "1005093 " keep separate balances; the key keeps
+    them apart in SQLite. The digest is an order-independent sum of row
+    hashes, so it changes whenever any of a supplier's rows does.
+    """
+    supplier_df = supplier_df[supplier_df["Supplier"].notna()]
+    frame = pd.DataFrame({
+        "supplier": supplier_df["Supplier"],
+        "debit": pd.to_numeric(supplier_df["Clsng Blns Debit"], errors="coerce").fillna(0),
+        "credit": pd.to_numeric(supplier_df["Clsng Blns Credit"], errors="coerce").fillna(0),
+    })
+    # uint64 sums wrap around, which is fine for a digest; view as int64 for SQLite
+    frame["digest"] = pd.util.hash_pandas_object(frame, index=False).to_numpy().view("int64")
+    frame["net_value"] = frame["debit"] + frame["credit"]
+    grouped = frame.groupby("supplier", as_index=False, sort=False).agg(
+        digest=("digest", "sum"), net_value=("net_value", "sum")
+    )
+    grouped["supplier"] = [supplier_key(value) for value in grouped["supplier"].tolist()]
+    return grouped
+
+
+class SupplierBalanceIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_snapshots=DEFAULT_MAX_SNAPSHOTS):
+        self.path = path
+        self.max_snapshots = max_snapshots
+        # file hash -> suppliers, so a long-running process skips SQLite too
+        self._memo = {}
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection that commits on success, rolls back on error and is always closed"""
+        # Batch workers may index the same Sub TB at once; wait for the lock
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _latest_snapshot(self, conn):
+        row = conn.execute(
+            "SELECT file_hash FROM snapshots ORDER BY indexed_at DESC LIMIT 1"
+        ).fetchone()
+        return row[0] if row else None
+
+    def _suppliers_with_balance(self, conn, tb_hash):
+        rows = conn.execute(
+            """
+            SELECT m.supplier FROM snapshot_suppliers m
+            JOIN supplier_balances b ON b.supplier = m.supplier AND b.digest = m.digest
+            WHERE m.file_hash = ? AND b.net_value > 0
+            """,
+            (tb_hash,)
+        )
+        return frozenset(supplier_label(supplier) for (supplier,) in rows)
+
+    def contains(self, tb_path, tb_hash=None):
+        """True if this Sub TB file has already been indexed; tb_hash is its file_hash, if known"""
+        tb_hash = tb_hash or file_hash(tb_path)
+        if tb_hash in self._memo:
+            return True
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM snapshots WHERE file_hash = ?", (tb_hash,)
+            ).fetchone() is not None
+
+    def suppliers_with_balance(self, tb_path, load, tb_hash=None):
+        """Return (suppliers with a positive net balance, status message).
+
+        load() is only called when tb_path has not been indexed yet and must
+        return the trial balance as a DataFrame. tb_hash is the file's
+        file_hash, if the caller already has it.
+        """
+        tb_hash = tb_hash or file_hash(tb_path)
+        if tb_hash in self._memo:
+            return self._memo[tb_hash], "memory hit"
+        suppliers, status = self._lookup(tb_path, tb_hash, load)
+        self._memo[tb_hash] = suppliers
+        while len(self._memo) > self.max_snapshots:
+            self._memo.pop(next(iter(self._memo)))
+        return suppliers, status
+
+    def _lookup(self, tb_path, tb_hash, load):
+        with self._connect() as conn:
+            known = conn.execute(
+                "SELECT 1 FROM snapshots WHERE file_hash = ?", (tb_hash,)
+            ).fetchone()
+            if known:
+                return self._suppliers_with_balance(conn, tb_hash), "index hit"
+
+            current = supplier_digests(load())
+            previous_hash = self._latest_snapshot(conn)
+            previous = pd.read_sql_query(
+                "SELECT supplier, digest FROM snapshot_suppliers WHERE file_hash = ?",
+                conn, params=(previous_hash,)
+            )
+            merged = current.merge(previous, on="supplier", how="left", suffixes=("", "_prev"))
+            changed = merged[merged["digest"] != merged["digest_prev"]]
+
+            # Only suppliers whose rows changed need new balance rows
+            conn.executemany(
+                "INSERT OR IGNORE INTO supplier_balances (supplier, digest, net_value) VALUES (?, ?, ?)",
+                [(supplier, int(digest), float(net))
+                 for supplier, digest, net in changed[["supplier", "digest", "net_value"]].itertuples(index=False)]
+            )
+            conn.executemany(
+                "INSERT INTO snapshot_suppliers (file_hash, supplier, digest) VALUES (?, ?, ?)",
+                [(tb_hash, supplier, int(digest))
+                 for supplier, digest in current[["supplier", "digest"]].itertuples(index=False)]
+            )
+            conn.execute(
+                "INSERT INTO snapshots (file_hash, file_name, indexed_at) VALUES (?, ?, ?)",
+                (tb_hash, os.path.basename(tb_path), datetime.now().isoformat())
+            )
+            self._evict(conn)
+            status = f"indexed, {len(changed)} of {len(current)} suppliers changed"
+            return self._suppliers_with_balance(conn, tb_hash), status
+
+    def _evict(self, conn):
+        """Drop the oldest snapshots beyond max_snapshots"""
+        stale = [row[0] for row in conn.execute(
+            "SELECT file_hash FROM snapshots ORDER BY indexed_at DESC LIMIT -1 OFFSET ?",
+            (self.max_snapshots,)
+        )]
+        for tb_hash in stale:
+            conn.execute("DELETE FROM snapshot_suppliers WHERE file_hash = ?", (tb_hash,))
+            conn.execute("DELETE FROM snapshots WHERE file_hash = ?", (tb_hash,))
+        if stale:
+            conn.execute(
+                """
+                DELETE FROM supplier_balances WHERE NOT EXISTS (
+                    SELECT 1 FROM snapshot_suppliers m
+                    WHERE m.supplier = supplier_balances.supplier
+                    AND m.digest = supplier_balances.digest
+                )
+                """
+            )
+
+
+_open_indexes = {}
+
+
+def balance_index_from_config(config):
+    """Return the SupplierBalanceIndex for config["balance_index"], or None if off.
+
+    Indexes are shared per process, so repeated runs in the same process
+    reuse the in-memory lookups.
+    """
+    index_config = config.get("balance_index", {})
+    if not index_config.get("enabled", True):
+        return None
+    key = (
+        os.path.abspath(index_config.get("path", DEFAULT_INDEX_PATH)),
+        index_config.get("max_snapshots", DEFAULT_MAX_SNAPSHOTS),
+    )
+    if key not in _open_indexes:
+        _open_indexes[key] = SupplierBalanceIndex(*key)
+    return _open_indexes[key]
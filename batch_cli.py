@@ -0,0 +1,153 @@
+"""Headless batch mode: run the proposal pipeline for many days at once.
+
+Each job is a (workings file, TB file, prefix) triple. Jobs run across a
+process pool sized to the machine's cores, and a per-job timing table is
+printed at the end.
+
+Examples:
+    python batch_cli.py --job workings_file.xlsx "Sub TB 28.05.2025.XLSX" 20250528
+    python batch_cli.py --jobs-file may_jobs.csv --workers 4
+    python batch_cli.py --glob "history/*/workings_file.xlsx" --tb-name "Sub TB.XLSX"
+    python batch_cli.py --jobs-file may_jobs.csv --formats xlsx,parquet --single-workbook
+    python batch_cli.py --job workings_file.xlsx "Sub TB 28.05.2025.XLSX" 20250528 --available-cash 250000000
+
+A jobs file is a CSV with the columns workings,tb,prefix. With --glob, every
+matching workings file is paired with --tb-name from the same folder and the
+folder name is used as the prefix.
+"""
+import argparse
+import copy
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app_config
+import proposal_engine
+
+STAGES = ["load", "filter", "duplicates", "group", "priority", "save_filtered", "save_summary", "save_deferred",
+          "save_rejected", "batches", "history"]
+
+
+def jobs_from_args(args):
+    """Collect (workings, tb, prefix) jobs from the command-line options"""
+    jobs = [tuple(job) for job in args.job or []]
+    if args.jobs_file:
+        with open(args.jobs_file, newline="") as f:
+            for row in csv.DictReader(f):
+                jobs.append((row["workings"], row["tb"], row["prefix"]))
+    if args.glob:
+        for workings in sorted(glob.glob(args.glob)):
+            folder = os.path.dirname(os.path.abspath(workings))
+            jobs.append((workings, os.path.join(folder, args.tb_name), os.path.basename(folder)))
+    return jobs
+
+
+def run_job(job, config, verbose=False):
+    """Run one job in a worker process. Returns (job, result, error)"""
+    workings, tb, prefix = job
+    config = copy.deepcopy(config)
+    config["output"]["file_prefix"] = prefix
+    # Jobs already run in parallel; a second pool per job would oversubscribe the cores
+    config.setdefault("input", {})["parallel_load"] = False
+    config["output"]["parallel_currencies"] = False
+    log = (lambda msg: print(f"[{prefix}] {msg}", flush=True)) if verbose else (lambda msg: None)
+    try:
+        result = proposal_engine.run_pipeline(workings, tb, config, log=log)
+    except Exception as e:
+        return job, None, str(e)
+    # Only the counts and timings go back to the parent process
+    for outputs in [result, *result.get("partitions", {}).values()]:
+        outputs.pop("filtered_df", None)
+        outputs.pop("grouped_df", None)
+        outputs.pop("duplicates_df", None)
+        outputs.pop("batches_df", None)
+        outputs.pop("deferred_df", None)
+    return job, result, None
+
+
+def print_table(outcomes, wall):
+    """Print the per-job timing table"""
+    header = ["prefix", "status", "rows", "kept", "groups"] + STAGES + ["total"]
+    rows = []
+    for (workings, tb, prefix), result, error in outcomes:
+        if error is not None:
+            rows.append([prefix, f"ERROR: {error}"] + [""] * (len(header) - 2))
+            continue
+        timings = result["timings"]
+        rows.append(
+            [prefix, "ok", str(result["rows_in"]), str(result["rows_filtered"]), str(result["groups"])]
+            + [f"{timings.get(stage, 0):.2f}" for stage in STAGES]
+            + [f"{result['total']:.2f}"]
+        )
+    widths = [max(len(h), *(len(r[i]) for r in rows)) if rows else len(h) for i, h in enumerate(header)]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+    busy = sum(result["total"] for _, result, error in outcomes if error is None)
+    print(f"\n{len(outcomes)} jobs, wall {wall:.2f}s, summed job time {busy:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate payment proposals for many days in parallel")
+    parser.add_argument("--job", nargs=3, action="append", metavar=("WORKINGS", "TB", "PREFIX"),
+                        help="one job; may be repeated")
+    parser.add_argument("--jobs-file", help="CSV file with columns workings,tb,prefix")
+    parser.add_argument("--glob", help="glob of workings files, one job per match")
+    parser.add_argument("--tb-name", default="Sub TB.XLSX",
+                        help="TB file name next to each --glob match (default: %(default)s)")
+    parser.add_argument("--config", default=app_config.CONFIG_PATH, help="config file (default: %(default)s)")
+    parser.add_argument("--output-folder", help="override config output.output_folder")
+    parser.add_argument("--stream", action="store_true",
+                        help="read each workings file in row chunks (config input.streaming)")
+    parser.add_argument("--formats", help="comma-separated output formats: xlsx, csv, parquet, arrow "
+                                          "(config output.formats)")
+    parser.add_argument("--single-workbook", action="store_true",
+                        help="write the xlsx outputs as sheets of one workbook (config output.single_workbook)")
+    parser.add_argument("--rejected-rows", action="store_true",
+                        help="also write every excluded row with its reasons (config output.rejected_rows)")
+    parser.add_argument("--available-cash", type=float,
+                        help="pay suppliers in priority order up to this amount (config priority.available_cash)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: number of cores)")
+    parser.add_argument("--verbose", action="store_true", help="print each job's processing log")
+    args = parser.parse_args(argv)
+
+    jobs = jobs_from_args(args)
+    if not jobs:
+        parser.error("no jobs given; use --job, --jobs-file or --glob")
+
+    config = app_config.load_config(args.config)
+    if args.output_folder:
+        config["output"]["output_folder"] = args.output_folder
+    if args.stream:
+        config.setdefault("input", {})["streaming"] = True
+    if args.formats:
+        config["output"]["formats"] = args.formats.split(",")
+    if args.single_workbook:
+        config["output"]["single_workbook"] = True
+    if args.rejected_rows:
+        config["output"]["rejected_rows"] = True
+    if args.available_cash is not None:
+        priority = config.setdefault("priority", {})
+        priority["enabled"] = True
+        priority["available_cash"] = args.available_cash
+
+    started = time.perf_counter()
+    outcomes = []
+    workers = max(1, min(args.workers, len(jobs)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, config, args.verbose) for job in jobs]
+        for future in as_completed(futures):
+            outcomes.append(future.result())
+    outcomes.sort(key=lambda outcome: jobs.index(outcome[0]))
+
+    print_table(outcomes, time.perf_counter() - started)
+    return 1 if any(error is not None for _, _, error in outcomes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
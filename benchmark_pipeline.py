@@ -0,0 +1,359 @@
+"""Benchmark the proposal pipeline stages on synthetic workbooks.
+
+generate_invoices and generate_trial_balance build frames with the same
+columns as workings_file.xlsx and the Sub TB, with value distributions and
+cardinalities taken from a real day's files. Each stage is timed on its own
+at every size and the results are written as JSON, so two runs can be
+compared to spot regressions.
+
+Examples:
+    python benchmark_pipeline.py
+    python benchmark_pipeline.py --sizes 10000 100000 2000000 --repeat 3
+    python benchmark_pipeline.py --output after.json --compare before.json
+    python benchmark_pipeline.py --sizes 10000 100000 --parse
+    python benchmark_pipeline.py --backend arrow --output arrow.json --compare benchmark_results.json
+
+--parse also writes each invoice frame to an .xlsx file and times reading it
+back, which is slow to set up; Excel caps a sheet at 1,048,576 rows, so
+larger sizes skip that stage.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+import app_config
+import proposal_engine
+from excel_writer import EXCEL_MAX_ROWS, save_with_accounting_format
+from filter_plan import normalize_text_columns
+
+DEFAULT_SIZES = [10_000, 100_000, 500_000, 2_000_000]
+
+INVOICE_COLUMNS = [
+    "Company Code", "Payment block", "Payable Status", "Payment Method", "Cheque",
+    "Net document type", "G/L Account", "G/L Account: Long Text", "Fiscal Year",
+    "Posting period", "Supplier", "Transport creditors", "Debit Balance", "Diageo",
+    "Bank account", "Name", "Document Currency Key", "Document Currency Value",
+    "WHT availability", "WHT Base amount", "WHT rate", "WHT Amount", "Payable after WHT",
+    "Net Due Date", "Due/Not", "Currency", "Posting Date", "Diageo/Tolaram",
+    "Document Date", "Document Number", "Document Type", "Reference", "Assignment",
+    "Text", "Reference.1", "Assignment.1", "Text.1", "Unnamed: 37",
+]
+
+# (G/L Account, long text, share of rows) from a real workings file
+GL_ACCOUNTS = [
+    (21110003, "TRANSPORT CREDITORS", 0.337),
+    (11260002, "IOU STAFF", 0.217),
+    (21100000, "TRADE CREDITORS-LOCAL", 0.160),
+    (21110002, "NON-TRADE CREDITORS", 0.148),
+    (21110004, "VENDORS BILLS OF EXCHANGE", 0.062),
+    (21100001, "TRADE CREDITORS-FOREIGN", 0.034),
+    (21110001, "MARKETING CREDITORS", 0.016),
+    (11261001, "ADVANCES-TRADE CREDITORS", 0.014),
+    (11260001, "IOU MANAGER", 0.008),
+    (11261002, "ADVANCES-NON TRADE CREDITORS", 0.003),
+    (21300000, "SHORT TERM LOAN", 0.001),
+]
+CURRENCIES = {"NGN": 0.927, "USD": 0.031, "GBP": 0.012, "EUR": 0.011, "UGX": 0.008,
+              "KES": 0.005, "GHS": 0.004, "TZS": 0.001, "ZAR": 0.0005, "XAF": 0.0005}
+PAYMENT_METHODS = {"T": 0.937, "S": 0.062, None: 0.001}
+PAYMENT_BLOCKS = {"B": 0.393, None: 0.391, "V": 0.138, "A": 0.074, "R": 0.004}
+DUE_NOT = {None: 0.862, "Not due": 0.082, "Due": 0.056}
+PAYABLE_STATUS = {
+    "No- Blocked for payment": 0.49, "No- these GL Not payable": 0.32, "No- Not due": 0.08,
+    "No- Forex": 0.04, "No- Debit balance": 0.02, "No- NTC vendors": 0.01, None: 0.04,
+}
+DOCUMENT_TYPES = {"RE": 0.552, "IS": 0.214, "UE": 0.192, "KR": 0.023, "KG": 0.01, "BP": 0.005,
+                  "ZP": 0.004}
+WHT_CODES = ["WHT not applicable", "PK20", "PI16", "PL22", "PL23", "PQ32", "PB03", "PN26"]
+
+
+def _choice(rng, weights, n):
+    """Draw n values from a {value: weight} dict as an object array"""
+    values = np.empty(len(weights), dtype=object)
+    values[:] = list(weights)
+    p = np.array(list(weights.values()), dtype=float)
+    return values[rng.choice(len(values), size=n, p=p / p.sum())]
+
+
+def _sparse(rng, values, share, n):
+    """Object array that is mostly NaN, with share of the rows taken from values"""
+    out = np.full(n, np.nan, dtype=object)
+    mask = rng.random(n) < share
+    out[mask] = values[rng.integers(0, len(values), mask.sum())]
+    return out
+
+
+def supplier_ids(n):
+    """Supplier keys like the real file: mostly integers, some alphanumeric"""
+    ids = np.empty(n, dtype=object)
+    ids[:] = [1_000_000 + i if i % 4 else f"NG{700_000 + i}" for i in range(n)]
+    return ids
+
+
+def generate_invoices(rows, seed=0):
+    """Return a synthetic workings_file frame with rows invoice lines"""
+    rng = np.random.default_rng(seed)
+    n_suppliers = min(max(50, rows // 15), 50_000)
+    suppliers = supplier_ids(n_suppliers)
+    names = np.array([f"SUPPLIER {i} LTD" for i in range(n_suppliers)], dtype=object)
+    # Most suppliers have a bank account on file, a few share one
+    bank_accounts = 2_000_000_000.0 + np.arange(n_suppliers) * 7919
+    bank_accounts[rng.random(n_suppliers) < 0.1] = np.nan
+
+    # A few suppliers carry most of the lines
+    weights = 1.0 / np.arange(1, n_suppliers + 1) ** 0.8
+    supplier_idx = rng.choice(n_suppliers, size=rows, p=weights / weights.sum())
+
+    gl_weights = np.array([share for _, _, share in GL_ACCOUNTS])
+    gl_idx = rng.choice(len(GL_ACCOUNTS), size=rows, p=gl_weights / gl_weights.sum())
+    gl_codes = np.array([code for code, _, _ in GL_ACCOUNTS])
+    gl_texts = np.array([text for _, text, _ in GL_ACCOUNTS], dtype=object)
+
+    amounts = -np.round(rng.lognormal(12, 2, rows), 2)
+    wht = _sparse(rng, np.round(-amounts[:1000] * 0.05, 2), 0.02, rows).astype(float)
+    posting = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 150, rows), unit="D")
+    document = posting - pd.to_timedelta(rng.integers(0, 60, rows), unit="D")
+    due = (posting + pd.to_timedelta(rng.integers(0, 90, rows), unit="D")).to_numpy(copy=True)
+    due[rng.random(rows) < 0.01] = np.datetime64("NaT")
+
+    text_pool = np.array([f"Invoice text {i}" for i in range(min(rows, 20_000))], dtype=object)
+    data = {
+        "Company Code": np.full(rows, "NG70", dtype=object),
+        "Payment block": _choice(rng, PAYMENT_BLOCKS, rows),
+        "Payable Status": _choice(rng, PAYABLE_STATUS, rows),
+        "Payment Method": _choice(rng, PAYMENT_METHODS, rows),
+        "Cheque": np.full(rows, np.nan),
+        "Net document type": np.full(rows, np.nan),
+        "G/L Account": gl_codes[gl_idx],
+        "G/L Account: Long Text": gl_texts[gl_idx],
+        "Fiscal Year": np.full(rows, 2025),
+        "Posting period": posting.month.to_numpy(),
+        "Supplier": suppliers[supplier_idx],
+        "Transport creditors": np.where(rng.random(rows) < 0.01, 6_004_266.0, np.nan),
+        "Debit Balance": _sparse(rng, names, 0.02, rows),
+        "Diageo": _sparse(rng, np.array(["NTC- VENDOR"], dtype=object), 0.01, rows),
+        "Bank account": bank_accounts[supplier_idx],
+        "Name": names[supplier_idx],
+        "Document Currency Key": None,
+        "Document Currency Value": amounts,
+        "WHT availability": _sparse(rng, np.array(WHT_CODES, dtype=object), 0.02, rows),
+        "WHT Base amount": wht,
+        "WHT rate": np.where(np.isnan(wht), np.nan, 0.0),
+        "WHT Amount": np.where(np.isnan(wht), np.nan, 0.0),
+        "Payable after WHT": np.where(rng.random(rows) < 0.02, amounts, np.nan),
+        "Net Due Date": due,
+        "Due/Not": _choice(rng, DUE_NOT, rows),
+        "Currency": _choice(rng, CURRENCIES, rows),
+        "Posting Date": posting.to_numpy(),
+        "Diageo/Tolaram": _sparse(rng, np.array(["Tolaram"] * 30 + ["Diageo"], dtype=object), 0.025, rows),
+        "Document Date": document.to_numpy(),
+        "Document Number": np.arange(1_600_000_000, 1_600_000_000 + rows),
+        "Document Type": _choice(rng, DOCUMENT_TYPES, rows),
+        "Reference": np.array([str(12_400_000 + i) for i in range(rows)], dtype=object),
+        "Assignment": _sparse(rng, np.array(["7001", "7002", "7004", "Hotel", "TAX_WHT_RECHARGE"], dtype=object), 0.62, rows),
+        "Text": text_pool[rng.integers(0, len(text_pool), rows)],
+        "Reference.1": np.full(rows, np.nan),
+        "Assignment.1": np.full(rows, np.nan),
+        "Text.1": np.full(rows, np.nan),
+        "Unnamed: 37": np.full(rows, np.nan, dtype=object),
+    }
+    data["Document Currency Key"] = data["Currency"]
+    return pd.DataFrame(data, columns=INVOICE_COLUMNS)
+
+
+def generate_trial_balance(invoice_df, seed=0):
+    """Return a synthetic Sub TB covering the suppliers in invoice_df"""
+    rng = np.random.default_rng(seed + 1)
+    suppliers = pd.unique(invoice_df["Supplier"])
+    # About a third of the TB lines belong to suppliers, the rest are GL-only lines
+    rows = len(suppliers) * 5
+    supplier = np.full(rows, np.nan, dtype=object)
+    supplier[: len(suppliers) * 2] = np.repeat(suppliers, 2).astype(str)
+    rng.shuffle(supplier)
+    debit = np.where(rng.random(rows) < 0.35, np.round(rng.lognormal(12, 2, rows), 2), 0.0)
+    credit = np.where(rng.random(rows) < 0.5, -np.round(rng.lognormal(13, 2, rows), 2), 0.0)
+    return pd.DataFrame({
+        "Company Code": "NG70",
+        "G/L Account": rng.choice([g for g, _, _ in GL_ACCOUNTS], rows).astype(float),
+        "Supplier": supplier,
+        "Vendor name": np.where(pd.isna(supplier), None, "VENDOR"),
+        "Currency": "NGN",
+        "Clsng Blns Debit": debit,
+        "Clsng Blns Credit": credit,
+        "Net Value": debit + credit,
+    })
+
+
+def write_invoice_workbook(invoice_df, path):
+    """Write invoice_df the way workings_file.xlsx is laid out (title row first)"""
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    try:
+        sheet = workbook.add_worksheet()
+        sheet.write_row(0, 0, ["Payment proposal workings"])
+        sheet.write_row(1, 0, list(invoice_df.columns))
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        columns = [invoice_df[col].tolist() for col in invoice_df.columns]
+        for row_idx, values in enumerate(zip(*columns), start=2):
+            for col_idx, value in enumerate(values):
+                if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+                    continue
+                if isinstance(value, pd.Timestamp):
+                    sheet.write_datetime(row_idx, col_idx, value.to_pydatetime(), date_format)
+                else:
+                    sheet.write(row_idx, col_idx, value)
+    finally:
+        workbook.close()
+
+
+def time_best(func, repeat):
+    """Run func repeat times; return (fastest seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def benchmark_size(rows, config, repeat=1, parse=False, workdir=".", log=print):
+    """Time every stage at one size; returns a list of result records"""
+    records = []
+
+    def record(stage, seconds, rows_in, rows_out):
+        records.append({"rows": rows, "stage": stage, "seconds": round(seconds, 4),
+                        "rows_in": rows_in, "rows_out": rows_out})
+        log(f"{rows:>10,}  {stage:<14} {seconds:8.3f}s  {rows_in:>10,} -> {rows_out:,}")
+
+    invoice_df = generate_invoices(rows)
+    supplier_df = generate_trial_balance(invoice_df)
+
+    if parse and rows < EXCEL_MAX_ROWS:
+        path = os.path.join(workdir, f"invoices_{rows}.xlsx")
+        write_invoice_workbook(invoice_df, path)
+        no_cache = dict(config, cache={"enabled": False})
+        seconds, parsed = time_best(
+            lambda: proposal_engine.read_workbook(path, no_cache, header=1, log=lambda _: None), repeat
+        )
+        record("parse", seconds, rows, len(parsed))
+
+    def normalize():
+        frame = invoice_df.copy()
+        frame.attrs.pop("text_normalized", None)
+        return normalize_text_columns(frame)
+
+    seconds, invoice_df = time_best(normalize, repeat)
+    record("normalize", seconds, rows, len(invoice_df))
+
+    seconds, suppliers = time_best(
+        lambda: proposal_engine.get_suppliers_with_balance(supplier_df, config), repeat
+    )
+    record("balance", seconds, len(supplier_df), len(suppliers))
+
+    quiet = lambda _: None
+    seconds, filtered_df = time_best(
+        lambda: proposal_engine.apply_filters(invoice_df, supplier_df, config, quiet, suppliers), repeat
+    )
+    record("filter", seconds, rows, len(filtered_df))
+
+    seconds, grouped_df = time_best(lambda: proposal_engine.apply_grouping(filtered_df, config, quiet), repeat)
+    record("group", seconds, len(filtered_df), len(grouped_df))
+
+    constant_memory = config["output"].get("constant_memory", True)
+    for stage, frame in (("save_filtered", filtered_df), ("save_summary", grouped_df)):
+        path = os.path.join(workdir, f"{stage}_{rows}.xlsx")
+        seconds, _ = time_best(
+            lambda: save_with_accounting_format(frame, path, constant_memory=constant_memory), repeat
+        )
+        record(stage, seconds, len(frame), len(frame))
+    return records
+
+
+def git_revision():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print stage timings against a baseline run; returns the regressed stages"""
+    before = {(r["rows"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'} ({baseline.get('created')}):")
+    for r in results:
+        old = before.get((r["rows"], r["stage"]))
+        if not old:
+            continue
+        ratio = r["seconds"] / old
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(r)
+        print(f"{r['rows']:>10,}  {r['stage']:<14} {old:8.3f}s -> {r['seconds']:8.3f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the proposal pipeline stages on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="invoice row counts to benchmark (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, fastest is kept")
+    parser.add_argument("--parse", action="store_true", help="also time reading the workbook from .xlsx")
+    parser.add_argument("--config", default=app_config.CONFIG_PATH, help="config file (default: %(default)s)")
+    parser.add_argument("--backend", help="compute backend to time (default: config compute.backend)")
+    parser.add_argument("--output", default="benchmark_results.json", help="results file (default: %(default)s)")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown ratio reported as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    config = copy.deepcopy(app_config.load_config(args.config))
+    if args.backend:
+        config.setdefault("compute", {})["backend"] = args.backend
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.sizes:
+            results.extend(benchmark_size(rows, config, args.repeat, args.parse, workdir))
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": config.get("compute", {}).get("backend", "pandas"),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Measure how long the GUIs take to show a window and finish loading.
+
+Each target is launched with --startup-benchmark; it reports when its window
+was drawn and when the background imports finished, then exits. Times are
+measured from the moment this script starts the process, so for the frozen
+one-file executables they include unpacking the bundle.
+
+Examples:
+    python benchmark_startup.py
+    python benchmark_startup.py --script agentic_ai.py enhanced_agentic_ai.py --eager --runs 10
+    python benchmark_startup.py --exe dist/agentic_ai.exe dist/invoice_gui.exe
+
+--eager also runs each script with --eager-imports, the old start-up order
+(import everything, then draw the window), for comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from startup import BENCHMARK_FLAG, EAGER_FLAG
+
+
+def launch(command, timeout):
+    """Start the app once; returns window, imports-ready and exit seconds"""
+    with tempfile.TemporaryDirectory() as workdir:
+        marks_path = os.path.join(workdir, "startup.json")
+        started = time.time()
+        subprocess.run(command + [BENCHMARK_FLAG, marks_path], timeout=timeout, check=True)
+        exited = time.time()
+        with open(marks_path) as f:
+            marks = json.load(f)
+    return {
+        "window_seconds": round(marks["window_shown"] - started, 4),
+        "ready_seconds": round(marks["imports_ready"] - started, 4),
+        "exit_seconds": round(exited - started, 4),
+    }
+
+
+def benchmark(name, command, runs, timeout):
+    """Launch command runs times; returns a summary record with every run"""
+    samples = [launch(command, timeout) for _ in range(runs)]
+    record = {"target": name, "command": command, "runs": samples}
+    for key in ("window_seconds", "ready_seconds", "exit_seconds"):
+        values = [sample[key] for sample in samples]
+        record[key] = {"median": round(statistics.median(values), 4), "min": min(values)}
+    print(f"{name:<40} window {record['window_seconds']['median']:6.2f}s  "
+          f"ready {record['ready_seconds']['median']:6.2f}s  (median of {runs})")
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GUI start-up time")
+    parser.add_argument("--script", nargs="+", default=["agentic_ai.py"],
+                        help="GUI scripts to run with this Python (default: %(default)s)")
+    parser.add_argument("--exe", nargs="+", default=[], help="frozen executables to run")
+    parser.add_argument("--eager", action="store_true",
+                        help="also time each script with all imports done before the window")
+    parser.add_argument("--runs", type=int, default=5, help="launches per target (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a launch is abandoned")
+    parser.add_argument("--output", default="startup_results.json", help="results file (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    targets = []
+    for script in args.script:
+        targets.append((script, [sys.executable, script]))
+        if args.eager:
+            targets.append((f"{script} {EAGER_FLAG}", [sys.executable, script, EAGER_FLAG]))
+    for exe in args.exe:
+        targets.append((exe, [os.path.abspath(exe)]))
+
+    results = [benchmark(name, command, args.runs, args.timeout) for name, command in targets]
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
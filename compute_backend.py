@@ -0,0 +1,217 @@
+"""Compute backends for the filter, group and balance steps.
+
+config["compute"]["backend"] picks one:
+
+    pandas  the pandas code in filter_plan and proposal_engine (default)
+    arrow   PyArrow compute kernels, run in-process on Arrow's thread pool
+
+The arrow backend evaluates filter rules from their declarative terms on
+Arrow arrays (dictionary-encoded columns on their dictionaries only), and
+builds groups with Arrow's multi-threaded hash aggregation. Results come
+back as row positions, so the frames it returns are cut from the pandas
+frame by pandas indexing and match the pandas backend exactly, dtypes
+included. Arrow's float sums are not compensated, so sums and means run
+pandas' compensated kernel over the group ids Arrow built; totals stay
+bit-identical, which matters for the Sub TB balance > 0 test.
+
+Anything the arrow backend cannot express (a rule without terms, a column
+Arrow cannot convert, an unsupported aggregation) runs the pandas code for
+that step.
+"""
+import numpy as np
+import pandas as pd
+
+from filter_plan import evaluate_rule, get_suppliers_with_balance
+
+BACKENDS = ("pandas", "arrow")
+
+# Aggregations the arrow backend builds itself; others fall back to pandas
+ARROW_AGGREGATIONS = {"first", "last", "count", "min", "max", "sum", "mean"}
+
+
+class PandasBackend:
+    name = "pandas"
+
+    def evaluate_rule(self, rule, invoice_df, supplier_df=None, alive=None):
+        return evaluate_rule(rule, invoice_df, supplier_df, alive)
+
+    def group(self, df, by, aggregations):
+        return df.groupby(by, as_index=False).agg(aggregations)
+
+    def suppliers_with_balance(self, supplier_df):
+        return get_suppliers_with_balance(supplier_df)
+
+
+class ArrowBackend(PandasBackend):
+    name = "arrow"
+
+    def __init__(self, threads=None):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        self.pa = pa
+        self.pc = pc
+        self.arrow_errors = (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError)
+        if threads:
+            pa.set_cpu_count(threads)
+        # Arrow copies of the columns of the frame last filtered
+        self._frame = None
+        self._arrays = {}
+
+    def array(self, df, column):
+        """df[column] as an Arrow array, converted once per frame"""
+        if df is not self._frame:
+            self._frame, self._arrays = df, {}
+        if column not in self._arrays:
+            self._arrays[column] = self.pa.array(df[column], from_pandas=True)
+        return self._arrays[column]
+
+    def term_mask(self, array, op, argument):
+        """Boolean Arrow array for one filter term; missing values never match"""
+        pa, pc = self.pa, self.pc
+        negate = op.startswith("not_")
+        op = op.removeprefix("not_")
+        if op == "notna":
+            mask = pc.is_valid(array)
+            return pc.invert(mask) if negate else mask
+        dictionary = array.dictionary if pa.types.is_dictionary(array.type) else None
+        values = array if dictionary is None else dictionary
+        if op == "equals":
+            mask = pc.equal(values, pa.scalar(argument, values.type))
+        elif op == "isin":
+            mask = pc.is_in(values, value_set=pa.array(list(argument), values.type))
+        elif op == "contains":
+            mask = pc.match_substring_regex(values, argument, ignore_case=True)
+        elif op == "equals_folded":
+            mask = pc.equal(pc.utf8_lower(pc.utf8_trim_whitespace(values)), argument)
+        else:
+            raise ValueError(f"Unknown filter term {op!r}")
+        # Negate before spreading, so a dictionary column does the work once
+        # per distinct value; missing rows pass negated terms and fail others
+        mask = pc.fill_null(mask, False)
+        if negate:
+            mask = pc.invert(mask)
+        if dictionary is not None:
+            mask = pc.fill_null(pc.take(mask, array.indices), negate)
+        elif array.null_count:
+            mask = pc.if_else(pc.is_valid(array), mask, negate)
+        return mask
+
+    def evaluate_rule(self, rule, invoice_df, supplier_df=None, alive=None):
+        if rule.terms is None:
+            return evaluate_rule(rule, invoice_df, supplier_df, alive)
+        try:
+            passed = None
+            for op, column, argument in rule.terms:
+                if callable(argument):
+                    argument = argument(supplier_df)
+                mask = self.term_mask(self.array(invoice_df, column), op, argument)
+                passed = mask if passed is None else self.pc.and_(passed, mask)
+        except self.arrow_errors:
+            # Mixed-type columns and values of the wrong type: let pandas decide
+            return evaluate_rule(rule, invoice_df, supplier_df, alive)
+        passed = passed.to_numpy(zero_copy_only=False)
+        return passed if alive is None else passed[alive]
+
+    def group_ids(self, df, by):
+        """Return (group number per row, [(codes, uniques) per key]).
+
+        Group numbers follow pandas' sorted key order; rows with a null key
+        get -1, as pandas drops them.
+        """
+        ids = np.zeros(len(df), dtype=np.int64)
+        valid = np.ones(len(df), dtype=bool)
+        keys = []
+        for column in by:
+            codes, uniques = pd.factorize(df[column], sort=True)
+            ids = ids * max(len(uniques), 1) + codes
+            valid &= codes >= 0
+            keys.append((codes, uniques))
+        return np.where(valid, ids, -1), keys
+
+    def supports(self, df, by, aggregations):
+        """True if every aggregation is one the arrow backend builds"""
+        for col, func in aggregations.items():
+            if not isinstance(func, str) or func not in ARROW_AGGREGATIONS or col in by:
+                return False
+            dtype = df[col].dtype
+            if func in ("min", "max", "sum", "mean") and (
+                not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)
+            ):
+                return False
+        return True
+
+    def group(self, df, by, aggregations):
+        if not self.supports(df, by, aggregations):
+            return super().group(df, by, aggregations)
+        pa, pc = self.pa, self.pc
+        ids, keys = self.group_ids(df, by)
+        rows = np.arange(len(df), dtype=np.int64)
+
+        # Arrow works on row numbers: the first row of each group gives its
+        # keys, and first/last/count use row numbers masked where the value
+        # is missing, so values are taken from df afterwards with their dtype
+        columns = {"id": ids, "row": rows}
+        specs = [("row", "min")]
+        arrow_func = {"first": "min", "last": "max", "count": "count", "min": "min", "max": "max"}
+        for i, (col, func) in enumerate(aggregations.items()):
+            if func in ("first", "last", "count"):
+                columns[f"c{i}"] = pa.array(rows, mask=df[col].isna().to_numpy())
+            elif func in ("min", "max"):
+                columns[f"c{i}"] = pa.array(df[col], from_pandas=True)
+            else:
+                continue
+            specs.append((f"c{i}", arrow_func[func]))
+        table = pa.table(columns).filter(pc.greater_equal(pa.array(ids), 0))
+        grouped = table.group_by("id", use_threads=True).aggregate(specs).sort_by("id")
+        group_ids = grouped["id"].to_numpy()
+
+        first_rows = grouped["row_min"].to_numpy()
+        # Keys are inferred from the distinct values the way pandas builds its result index
+        result = {
+            col: pd.Series(uniques.take(codes[first_rows]).infer_objects(), name=col)
+            for col, (codes, uniques) in zip(by, keys)
+        }
+        for i, (col, func) in enumerate(aggregations.items()):
+            if func in ("sum", "mean"):
+                # pandas' compensated kernel, grouped on the ids rather than the keys
+                totals = pd.Series(df[col].to_numpy(), copy=False).groupby(ids).agg(func)
+                result[col] = pd.Series(totals.reindex(group_ids).to_numpy(), name=col)
+                continue
+            values = grouped[f"c{i}_{arrow_func[func]}"].to_numpy(zero_copy_only=False)
+            if func == "count":
+                result[col] = pd.Series(values, name=col)
+            elif func in ("min", "max"):
+                result[col] = pd.Series(values, name=col).astype(df[col].dtype)
+            else:
+                present = ~pd.isna(values)
+                picked = df[col].iloc[np.where(present, values, 0).astype(np.int64)].reset_index(drop=True)
+                result[col] = picked if present.all() else picked.where(present)
+        return pd.DataFrame(result)
+
+    def suppliers_with_balance(self, supplier_df):
+        pc = self.pc
+        if not all(pd.api.types.is_numeric_dtype(supplier_df[col])
+                   for col in ("Clsng Blns Debit", "Clsng Blns Credit")):
+            return get_suppliers_with_balance(supplier_df)
+        debit = pc.fill_null(self.pa.array(supplier_df["Clsng Blns Debit"], from_pandas=True), 0)
+        credit = pc.fill_null(self.pa.array(supplier_df["Clsng Blns Credit"], from_pandas=True), 0)
+        net = pd.Series(pc.add(debit, credit).to_numpy(zero_copy_only=False), copy=False)
+        codes, uniques = pd.factorize(supplier_df["Supplier"], sort=True)
+        totals = net[codes >= 0].groupby(codes[codes >= 0]).sum()
+        positive = pd.Series(uniques[totals.index[totals.to_numpy() > 0]], dtype=object)
+        return positive.astype(str).str.strip().unique()
+
+
+def backend_from_config(config):
+    """Return the compute backend named by config["compute"]["backend"]"""
+    settings = config.get("compute", {})
+    name = settings.get("backend", "pandas")
+    if name == "pandas":
+        return PandasBackend()
+    if name == "arrow":
+        try:
+            return ArrowBackend(settings.get("threads"))
+        except ImportError as e:
+            raise RuntimeError("compute.backend 'arrow' needs pyarrow: pip install pyarrow") from e
+    raise ValueError(f"Unknown compute.backend {name!r}; choose one of {', '.join(BACKENDS)}")
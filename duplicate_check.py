@@ -0,0 +1,223 @@
+"""Duplicate invoice detection between filtering and grouping.
+
+The same invoice can reach a proposal twice, for example when it was posted
+under two documents or on two G/L lines. Two checks run over the filtered
+rows:
+
+    exact  rows whose duplicates.keys (default Supplier, Reference,
+           Document Currency Value and Document Date) are all equal, found
+           with one hash index over the combined key codes
+    near   rows with equal duplicates.near_keys (default Supplier and
+           Reference) whose amounts are within duplicates.amount_tolerance,
+           or relative_tolerance of the amount, of a neighbour; found by
+           sorting on the keys and amount and sweeping once
+
+Text keys are compared upper-case without spaces, punctuation or leading
+zeros, so "INV-0042" matches "inv 42". Amounts are compared in cents and
+dates by day. A row with a blank key is never matched, and a check whose
+key or amount columns the extract does not have is skipped. Apart from the one
+sort, both checks are linear in the number of rows.
+
+Matched rows are linked into numbered duplicate groups and written to the
+possible duplicates output. With duplicates.hold, every row of a group
+except the first in extract order is also held out of the proposal.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_float_dtype, is_integer_dtype
+
+DEFAULT_KEYS = ["Supplier", "Reference", "Document Currency Value", "Document Date"]
+DEFAULT_NEAR_KEYS = ["Supplier", "Reference"]
+DEFAULT_AMOUNT_COLUMN = "Document Currency Value"
+
+# Shown with the key columns in the possible duplicates output, when present
+DISPLAY_COLUMNS = [
+    "Supplier", "Name", "Document Number", "Document Type", "Document Date", "Posting Date",
+    "Reference", "Document Currency Value", "Payable after WHT", "Currency"
+]
+
+_NOT_ALPHANUMERIC = re.compile(r"[^0-9A-Z]")
+
+
+def _text_key(value):
+    """Upper-case alphanumerics without leading zeros, or None if nothing is left"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return _NOT_ALPHANUMERIC.sub("", str(value).upper()).lstrip("0") or None
+
+
+def key_codes(series):
+    """One integer code per distinct normalized value of series; -1 for blanks"""
+    if is_datetime64_any_dtype(series.dtype):
+        codes, _ = pd.factorize(series.dt.normalize())
+        return codes
+    if is_float_dtype(series.dtype):
+        # Adding 0.0 turns -0.0 into 0.0
+        cents = np.round(series.to_numpy(dtype=np.float64, na_value=np.nan) * 100) + 0.0
+        codes, _ = pd.factorize(cents)
+        return codes
+    if is_integer_dtype(series.dtype) or is_bool_dtype(series.dtype):
+        codes, _ = pd.factorize(series)
+        return codes
+    # Text, categorical or mixed values: normalize the distinct values only
+    codes, uniques = pd.factorize(series)
+    label_codes, _ = pd.factorize(pd.Series([_text_key(value) for value in uniques], dtype=object))
+    # Missing values have code -1, which picks the appended -1
+    return np.append(label_codes, -1)[codes]
+
+
+def combine_codes(code_arrays, rows):
+    """One id per distinct combination of the codes; -1 where any code is -1.
+
+    Each step packs the ids so far and the next column's codes into one
+    int64 and factorizes it, a single hash pass per key column.
+    """
+    ids = np.zeros(rows, dtype=np.int64)
+    valid = np.ones(rows, dtype=bool)
+    for codes in code_arrays:
+        valid &= codes >= 0
+        ids, _ = pd.factorize(ids * (int(codes.max(initial=-1)) + 2) + codes + 1)
+        ids = ids.astype(np.int64)
+    ids[~valid] = -1
+    return ids
+
+
+def _members(ids):
+    """True for rows whose id is shared with another row"""
+    members = np.zeros(len(ids), dtype=bool)
+    keyed = ids >= 0
+    if keyed.any():
+        members[keyed] = np.bincount(ids[keyed])[ids[keyed]] > 1
+    return members
+
+
+class DuplicateCheck:
+    def __init__(self, keys=None, near_keys=None, amount_column=DEFAULT_AMOUNT_COLUMN,
+                 amount_tolerance=1.0, relative_tolerance=0.001, hold=False):
+        self.keys = list(keys or DEFAULT_KEYS)
+        self.near_keys = list(near_keys or DEFAULT_NEAR_KEYS)
+        self.amount_column = amount_column
+        self.amount_tolerance = float(amount_tolerance or 0)
+        self.relative_tolerance = float(relative_tolerance or 0)
+        self.hold = hold
+
+    @property
+    def key_columns(self):
+        """Invoice columns the checks compare"""
+        return list(dict.fromkeys(self.keys + self.near_keys + [self.amount_column]))
+
+    @property
+    def columns(self):
+        """Invoice columns the check reads or shows"""
+        return list(dict.fromkeys(DISPLAY_COLUMNS + self.key_columns))
+
+    def missing(self, df):
+        """(exact check columns, near check columns) that df does not have"""
+        return (
+            [col for col in self.keys if col not in df.columns],
+            [col for col in self.near_keys + [self.amount_column] if col not in df.columns],
+        )
+
+    def _near_groups(self, df, codes):
+        """Sweep ids: rows chained to a neighbour within the amount tolerance share one"""
+        rows = len(df)
+        block = combine_codes([codes[col] for col in self.near_keys], rows)
+        amount = pd.to_numeric(df[self.amount_column], errors="coerce").to_numpy(dtype=np.float64)
+        candidates = np.flatnonzero((block >= 0) & ~np.isnan(amount))
+        order = candidates[np.lexsort((amount[candidates], block[candidates]))]
+        values = amount[order]
+        tolerance = np.maximum(
+            self.amount_tolerance,
+            self.relative_tolerance * np.maximum(np.abs(values[:-1]), np.abs(values[1:]))
+        )
+        linked = (block[order][1:] == block[order][:-1]) & (np.diff(values) <= tolerance)
+        ids = np.full(rows, -1, dtype=np.int64)
+        ids[order] = np.concatenate([[0], np.cumsum(~linked)])
+        return ids
+
+    def find(self, df):
+        """Per row: duplicate group number (0 for none) and "exact", "near" or None"""
+        rows = len(df)
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.empty(0, dtype=object)
+        missing_exact, missing_near = self.missing(df)
+        codes = {
+            col: key_codes(df[col]) for col in dict.fromkeys(self.keys + self.near_keys) if col in df.columns
+        }
+        no_match = np.full(rows, -1, dtype=np.int64)
+        exact = no_match if missing_exact else combine_codes([codes[col] for col in self.keys], rows)
+        near = no_match if missing_near else self._near_groups(df, codes)
+        in_exact = _members(exact)
+        in_near = _members(near)
+
+        # Link the two kinds of groups: every row takes the smallest row
+        # position reachable through either, until nothing changes
+        label = np.arange(rows)
+        while True:
+            new = label.copy()
+            for ids, members in ((exact, in_exact), (near, in_near)):
+                if not members.any():
+                    continue
+                smallest = np.full(ids.max() + 1, rows)
+                np.minimum.at(smallest, ids[members], new[members])
+                new[members] = smallest[ids[members]]
+            if (new == label).all():
+                break
+            label = new
+
+        flagged = in_exact | in_near
+        group = np.zeros(rows, dtype=np.int64)
+        # Smallest positions come first, so groups are numbered in extract order
+        group[flagged] = pd.factorize(label[flagged])[0] + 1
+        match = np.where(in_exact, "exact", np.where(in_near, "near", None)).astype(object)
+        return group, match
+
+    def report(self, df, group, match, held):
+        """The flagged rows, by group, with their group, match and held columns"""
+        rows = np.flatnonzero(group > 0)
+        rows = rows[np.argsort(group[rows], kind="stable")]
+        columns = [col for col in self.columns if col in df.columns]
+        report = df.iloc[rows][columns].reset_index(drop=True)
+        report.insert(0, "Duplicate group", group[rows])
+        report.insert(1, "Match", pd.Series(match[rows], dtype=object))
+        report.insert(2, "Held", held[rows])
+        return report
+
+    def apply(self, df, log=print):
+        """Return (the rows to propose, the possible duplicates report)"""
+        for kind, missing in zip(("Exact", "Near"), self.missing(df)):
+            if missing:
+                log(f"{kind} duplicate check skipped: the extract has no {', '.join(missing)} column")
+        group, match = self.find(df)
+        flagged = group > 0
+        held = np.zeros(len(df), dtype=bool)
+        if self.hold and flagged.any():
+            # The first row of each group, in extract order, stays in the proposal
+            positions = np.flatnonzero(flagged)
+            _, first = np.unique(group[positions], return_index=True)
+            held[positions] = True
+            held[positions[first]] = False
+        groups = int(group.max()) if len(group) else 0
+        message = f"Possible duplicates: {int(flagged.sum())} rows in {groups} groups"
+        if self.hold:
+            message += f", {int(held.sum())} held out of the proposal"
+        log(message)
+        report = self.report(df, group, match, held)
+        return (df[~held] if held.any() else df), report
+
+
+def duplicate_check_from_config(config):
+    """Return the configured DuplicateCheck, or None if it is disabled"""
+    settings = config.get("duplicates", {})
+    if not settings.get("enabled", False):
+        return None
+    return DuplicateCheck(
+        settings.get("keys"),
+        settings.get("near_keys"),
+        settings.get("amount_column", DEFAULT_AMOUNT_COLUMN),
+        settings.get("amount_tolerance", 1.0),
+        settings.get("relative_tolerance", 0.001),
+        settings.get("hold", False),
+    )
@@ -1,9 +1,30 @@
+from __future__ import annotations
+
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-import pandas as pd
 import yaml
 from datetime import datetime
 import os
+import multiprocessing
+import queue
+import threading
+import time
+
+import app_config
+import startup
+from history_panel import HistoryPanel
+from preview_grid import PreviewPanel, result_frames
+
+
+def import_engine():
+    # pandas, openpyxl and xlsxwriter come in with the processing code
+    import proposal_engine
+    return proposal_engine
+
+
+class ProcessingCancelled(Exception):
+    """Raised on the worker thread when the user cancels a run"""
+
 
 class DynamicInvoiceProcessor:
     def __init__(self, root):
@@ -16,53 +37,44 @@ class DynamicInvoiceProcessor:
         # Load or create config.yaml
         self.config = self.load_default_config()
 
+        # Worker thread state; the worker reports back through self.events
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+
         # Build the UI
         self.setup_ui()
+        self.root.after(100, self.poll_events)
+
+        # pandas and openpyxl load in the background while the user picks files
+        self.update_status("Loading libraries...")
+        self.engine_loader = startup.BackgroundLoader(import_engine, self.engine_loaded).start()
 
     def load_default_config(self):
-        default_config = {
-            "filters": {
-                "exclude_gl_texts": [
-                    "Intercompany payable",
-                    "IOU manager",
-                    "IOU staff",
-                    "Short Term loan",
-                    "Trade creditors-Foreign",
-                    "Vendors bills of exchange",
-                    "Transport Creditors"
-                ],
-                "payment_method": "T",
-                "currency": "NGN",
-                "exclude_suppliers_with_balance": True,
-                "exclude_payment_block": True,
-                "exclude_ntc_vendor": True,
-                "exclude_blank_suppliers": True,
-                "exclude_blank_bank_accounts": True,
-                "additional_exclusions": []
-            },
-            "grouping": {
-                "by": ["Supplier"],
-                "aggregations": {
-                    "Name": "first",
-                    "WHT availability": "first",
-                    "Diageo/Tolaram": "first",
-                    "Document Currency Value": "sum",
-                    "Payable after WHT": "sum"
-                }
-            },
-            "output": {
-                "output_folder": "processed_results",
-                "file_prefix": datetime.now().strftime("%Y%m%d")
-            }
-        }
-
-        if not os.path.exists("config.yaml"):
-            with open("config.yaml", "w") as f:
-                yaml.dump(default_config, f)
-            return default_config
+        return app_config.load_config(create=True)
+
+    def engine_loaded(self, error):
+        # Runs on the loader thread once the background imports finish
+        if error is not None:
+            self.log_message(f"❌ ERROR: could not load the processing libraries: {error}")
+            self.update_status("Error occurred")
         else:
-            with open("config.yaml", "r") as f:
-                return yaml.safe_load(f)
+            self.update_status("Ready")
+
+    def engine(self):
+        # The proposal_engine module, waiting for the background import if needed
+        return self.engine_loader.get()
+
+    def open_history(self):
+        # The HistoryStore needs pandas, so wait for the background imports first
+        self.engine()
+        from history_store import history_store_from_config
+        return history_store_from_config(self.config)
+
+    def currency_text(self) -> str:
+        # One code, a comma-separated list (one output pair each) or ALL
+        currency = self.config["filters"]["currency"]
+        return ", ".join(currency) if isinstance(currency, list) else currency
 
     def setup_ui(self):
         # ------------------------------
@@ -167,7 +179,7 @@ class DynamicInvoiceProcessor:
         lbl_currency = ctk.CTkLabel(config_frame, text="Currency:")
         lbl_currency.grid(row=2, column=0, sticky="e", padx=(10, 5), pady=8)
 
-        self.currency = ctk.StringVar(value=self.config["filters"]["currency"])
+        self.currency = ctk.StringVar(value=self.currency_text())
         entry_currency = ctk.CTkEntry(config_frame, textvariable=self.currency, width=80)
         entry_currency.grid(row=2, column=1, sticky="w", padx=(0, 10), pady=8)
 
@@ -270,7 +282,7 @@ class DynamicInvoiceProcessor:
         btn_frame = ctk.CTkFrame(main_frame, corner_radius=5)
         btn_frame.pack(fill="x", pady=(15, 0), padx=10)
 
-        process_btn = ctk.CTkButton(
+        self.process_btn = ctk.CTkButton(
             btn_frame,
             text="Process Files",
             fg_color="#26ba4b",
@@ -279,21 +291,44 @@ class DynamicInvoiceProcessor:
             command=self.process_files,
             height=40
         )
-        process_btn.pack(pady=10, padx=10)
+        self.process_btn.pack(side="left", pady=10, padx=10)
+
+        self.cancel_btn = ctk.CTkButton(
+            btn_frame,
+            text="Cancel",
+            fg_color="#c0392b",
+            hover_color="#a93226",
+            font=ctk.CTkFont(size=14, weight="bold"),
+            command=self.cancel_processing,
+            state="disabled",
+            height=40
+        )
+        self.cancel_btn.pack(side="left", pady=10, padx=10)
 
         # ------------------------------
         # 4) LOGGING AREA
         # ------------------------------
         section4_label = ctk.CTkLabel(
             main_frame,
-            text="4. Processing Log",
+            text="4. Processing Log & Results",
             font=ctk.CTkFont(size=16, weight="bold"),
             anchor="w"
         )
         section4_label.pack(fill="x", pady=(15, 0), padx=10)
 
-        log_frame = ctk.CTkFrame(main_frame, corner_radius=8)
-        log_frame.pack(fill="both", expand=True, pady=8, padx=10)
+        self.results_tabs = ctk.CTkTabview(main_frame, corner_radius=8)
+        self.results_tabs.pack(fill="both", expand=True, pady=8, padx=10)
+        log_frame = self.results_tabs.add("Log")
+        preview_frame = self.results_tabs.add("Results Preview")
+        history_frame = self.results_tabs.add("History")
+
+        # Virtualized grid over the last run's frames; sort and filter stay in memory
+        self.preview = PreviewPanel(preview_frame)
+        self.preview.pack(fill="both", expand=True, padx=5, pady=5)
+
+        # Past proposals from the local history store
+        self.history = HistoryPanel(history_frame, self.open_history)
+        self.history.pack(fill="both", expand=True, padx=5, pady=5)
 
         # Use CTkTextbox for a built-in dark-mode text area
         self.log_area = ctk.CTkTextbox(
@@ -339,14 +374,12 @@ class DynamicInvoiceProcessor:
             self.output_folder.set(folder_path)
 
     def log_message(self, message: str):
+        # Queued so the worker thread never touches the widgets directly
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_area.insert("end", f"[{timestamp}] {message}\n")
-        self.log_area.see("end")
-        self.root.update()
+        self.events.put(("log", f"[{timestamp}] {message}"))
 
     def update_status(self, message: str):
-        self.status_var.set(message)
-        self.root.update()
+        self.events.put(("status", message))
 
     # -------------------------------------------------
     # Validation & Config update
@@ -386,171 +419,106 @@ class DynamicInvoiceProcessor:
     # Main Processing Logic
     # -------------------------------------------------
     def process_files(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
         if not self.validate_inputs():
             return
 
+        # Read the UI variables here; the worker must not touch widgets
+        self.update_config()
+        self.cancel_event.clear()
+        self.process_btn.configure(state="disabled")
+        self.cancel_btn.configure(state="normal")
+        self.worker = threading.Thread(
+            target=self.run_pipeline,
+            args=(self.invoice_path.get(), self.supplier_path.get()),
+            daemon=True
+        )
+        self.worker.start()
+
+    def cancel_processing(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.cancel_btn.configure(state="disabled")
+            self.log_message("⏹ Cancelling...")
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise ProcessingCancelled()
+
+    def poll_events(self):
+        # Drain worker events on the Tk thread, then reschedule
+        try:
+            while True:
+                kind, payload = self.events.get_nowait()
+                if kind == "log":
+                    self.log_area.insert("end", payload + "\n")
+                    self.log_area.see("end")
+                elif kind == "status":
+                    self.status_var.set(payload)
+                elif kind == "preview":
+                    self.preview.load(payload)
+                    self.results_tabs.set("Results Preview")
+                elif kind == "done":
+                    self.finish_run()
+                    messagebox.showinfo("Success", "Files processed successfully!")
+                    # Attempt to open the output folder (Windows only; safely ignore errors elsewhere)
+                    try:
+                        os.startfile(payload)
+                    except Exception:
+                        pass
+                elif kind == "cancelled":
+                    self.finish_run()
+                elif kind == "error":
+                    self.finish_run()
+                    messagebox.showerror("Processing Error", payload)
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+
+    def finish_run(self):
+        self.process_btn.configure(state="normal")
+        self.cancel_btn.configure(state="disabled")
+
+    def run_pipeline(self, invoice_path: str, supplier_path: str):
+        # Runs on the worker thread; Cancel stops the load or the next stage
+        # and removes the files the run had written
         try:
+            if not self.engine_loader.ready():
+                self.log_message("⏳ Waiting for libraries to finish loading...")
+            engine = self.engine()
             self.update_status("Processing...")
             self.log_message("🔄 Starting invoice processing...")
-            self.update_config()
-            os.makedirs(self.config["output"]["output_folder"], exist_ok=True)
-
-            # Load invoice data
-            self.log_message("📥 Loading invoice data...")
-            invoice_df = pd.read_excel(self.invoice_path.get(), header=1)
-            invoice_df.columns = invoice_df.columns.str.strip()
-
-            # Load supplier data
-            self.log_message("📥 Loading supplier data...")
-            supplier_df = pd.read_excel(self.supplier_path.get())
-            supplier_df.columns = supplier_df.columns.str.strip()
-
-            # Apply filters
-            self.log_message("🔀 Applying filters...")
-            filtered_df = self.apply_filters(invoice_df, supplier_df)
-
-            # Group/aggregate
-            self.log_message("📊 Grouping data...")
-            grouped_df = self.apply_grouping(filtered_df)
-
-            # Prepare output paths
-            prefix = self.config["output"]["file_prefix"]
-            output_folder = self.config["output"]["output_folder"]
-            filtered_path = os.path.join(output_folder, f"{prefix}_filtered.xlsx")
-            summary_path = os.path.join(output_folder, f"{prefix}_summary.xlsx")
-
-            # Helper to save with accounting format
-            def save_with_accounting_format(df: pd.DataFrame, file_path: str):
-                with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
-                    df.to_excel(writer, index=False, sheet_name="Sheet1")
-                    workbook = writer.book
-                    worksheet = writer.sheets["Sheet1"]
-                    accounting_fmt = '_(* #,##0.00_);_(* (#,##0.00);_(* "-"??_);_(@_)'
-                    for col_name in df.select_dtypes(include=["int64", "float64"]).columns:
-                        col_idx = df.columns.get_loc(col_name) + 1
-                        for row in range(2, len(df) + 2):
-                            cell = worksheet.cell(row=row, column=col_idx)
-                            if pd.api.types.is_numeric_dtype(df[col_name]):
-                                cell.number_format = accounting_fmt
-
-            # Save filtered data
-            self.log_message(f"💾 Saving filtered data → {filtered_path}")
-            save_with_accounting_format(filtered_df, filtered_path)
-
-            # Save summary data
-            self.log_message(f"💾 Saving summary data → {summary_path}")
-            save_with_accounting_format(grouped_df, summary_path)
-
+            result = engine.run_pipeline(
+                invoice_path, supplier_path, self.config,
+                log=self.log_message, check_cancelled=self.check_cancelled
+            )
+            self.log_message(f"⏱ Stage profile saved to: {result['profile_path']}")
             self.log_message("✅ Processing completed successfully!")
             self.update_status("Ready")
-            messagebox.showinfo("Success", "Files processed successfully!")
-
-            # Attempt to open the output folder (Windows only; safely ignore errors elsewhere)
-            try:
-                os.startfile(output_folder)
-            except Exception:
-                pass
+            self.events.put(("preview", result_frames(result)))
+            self.events.put(("done", result["output_folder"]))
 
+        except ProcessingCancelled:
+            self.log_message("⏹ Processing cancelled")
+            self.update_status("Cancelled")
+            self.events.put(("cancelled", None))
         except Exception as e:
             self.log_message(f"❌ ERROR: {str(e)}")
             self.update_status("Error occurred")
-            messagebox.showerror("Processing Error", str(e))
-
-    # -------------------------------------------------
-    # Filtering & Grouping Functions
-    # -------------------------------------------------
-    def apply_filters(self, invoice_df: pd.DataFrame, supplier_df: pd.DataFrame) -> pd.DataFrame:
-        filters = self.config["filters"]
-        text_columns = [
-            "G/L Account: Long Text", "Payment Method", "Currency",
-            "Payment block", "Diageo", "Supplier", "Bank account", "Due/Not"
-        ]
-        for col in text_columns:
-            if col in invoice_df.columns:
-                invoice_df[col] = invoice_df[col].astype(str).str.strip()
-
-        # 1) Exclude GL texts
-        if filters["exclude_gl_texts"]:
-            self.log_message(f"✂ Excluding GL texts: {', '.join(filters['exclude_gl_texts'])}")
-            invoice_df = invoice_df[
-                ~invoice_df["G/L Account: Long Text"].isin(filters["exclude_gl_texts"])
-            ]
-
-        # 2) Payment method filter
-        if filters.get("payment_method"):
-            self.log_message(f"🔍 Filtering for payment method: {filters['payment_method']}")
-            invoice_df = invoice_df[invoice_df["Payment Method"] == filters["payment_method"]]
-
-        # 3) Currency filter
-        if filters.get("currency"):
-            self.log_message(f"🔍 Filtering for currency: {filters['currency']}")
-            invoice_df = invoice_df[invoice_df["Currency"] == filters["currency"]]
-
-        # 4) Exclude payment blocked items (A, B, R, V)
-        if filters.get("exclude_payment_block"):
-            self.log_message("✂ Excluding payment blocked items (A, B, R, V)")
-            invoice_df = invoice_df[~invoice_df["Payment block"].isin(["A", "B", "R", "V"])]
-
-        # 5) Exclude NTC-VENDOR
-        if filters.get("exclude_ntc_vendor"):
-            self.log_message("✂ Excluding NTC-VENDOR items")
-            invoice_df = invoice_df[
-                ~invoice_df["Diageo"].str.contains("NTC- VENDOR", case=False, na=False)
-            ]
-
-        # 6) Exclude blank suppliers
-        if filters.get("exclude_blank_suppliers"):
-            self.log_message("✂ Excluding blank suppliers")
-            invoice_df = invoice_df[
-                invoice_df["Supplier"].notna() & (invoice_df["Supplier"] != "")
-            ]
-
-        # 7) Exclude blank bank accounts
-        if filters.get("exclude_blank_bank_accounts"):
-            self.log_message("✂ Excluding blank bank accounts")
-            invoice_df = invoice_df[
-                ~invoice_df["Bank account"].isin(["", "nan", "None"]) &
-                invoice_df["Bank account"].notna()
-            ]
-
-        # 8) Additional validations: Net Due Date present & Due/Not == “due”
-        self.log_message("🔬 Applying additional validations")
-        invoice_df = invoice_df[
-            (invoice_df["Net Due Date"].notna()) &
-            (invoice_df["Due/Not"].str.strip().str.lower() == "due")
-        ]
-
-        # 9) Exclude suppliers with outstanding balance
-        if filters.get("exclude_suppliers_with_balance"):
-            self.log_message("✂ Excluding suppliers with outstanding balances")
-            suppliers_with_balance = self.get_suppliers_with_balance(supplier_df)
-            invoice_df = invoice_df[~invoice_df["Supplier"].isin(suppliers_with_balance)]
-
-        return invoice_df
-
-    def apply_grouping(self, df: pd.DataFrame) -> pd.DataFrame:
-        grouping = self.config["grouping"]
-        self.log_message(f"📑 Grouping by: {', '.join(grouping['by'])}")
-        return df.groupby(grouping["by"], as_index=False).agg(grouping["aggregations"])
-
-    def get_suppliers_with_balance(self, supplier_df: pd.DataFrame):
-        supplier_df = supplier_df[supplier_df["Supplier"].notna()].copy()
-        supplier_df["Clsng Blns Debit"] = pd.to_numeric(
-            supplier_df["Clsng Blns Debit"], errors="coerce"
-        ).fillna(0)
-        supplier_df["Clsng Blns Credit"] = pd.to_numeric(
-            supplier_df["Clsng Blns Credit"], errors="coerce"
-        ).fillna(0)
-        supplier_df["Net_value"] = (
-            supplier_df["Clsng Blns Debit"] + supplier_df["Clsng Blns Credit"]
-        )
-        grouped = supplier_df.groupby("Supplier", as_index=False)["Net_value"].sum()
-        suppliers_with_balance = grouped[grouped["Net_value"] > 0]["Supplier"]\
-            .astype(str).str.strip().unique()
-        return suppliers_with_balance
+            self.events.put(("error", str(e)))
 
 
 if __name__ == "__main__":
+    # Needed for the workbook loader's process pool in the frozen exe
+    multiprocessing.freeze_support()
+    imported_at = None
+    if startup.eager_imports():
+        import_engine()
+        imported_at = time.time()
     root = ctk.CTk()
     app = DynamicInvoiceProcessor(root)
+    benchmark = startup.benchmark_path()
+    if benchmark:
+        startup.run_startup_benchmark(root, app.engine_loader, benchmark, imported_at)
     root.mainloop()
@@ -0,0 +1,92 @@
+"""Excel output with column-level accounting number formats.
+
+Instead of setting number_format on every numeric cell through openpyxl, the
+accounting format is attached once per column with xlsxwriter. Rows are
+written in order, so the workbook can be streamed in constant_memory mode and
+write time follows the data size rather than the number of cell objects.
+SheetWriter appends a sheet chunk by chunk for the streaming pipeline.
+"""
+import math
+
+import pandas as pd
+import xlsxwriter
+
+ACCOUNTING_FORMAT = '_(* #,##0.00_);_(* (#,##0.00);_(* "-"??_);_(@_)'
+DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+# Rows per sheet, including the header row
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def _is_blank(value):
+    """True for the values pandas leaves as empty cells"""
+    if value is None or value is pd.NaT:
+        return True
+    return isinstance(value, float) and math.isnan(value)
+
+
+class SheetWriter:
+    """Append DataFrame chunks to one sheet of an open xlsxwriter workbook.
+
+    Column formats come from the dtypes of the frame given when the sheet is
+    created, so every chunk must have the same columns and dtypes. A
+    worksheet added earlier, to fix the sheet order, can be passed in
+    instead of a sheet name.
+    """
+
+    def __init__(self, workbook, df, sheet_name="Sheet1", worksheet=None):
+        self.worksheet = workbook.add_worksheet(sheet_name) if worksheet is None else worksheet
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center"})
+        accounting_format = workbook.add_format({"num_format": ACCOUNTING_FORMAT})
+        datetime_format = workbook.add_format({"num_format": DATETIME_FORMAT})
+
+        # Column formats must be set before any row is written in constant_memory mode
+        numeric_columns = set(df.select_dtypes(include=["int64", "float64"]).columns)
+        datetime_columns = set(df.select_dtypes(include=["datetime64"]).columns)
+        for col_idx, col_name in enumerate(df.columns):
+            if col_name in numeric_columns:
+                self.worksheet.set_column(col_idx, col_idx, None, accounting_format)
+            elif col_name in datetime_columns:
+                self.worksheet.set_column(col_idx, col_idx, None, datetime_format)
+
+        self.worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        self.rows = 0
+
+    def write(self, df):
+        """Write df's rows below the rows already written"""
+        worksheet = self.worksheet
+        # tolist() hands back plain Python scalars, which xlsxwriter writes directly
+        columns = [df[col].tolist() for col in df.columns]
+        for row_idx, values in enumerate(zip(*columns), start=self.rows + 1):
+            for col_idx, value in enumerate(values):
+                if _is_blank(value):
+                    continue
+                worksheet.write(row_idx, col_idx, value)
+        self.rows += len(df)
+
+
+def write_sheet(workbook, df, sheet_name="Sheet1"):
+    """Write df to a new sheet of an open xlsxwriter workbook"""
+    writer = SheetWriter(workbook, df, sheet_name)
+    writer.write(df)
+    return writer.worksheet
+
+
+def open_workbook(file_path, constant_memory=True):
+    """Open an xlsxwriter workbook with the options every output uses"""
+    options = {"constant_memory": constant_memory, "default_date_format": DATETIME_FORMAT}
+    return xlsxwriter.Workbook(file_path, options)
+
+
+def save_sheets(sheets, file_path, constant_memory=True):
+    """Save a {sheet name: DataFrame} dict as one workbook"""
+    workbook = open_workbook(file_path, constant_memory)
+    try:
+        for sheet_name, df in sheets.items():
+            write_sheet(workbook, df, sheet_name)
+    finally:
+        workbook.close()
+
+
+def save_with_accounting_format(df, file_path, sheet_name="Sheet1", constant_memory=True):
+    """Save df to file_path with the accounting format on numeric columns"""
+    save_sheets({sheet_name: df}, file_path, constant_memory=constant_memory)
@@ -0,0 +1,367 @@
+"""Compiled single-pass filter plan for apply_filters.
+
+config["filters"] is compiled once into an ordered list of rules. Applying
+the plan keeps one boolean mask over the invoice rows: each rule only looks
+at rows that are still included, cheap and selective rules run first, and
+the filtered frame is materialized once at the end. String predicates are
+evaluated on each column's distinct values and broadcast back through the
+factorized codes.
+"""
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+TEXT_COLUMNS = [
+    "G/L Account: Long Text", "Payment Method", "Currency",
+    "Payment block", "Diageo", "Supplier", "Bank account", "Due/Not"
+]
+
+# Text columns with a handful of distinct values, stored as Categorical so
+# equality and isin filters compare integer codes
+CATEGORICAL_COLUMNS = [
+    "G/L Account: Long Text", "Payment Method", "Currency",
+    "Payment block", "Diageo", "Due/Not"
+]
+
+PAYMENT_BLOCK_CODES = ["A", "B", "R", "V"]
+
+# Text a bank account cell holds when it was exported from an empty value
+BLANK_TEXTS = ["nan", "None"]
+
+# Relative cost of each rule kind; lower runs first. Equality checks on
+# Currency and Payment Method are the cheapest and usually drop most rows,
+# substring matching and the balance lookup are the most expensive.
+COST_EQUALS = 1
+COST_ISIN = 2
+COST_BLANK = 3
+COST_STRING = 4
+COST_LOOKUP = 5
+
+
+class FilterRule:
+    def __init__(self, name, description, columns, predicate, cost, reason=None, terms=None):
+        self.name = name
+        self.description = description
+        self.columns = columns
+        # predicate(frame, supplier_df) -> boolean Series, True for rows to keep
+        self.predicate = predicate
+        # The same test as (op, column, argument) terms that must all hold, for
+        # backends that do not run pandas code. ops are "equals", "isin",
+        # "contains", "equals_folded" and "notna", each optionally prefixed
+        # "not_"; missing values never match. A callable argument is called
+        # with supplier_df. None means the rule only has the pandas predicate.
+        self.terms = terms
+        self.cost = cost
+        # Short text shown in the rejected rows output
+        self.reason = reason or description
+        # Set by FilterPlan: this rule's bit in the exclusion mask
+        self.bit = 0
+
+
+def evaluate_on_uniques(series, predicate, na_value=False):
+    """Evaluate predicate on the distinct values of series, broadcast to rows.
+
+    predicate receives the distinct non-null values as an object Series and
+    returns one boolean per value; missing rows get na_value. The cost grows
+    with the column's cardinality instead of its row count.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        uniques = series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+    result = np.asarray(predicate(pd.Series(uniques, dtype=object)), dtype=bool)
+    # Missing values have code -1, which picks the appended na_value
+    lookup = np.append(result, na_value)
+    return lookup[codes]
+
+
+def evaluate_rule(rule, invoice_df, supplier_df=None, alive=None):
+    """Run rule's pandas predicate; returns one bool per row, or per alive position"""
+    frame = invoice_df[rule.columns]
+    if alive is not None and len(alive) < len(invoice_df):
+        frame = frame.iloc[alive]
+    return np.asarray(rule.predicate(frame, supplier_df), dtype=bool)
+
+
+def _profile(profiler, name, rows_in):
+    """profiler.stage(), or a stand-in record when not profiling"""
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, rows_in)
+
+
+class FilterPlan:
+    def __init__(self, rules):
+        # Exclusion mask bits follow the config order, not the run order
+        for position, rule in enumerate(rules):
+            rule.bit = 1 << position
+        self.rules_by_bit = list(rules)
+        # sorted() is stable, so rules of equal cost keep their config order
+        self.rules = sorted(rules, key=lambda rule: rule.cost)
+        self.mask_dtype = np.min_scalar_type((1 << len(rules)) - 1) if rules else np.uint8
+
+    def apply(self, invoice_df, supplier_df=None, log=print, profiler=None, backend=None):
+        """Return the rows of invoice_df that pass every rule.
+
+        With a StageProfiler, each rule is recorded as a "filter.<name>" stage.
+        backend (see compute_backend) evaluates the rules; pandas by default.
+        """
+        evaluate = evaluate_rule if backend is None else backend.evaluate_rule
+        normalize_text_columns(invoice_df)
+        keep = np.ones(len(invoice_df), dtype=bool)
+        for rule in self.rules:
+            alive = np.flatnonzero(keep)
+            if len(alive) == 0:
+                log(f"{rule.description}: skipped, no rows left")
+                continue
+            with _profile(profiler, f"filter.{rule.name}", len(alive)) as record:
+                passed = evaluate(rule, invoice_df, supplier_df, alive)
+                keep[alive[~passed]] = False
+                record["rows_out"] = int(passed.sum())
+                log(f"{rule.description}: {int((~passed).sum())} rows excluded, "
+                    f"{int(passed.sum())} remaining")
+        return invoice_df[keep]
+
+    def exclusion_mask(self, invoice_df, supplier_df=None, log=print, profiler=None, backend=None):
+        """Return an exclusion bitmask for every row of invoice_df.
+
+        Each rule is evaluated once over all rows and sets its bit where it
+        would exclude the row, so a row shows every rule it fails, not only
+        the first. A mask of 0 means the row is kept.
+        """
+        evaluate = evaluate_rule if backend is None else backend.evaluate_rule
+        normalize_text_columns(invoice_df)
+        mask = np.zeros(len(invoice_df), dtype=self.mask_dtype)
+        for rule in self.rules:
+            with _profile(profiler, f"filter.{rule.name}", len(invoice_df)) as record:
+                passed = evaluate(rule, invoice_df, supplier_df)
+                mask[~passed] |= rule.bit
+                record["rows_out"] = int(passed.sum())
+                log(f"{rule.description}: {int((~passed).sum())} rows fail this rule")
+        kept = int((mask == 0).sum())
+        log(f"{len(mask) - kept} rows excluded, {kept} remaining")
+        return mask
+
+    def decode_reasons(self, mask):
+        """Return the "; "-joined reasons for each mask value.
+
+        Only the distinct mask values are decoded; rows share the result.
+        """
+        values, inverse = np.unique(mask, return_inverse=True)
+        labels = np.array([
+            "; ".join(rule.reason for rule in self.rules_by_bit if value & rule.bit)
+            for value in values
+        ], dtype=object)
+        return labels[inverse.reshape(-1)]
+
+    def exclusion_counts(self, mask):
+        """Per-rule table of rows each rule excludes, and rows it alone excludes"""
+        return pd.DataFrame({
+            "Rule": [rule.name for rule in self.rules_by_bit],
+            "Bit": [rule.bit for rule in self.rules_by_bit],
+            "Reason": [rule.reason for rule in self.rules_by_bit],
+            "Rows excluded": [int(((mask & rule.bit) != 0).sum()) for rule in self.rules_by_bit],
+            "Only reason": [int((mask == rule.bit).sum()) for rule in self.rules_by_bit],
+        })
+
+
+def encode_categorical(series):
+    """Return series as a Categorical of stripped strings.
+
+    Stripping works on the distinct values only; blanks and missing values
+    become real nulls.
+    """
+    codes, uniques = pd.factorize(series)
+    labels = pd.Series(pd.Index(uniques).astype(str), dtype=object).str.strip()
+    labels = labels.where(labels != "")
+    # Two raw values can strip to the same label, so factorize the labels again
+    label_codes, categories = pd.factorize(labels)
+    # Missing values have code -1, which picks the appended -1
+    row_codes = np.append(label_codes, -1)[codes]
+    return pd.Series(
+        pd.Categorical.from_codes(row_codes, categories=categories),
+        index=series.index, name=series.name
+    )
+
+
+def normalize_text_columns(invoice_df):
+    """Normalize the text columns once, keeping missing values as nulls.
+
+    Low-cardinality columns become Categorical; Supplier and Bank account
+    become stripped strings. Safe to call again on a normalized frame.
+    """
+    if invoice_df.attrs.get("text_normalized"):
+        return invoice_df
+    for col in TEXT_COLUMNS:
+        if col not in invoice_df.columns:
+            continue
+        if col in CATEGORICAL_COLUMNS:
+            invoice_df[col] = encode_categorical(invoice_df[col])
+        else:
+            values = invoice_df[col]
+            stripped = values.astype(str).str.strip().astype(object)
+            invoice_df[col] = stripped.where(values.notna() & (stripped != ""))
+    invoice_df.attrs["text_normalized"] = True
+    return invoice_df
+
+
+def get_suppliers_with_balance(supplier_df):
+    """Identify suppliers where sum of (Debit + Credit) > 0"""
+    supplier_df = supplier_df[supplier_df["Supplier"].notna()].copy()
+    supplier_df["Clsng Blns Debit"] = pd.to_numeric(
+        supplier_df["Clsng Blns Debit"], errors="coerce"
+    ).fillna(0)
+    supplier_df["Clsng Blns Credit"] = pd.to_numeric(
+        supplier_df["Clsng Blns Credit"], errors="coerce"
+    ).fillna(0)
+    supplier_df["Net_value"] = supplier_df["Clsng Blns Debit"] + supplier_df["Clsng Blns Credit"]
+    grouped = supplier_df.groupby("Supplier", as_index=False)["Net_value"].sum()
+    return grouped[grouped["Net_value"] > 0]["Supplier"].astype(str).str.strip().unique()
+
+
+def _is_blank(value):
+    if isinstance(value, (list, tuple)):
+        return all(_is_blank(item) for item in value)
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def compile_filter_plan(filters, suppliers_with_balance=get_suppliers_with_balance):
+    """Compile config["filters"] into a FilterPlan.
+
+    suppliers_with_balance(supplier_df) returns the suppliers to exclude when
+    exclude_suppliers_with_balance is set.
+    """
+    rules = []
+
+    if filters.get("exclude_gl_texts"):
+        gl_texts = list(filters["exclude_gl_texts"])
+        rules.append(FilterRule(
+            "exclude_gl_texts", f"Excluding GL texts: {', '.join(gl_texts)}",
+            ["G/L Account: Long Text"],
+            lambda df, _: ~evaluate_on_uniques(
+                df["G/L Account: Long Text"], lambda values: values.isin(gl_texts)
+            ),
+            COST_ISIN,
+            "GL text excluded",
+            [("not_isin", "G/L Account: Long Text", gl_texts)],
+        ))
+
+    # A payment_method or currency key that is present filters even when it
+    # is empty; an empty value keeps the rows where that column is blank
+    if "payment_method" in filters and _is_blank(filters["payment_method"]):
+        rules.append(FilterRule(
+            "payment_method", "Filtering for a blank payment method",
+            ["Payment Method"],
+            lambda df, _: df["Payment Method"].isna(),
+            COST_BLANK,
+            "Payment method is not blank",
+            [("not_notna", "Payment Method", None)],
+        ))
+    elif "payment_method" in filters:
+        payment_method = filters["payment_method"]
+        rules.append(FilterRule(
+            "payment_method", f"Filtering for payment method: {payment_method}",
+            ["Payment Method"],
+            lambda df, _: evaluate_on_uniques(
+                df["Payment Method"], lambda values: values == payment_method
+            ),
+            COST_EQUALS,
+            f"Payment method is not {payment_method}",
+            [("equals", "Payment Method", payment_method)],
+        ))
+
+    if "currency" in filters and _is_blank(filters["currency"]):
+        rules.append(FilterRule(
+            "currency", "Filtering for a blank currency",
+            ["Currency"],
+            lambda df, _: df["Currency"].isna(),
+            COST_BLANK,
+            "Currency is not blank",
+            [("not_notna", "Currency", None)],
+        ))
+    elif "currency" in filters:
+        currency = filters["currency"]
+        rules.append(FilterRule(
+            "currency", f"Filtering for currency: {currency}",
+            ["Currency"],
+            lambda df, _: evaluate_on_uniques(df["Currency"], lambda values: values == currency),
+            COST_EQUALS,
+            f"Currency is not {currency}",
+            [("equals", "Currency", currency)],
+        ))
+
+    if filters.get("exclude_payment_block"):
+        rules.append(FilterRule(
+            "exclude_payment_block",
+            f"Excluding payment blocked items ({', '.join(PAYMENT_BLOCK_CODES)})",
+            ["Payment block"],
+            lambda df, _: ~evaluate_on_uniques(
+                df["Payment block"], lambda values: values.isin(PAYMENT_BLOCK_CODES)
+            ),
+            COST_ISIN,
+            "Payment blocked",
+            [("not_isin", "Payment block", PAYMENT_BLOCK_CODES)],
+        ))
+
+    if filters.get("exclude_ntc_vendor"):
+        rules.append(FilterRule(
+            "exclude_ntc_vendor", "Excluding NTC-VENDOR items",
+            ["Diageo"],
+            lambda df, _: ~evaluate_on_uniques(
+                df["Diageo"], lambda values: values.str.contains("NTC- VENDOR", case=False, na=False)
+            ),
+            COST_STRING,
+            "NTC vendor",
+            [("not_contains", "Diageo", "NTC- VENDOR")],
+        ))
+
+    if filters.get("exclude_blank_suppliers"):
+        rules.append(FilterRule(
+            "exclude_blank_suppliers", "Excluding blank suppliers",
+            ["Supplier"],
+            lambda df, _: df["Supplier"].notna(),
+            COST_BLANK,
+            "Blank supplier",
+            [("notna", "Supplier", None)],
+        ))
+
+    if filters.get("exclude_blank_bank_accounts"):
+        rules.append(FilterRule(
+            "exclude_blank_bank_accounts", "Excluding blank bank accounts",
+            ["Bank account"],
+            lambda df, _: df["Bank account"].notna().to_numpy() & ~evaluate_on_uniques(
+                df["Bank account"], lambda values: values.isin(BLANK_TEXTS)
+            ),
+            COST_BLANK,
+            "Blank bank account",
+            [("notna", "Bank account", None), ("not_isin", "Bank account", BLANK_TEXTS)],
+        ))
+
+    # Always applied: Net Due Date present and Due/Not == "due"
+    rules.append(FilterRule(
+        "due_validation", "Applying additional validations",
+        ["Net Due Date", "Due/Not"],
+        lambda df, _: df["Net Due Date"].notna().to_numpy() & evaluate_on_uniques(
+            df["Due/Not"], lambda values: values.str.strip().str.lower() == "due"
+        ),
+        COST_STRING,
+        "Not due",
+        [("notna", "Net Due Date", None), ("equals_folded", "Due/Not", "due")],
+    ))
+
+    if filters.get("exclude_suppliers_with_balance"):
+        rules.append(FilterRule(
+            "exclude_suppliers_with_balance", "Excluding suppliers with outstanding balances",
+            ["Supplier"],
+            # Hashed semi-join: look up each distinct supplier in the balance set once
+            lambda df, supplier_df: ~evaluate_on_uniques(
+                df["Supplier"], lambda values: values.isin(suppliers_with_balance(supplier_df))
+            ),
+            COST_LOOKUP,
+            "Supplier has an outstanding balance",
+            [("not_isin", "Supplier", suppliers_with_balance)],
+        ))
+
+    return FilterPlan(rules)
@@ -0,0 +1,117 @@
+"""History tab: query past proposals from the local history store.
+
+Search by supplier code or name, Diageo/Tolaram entity, currency and run
+date range, then show supplier totals, one row per run, or the invoice
+lines in the same virtualized grid as the results preview. Queries are
+indexed and run on the GUI thread; the store is only opened on the first
+search, once the background imports have finished.
+"""
+import time
+import tkinter as tk
+from tkinter import ttk
+
+from preview_grid import FrameView, PreviewGrid
+
+ALL_ENTITIES = "(all)"
+ALL_CURRENCIES = "(all)"
+VIEWS = ("Supplier totals", "Runs per supplier", "Invoice lines")
+
+
+class HistoryPanel(ttk.Frame):
+    def __init__(self, master, open_store, **kwargs):
+        """open_store() returns the HistoryStore, or None if history is disabled"""
+        super().__init__(master, **kwargs)
+        self.open_store = open_store
+        self.store = None
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(toolbar, text="Supplier / name:").pack(side=tk.LEFT)
+        self.search_text = tk.StringVar()
+        entry = ttk.Entry(toolbar, textvariable=self.search_text, width=20)
+        entry.pack(side=tk.LEFT, padx=(2, 10))
+        entry.bind("<Return>", lambda e: self.search())
+
+        ttk.Label(toolbar, text="Entity:").pack(side=tk.LEFT)
+        self.entity = tk.StringVar(value=ALL_ENTITIES)
+        self.entity_box = ttk.Combobox(toolbar, textvariable=self.entity, state="readonly", width=12,
+                                       values=[ALL_ENTITIES], postcommand=self.load_entities)
+        self.entity_box.pack(side=tk.LEFT, padx=(2, 10))
+
+        ttk.Label(toolbar, text="Currency:").pack(side=tk.LEFT)
+        self.currency = tk.StringVar(value=ALL_CURRENCIES)
+        self.currency_box = ttk.Combobox(toolbar, textvariable=self.currency, state="readonly", width=7,
+                                         values=[ALL_CURRENCIES], postcommand=self.load_currencies)
+        self.currency_box.pack(side=tk.LEFT, padx=(2, 10))
+
+        ttk.Label(toolbar, text="From:").pack(side=tk.LEFT)
+        self.start = tk.StringVar()
+        ttk.Entry(toolbar, textvariable=self.start, width=11).pack(side=tk.LEFT, padx=2)
+        ttk.Label(toolbar, text="To:").pack(side=tk.LEFT)
+        self.end = tk.StringVar()
+        ttk.Entry(toolbar, textvariable=self.end, width=11).pack(side=tk.LEFT, padx=(2, 10))
+
+        self.view_name = tk.StringVar(value=VIEWS[0])
+        ttk.Combobox(toolbar, textvariable=self.view_name, state="readonly", width=18,
+                     values=VIEWS).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar, text="Search", command=self.search).pack(side=tk.LEFT, padx=2)
+
+        self.status_var = tk.StringVar(value="Dates are yyyy-mm-dd; leave blank for all runs")
+        ttk.Label(self, textvariable=self.status_var).pack(fill=tk.X, pady=(0, 5))
+        self.grid_view = PreviewGrid(self)
+        self.grid_view.pack(fill=tk.BOTH, expand=True)
+
+    def get_store(self):
+        if self.store is None:
+            self.store = self.open_store()
+        return self.store
+
+    def load_entities(self):
+        try:
+            store = self.get_store()
+        except Exception:
+            return
+        entities = store.entities() if store is not None else []
+        self.entity_box.configure(values=[ALL_ENTITIES] + entities)
+
+    def load_currencies(self):
+        try:
+            store = self.get_store()
+        except Exception:
+            return
+        currencies = store.currencies() if store is not None else []
+        self.currency_box.configure(values=[ALL_CURRENCIES] + currencies)
+
+    def search(self):
+        try:
+            store = self.get_store()
+        except Exception as e:
+            self.status_var.set(f"Could not open the history: {e}")
+            return
+        if store is None:
+            self.status_var.set("History is disabled (history.enabled in config.yaml)")
+            return
+        filters = {
+            "start": self.start.get().strip() or None,
+            "end": self.end.get().strip() or None,
+            "entity": None if self.entity.get() == ALL_ENTITIES else self.entity.get(),
+            "search": self.search_text.get().strip() or None,
+            "currency": None if self.currency.get() == ALL_CURRENCIES else self.currency.get(),
+        }
+        query = {
+            "Supplier totals": store.supplier_totals,
+            "Runs per supplier": store.supplier_history,
+            "Invoice lines": store.invoice_lines,
+        }[self.view_name.get()]
+        started = time.perf_counter()
+        try:
+            df = query(**filters)
+        except Exception as e:
+            self.status_var.set(f"Query failed: {e}")
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        self.grid_view.show(FrameView(df))
+        # Amounts in different currencies are never added together
+        payable = df.groupby("Currency", dropna=False)["Payable after WHT"].sum() if len(df) else {}
+        totals = ", ".join(f"{currency} {amount:,.2f}" for currency, amount in payable.items()) or "0.00"
+        self.status_var.set(f"{len(df):,} rows, payable after WHT {totals} ({elapsed:.0f} ms)")
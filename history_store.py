@@ -0,0 +1,500 @@
+"""Local SQLite history of every generated proposal.
+
+Each run's filtered invoice lines and grouped supplier rows are bulk-inserted
+under the run date, which is taken from the file prefix (yyyymmdd) or the
+day the run happened. Both tables are indexed by run date, Supplier and
+Diageo/Tolaram, so "how much did we propose to supplier X last quarter" is
+one indexed query instead of opening dozens of workbooks. Supplier rows are
+also rolled up per month, so totals over a quarter or a year read a dozen
+rows per supplier rather than one per run. Totals are always per currency:
+each currency of a run is recorded as its own run and never added to
+another.
+
+Re-running a prefix replaces its earlier rows, so totals never count a day
+twice.
+
+Examples:
+    python history_store.py import 20250529_filtered.xlsx 20250603_filtered.xlsx
+    python history_store.py totals --since 2025-03-01 --entity Diageo --currency NGN
+    python history_store.py supplier 1000123 --since 2025-03-01 --until 2025-05-31
+    python history_store.py lines 1000123 --since 2025-05-01
+"""
+import argparse
+import contextlib
+import glob
+import os
+import re
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import app_config
+
+DEFAULT_HISTORY_PATH = "proposal_history.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_date TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    invoice_file TEXT,
+    supplier_file TEXT,
+    recorded_at TEXT NOT NULL,
+    lines INTEGER NOT NULL,
+    suppliers INTEGER NOT NULL,
+    UNIQUE (prefix, currency)
+);
+CREATE TABLE IF NOT EXISTS proposal_suppliers (
+    run_id INTEGER NOT NULL,
+    run_date TEXT NOT NULL,
+    supplier TEXT NOT NULL,
+    name TEXT,
+    entity TEXT,
+    currency TEXT,
+    document_value REAL,
+    payable REAL
+);
+CREATE TABLE IF NOT EXISTS proposal_lines (
+    run_id INTEGER NOT NULL,
+    run_date TEXT NOT NULL,
+    supplier TEXT NOT NULL,
+    name TEXT,
+    entity TEXT,
+    currency TEXT,
+    document_number TEXT,
+    reference TEXT,
+    net_due_date TEXT,
+    document_value REAL,
+    payable REAL
+);
+-- proposal_suppliers rolled up per calendar month (yyyy-mm), rebuilt for
+-- the months a run touches; date-range totals read whole months from here
+CREATE TABLE IF NOT EXISTS supplier_months (
+    month TEXT NOT NULL,
+    supplier TEXT NOT NULL,
+    name TEXT,
+    entity TEXT,
+    currency TEXT,
+    runs INTEGER NOT NULL,
+    first_run TEXT NOT NULL,
+    last_run TEXT NOT NULL,
+    document_value REAL,
+    payable REAL
+);
+CREATE INDEX IF NOT EXISTS months_month ON supplier_months (month);
+CREATE INDEX IF NOT EXISTS months_supplier ON supplier_months (supplier, month);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (run_date);
+CREATE INDEX IF NOT EXISTS suppliers_supplier_date ON proposal_suppliers (supplier, run_date);
+CREATE INDEX IF NOT EXISTS suppliers_entity_date ON proposal_suppliers (entity, run_date);
+CREATE INDEX IF NOT EXISTS suppliers_date ON proposal_suppliers (run_date);
+CREATE INDEX IF NOT EXISTS suppliers_run ON proposal_suppliers (run_id);
+CREATE INDEX IF NOT EXISTS lines_supplier_date ON proposal_lines (supplier, run_date);
+CREATE INDEX IF NOT EXISTS lines_entity_date ON proposal_lines (entity, run_date);
+CREATE INDEX IF NOT EXISTS lines_run ON proposal_lines (run_id);
+"""
+
+# Table column -> proposal column; columns a run does not have are stored as NULL
+SUPPLIER_COLUMNS = {
+    "supplier": "Supplier",
+    "name": "Name",
+    "entity": "Diageo/Tolaram",
+    "currency": "Currency",
+    "document_value": "Document Currency Value",
+    "payable": "Payable after WHT",
+}
+LINE_COLUMNS = {
+    "supplier": "Supplier",
+    "name": "Name",
+    "entity": "Diageo/Tolaram",
+    "currency": "Currency",
+    "document_number": "Document Number",
+    "reference": "Reference",
+    "net_due_date": "Net Due Date",
+    "document_value": "Document Currency Value",
+    "payable": "Payable after WHT",
+}
+TEXT_COLUMNS = {"supplier", "name", "entity", "currency", "document_number", "reference"}
+AMOUNT_COLUMNS = {"document_value", "payable"}
+
+
+def run_date_for(prefix, today=None):
+    """Run date (yyyy-mm-dd) from a yyyymmdd file prefix, else today"""
+    match = re.match(r"(\d{4})(\d{2})(\d{2})", prefix)
+    if match:
+        try:
+            return date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            pass
+    return (today or date.today()).isoformat()
+
+
+def month_end(month):
+    """Last day (yyyy-mm-dd) of a yyyy-mm month"""
+    year, number = map(int, month.split("-"))
+    return (date(year + number // 12, number % 12 + 1, 1) - timedelta(days=1)).isoformat()
+
+
+def next_month(month):
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def previous_month(month):
+    year, number = map(int, month.split("-"))
+    return f"{year - (number == 1):04d}-{(number - 2) % 12 + 1:02d}"
+
+
+def history_rows(df, columns, run_id, run_date, currency):
+    """Rows of df as tuples for executemany, in (run_id, run_date, *columns) order"""
+    frame = pd.DataFrame(index=range(len(df)))
+    for target, source in columns.items():
+        values = df[source].reset_index(drop=True) if source in df.columns else pd.Series([None] * len(df))
+        if target in TEXT_COLUMNS:
+            text = values.astype(str).str.strip()
+            values = text.where(values.notna() & (text != ""))
+        elif target in AMOUNT_COLUMNS:
+            values = pd.to_numeric(values, errors="coerce")
+        elif target == "net_due_date":
+            values = pd.to_datetime(values, errors="coerce").dt.strftime("%Y-%m-%d")
+        frame[target] = values.astype(object).where(values.notna(), None)
+    if currency:
+        frame["currency"] = frame["currency"].where(frame["currency"].notna(), currency)
+    # Blank suppliers never reach a proposal, but keep the NOT NULL column safe
+    frame = frame[frame["supplier"].notna()]
+    frame.insert(0, "run_date", run_date)
+    frame.insert(0, "run_id", run_id)
+    return frame.itertuples(index=False, name=None)
+
+
+class HistoryStore:
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets the GUI query while a batch run is writing
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._upgrade(conn)
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection that commits on success, rolls back on error and is always closed"""
+        # Batch workers may record runs at once; wait for the lock
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _upgrade(self, conn):
+        """Rebuild a supplier_months table from before it was split by currency"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(supplier_months)")]
+        if not columns or "currency" in columns:
+            return
+        conn.execute("DROP TABLE supplier_months")
+        conn.executescript(SCHEMA)
+        months = conn.execute("SELECT DISTINCT substr(run_date, 1, 7) FROM proposal_suppliers").fetchall()
+        self._refresh_months(conn, {month for (month,) in months})
+
+    def record_run(self, prefix, filtered_df, grouped_df, currency=None,
+                   invoice_file=None, supplier_file=None, run_date=None, lines=None):
+        """Store one run's filtered lines and supplier rows; returns the run id.
+
+        An earlier run with the same prefix and currency is replaced.
+        filtered_df may be None (streaming runs keep no filtered frame); only
+        the supplier rows are stored then, and lines gives the line count.
+        """
+        run_date = run_date or run_date_for(prefix)
+        currency = currency or ""
+        with self._connect() as conn:
+            months = self._delete_runs(conn, "prefix = ? AND currency = ?", (prefix, currency))
+            run_id = conn.execute(
+                """
+                INSERT INTO runs (run_date, prefix, currency, invoice_file, supplier_file,
+                                  recorded_at, lines, suppliers)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (run_date, prefix, currency, invoice_file, supplier_file,
+                 datetime.now().isoformat(timespec="seconds"),
+                 len(filtered_df) if filtered_df is not None else lines or 0, len(grouped_df))
+            ).lastrowid
+            conn.executemany(
+                f"INSERT INTO proposal_suppliers (run_id, run_date, {', '.join(SUPPLIER_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(SUPPLIER_COLUMNS) + 2))})",
+                history_rows(grouped_df, SUPPLIER_COLUMNS, run_id, run_date, currency)
+            )
+            if filtered_df is not None:
+                conn.executemany(
+                    f"INSERT INTO proposal_lines (run_id, run_date, {', '.join(LINE_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(LINE_COLUMNS) + 2))})",
+                    history_rows(filtered_df, LINE_COLUMNS, run_id, run_date, currency)
+                )
+            self._refresh_months(conn, months | {run_date[:7]})
+        return run_id
+
+    def _delete_runs(self, conn, where, params):
+        """Delete the matching runs; returns the months (yyyy-mm) they were in"""
+        rows = conn.execute(f"SELECT run_id, run_date FROM runs WHERE {where}", params).fetchall()
+        run_ids = [(run_id,) for run_id, _ in rows]
+        conn.executemany("DELETE FROM proposal_lines WHERE run_id = ?", run_ids)
+        conn.executemany("DELETE FROM proposal_suppliers WHERE run_id = ?", run_ids)
+        conn.executemany("DELETE FROM runs WHERE run_id = ?", run_ids)
+        return {run_date[:7] for _, run_date in rows}
+
+    @staticmethod
+    def _refresh_months(conn, months):
+        """Rebuild the supplier_months rows of the given months"""
+        for month in months:
+            conn.execute("DELETE FROM supplier_months WHERE month = ?", (month,))
+            conn.execute(
+                """
+                INSERT INTO supplier_months
+                SELECT ?, supplier, MAX(name), entity, currency, COUNT(DISTINCT run_id),
+                       MIN(run_date), MAX(run_date), SUM(document_value), SUM(payable)
+                FROM proposal_suppliers
+                WHERE run_date >= ? AND run_date < ?
+                GROUP BY supplier, entity, currency
+                """,
+                (month, f"{month}-01", f"{month}-32")
+            )
+
+    def _monthly(self, start=None, end=None, supplier=None, entity=None, search=None, currency=None):
+        """SQL and parameters for per-supplier rows covering start..end.
+
+        Months wholly inside the range come from supplier_months; days of a
+        partly covered first or last month are summed from proposal_suppliers.
+        """
+        start, end = start and str(start), end and str(end)
+        first_month = last_month = None
+        if start:
+            first_month = start[:7] if start.endswith("-01") else next_month(start[:7])
+        if end:
+            last_month = end[:7] if end == month_end(end[:7]) else previous_month(end[:7])
+        edges = []
+        if start and start < f"{first_month}-01":
+            edges.append(("run_date < ?", f"{first_month}-01"))
+        if end and end > month_end(last_month):
+            edges.append(("run_date > ?", month_end(last_month)))
+
+        where, params = self._where(supplier=supplier, entity=entity, search=search, currency=currency)
+        parts, part_params = [], []
+        if not (first_month and last_month and first_month > last_month):
+            month_clauses = [where[len(" WHERE "):]] if where else []
+            month_params = list(params)
+            for clause, value in (("month >= ?", first_month), ("month <= ?", last_month)):
+                if value:
+                    month_clauses.append(clause)
+                    month_params.append(value)
+            month_where = (" WHERE " + " AND ".join(month_clauses)) if month_clauses else ""
+            parts.append(
+                "SELECT supplier, name, entity, currency, runs, first_run, last_run, document_value, payable "
+                f"FROM supplier_months{month_where}"
+            )
+            part_params += month_params
+        else:
+            # No whole month in the range: every day is an edge day
+            edges = [("1", None)]
+        if edges:
+            day_where, day_params = self._where(start, end, supplier, entity, search, currency)
+            day_where += (" AND " if day_where else " WHERE ") + \
+                "(" + " OR ".join(clause for clause, _ in edges) + ")"
+            parts.append(
+                "SELECT supplier, MAX(name) AS name, entity, currency, COUNT(DISTINCT run_id) AS runs, "
+                "MIN(run_date) AS first_run, MAX(run_date) AS last_run, "
+                "SUM(document_value) AS document_value, SUM(payable) AS payable "
+                f"FROM proposal_suppliers{day_where} GROUP BY supplier, entity, currency"
+            )
+            part_params += day_params + [value for _, value in edges if value is not None]
+        return " UNION ALL ".join(parts), part_params
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    @staticmethod
+    def _where(start=None, end=None, supplier=None, entity=None, search=None, currency=None):
+        """SQL WHERE clause and parameters for the common query filters.
+
+        start and end are inclusive yyyy-mm-dd dates; search matches the
+        supplier code or name, ignoring case.
+        """
+        clauses, params = [], []
+        if supplier:
+            clauses.append("supplier = ?")
+            params.append(str(supplier).strip())
+        if entity:
+            clauses.append("entity = ?")
+            params.append(entity)
+        if currency:
+            clauses.append("currency = ?")
+            params.append(currency)
+        if start:
+            clauses.append("run_date >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("run_date <= ?")
+            params.append(str(end))
+        if search:
+            clauses.append("(supplier LIKE ? OR name LIKE ?)")
+            params.extend([f"%{search.strip()}%"] * 2)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def supplier_totals(self, start=None, end=None, supplier=None, entity=None, search=None, currency=None):
+        """Proposed totals per supplier, entity and currency, largest payable first"""
+        rows, params = self._monthly(start, end, supplier, entity, search, currency)
+        # Payables are credits, so the largest is the most negative
+        return self._query(
+            f"""
+            SELECT supplier AS Supplier, MAX(name) AS Name, entity AS "Diageo/Tolaram",
+                   currency AS Currency,
+                   SUM(runs) AS Runs, MIN(first_run) AS "First run", MAX(last_run) AS "Last run",
+                   SUM(document_value) AS "Document Currency Value",
+                   SUM(payable) AS "Payable after WHT"
+            FROM ({rows})
+            GROUP BY supplier, entity, currency
+            ORDER BY currency, "Payable after WHT"
+            """,
+            params
+        )
+
+    def supplier_history(self, supplier=None, start=None, end=None, entity=None, search=None, currency=None):
+        """One row per run and supplier, oldest run first"""
+        where, params = self._where(start, end, supplier, entity, search, currency)
+        return self._query(
+            f"""
+            SELECT run_date AS "Run date", supplier AS Supplier, name AS Name,
+                   entity AS "Diageo/Tolaram", currency AS Currency,
+                   document_value AS "Document Currency Value", payable AS "Payable after WHT"
+            FROM proposal_suppliers{where}
+            ORDER BY run_date, supplier
+            """,
+            params
+        )
+
+    def invoice_lines(self, supplier=None, start=None, end=None, entity=None, search=None, currency=None):
+        """Proposed invoice lines, oldest run first"""
+        where, params = self._where(start, end, supplier, entity, search, currency)
+        return self._query(
+            f"""
+            SELECT run_date AS "Run date", supplier AS Supplier, name AS Name,
+                   entity AS "Diageo/Tolaram", currency AS Currency,
+                   document_number AS "Document Number", reference AS Reference,
+                   net_due_date AS "Net Due Date",
+                   document_value AS "Document Currency Value", payable AS "Payable after WHT"
+            FROM proposal_lines{where}
+            ORDER BY run_date, supplier
+            """,
+            params
+        )
+
+    def entity_totals(self, start=None, end=None, currency=None):
+        """Proposed totals per Diageo/Tolaram entity and currency, largest payable first"""
+        rows, params = self._monthly(start, end, currency=currency)
+        return self._query(
+            f"""
+            SELECT entity AS "Diageo/Tolaram", currency AS Currency,
+                   COUNT(DISTINCT supplier) AS Suppliers,
+                   SUM(runs) AS "Supplier runs",
+                   SUM(document_value) AS "Document Currency Value",
+                   SUM(payable) AS "Payable after WHT"
+            FROM ({rows})
+            GROUP BY entity, currency
+            ORDER BY currency, "Payable after WHT"
+            """,
+            params
+        )
+
+    def runs(self, start=None, end=None):
+        """Recorded runs, newest first"""
+        where, params = self._where(start, end)
+        return self._query(f"SELECT * FROM runs{where} ORDER BY run_date DESC, prefix", params)
+
+    def entities(self):
+        """Distinct Diageo/Tolaram values seen so far"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT entity FROM proposal_suppliers WHERE entity IS NOT NULL ORDER BY entity"
+            )
+            return [entity for (entity,) in rows]
+
+    def currencies(self):
+        """Distinct currencies seen so far"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT currency FROM proposal_suppliers WHERE currency IS NOT NULL ORDER BY currency"
+            )
+            return [currency for (currency,) in rows]
+
+    def import_outputs(self, filtered_path):
+        """Record an existing {prefix}_filtered.xlsx and its summary workbook"""
+        folder, name = os.path.split(filtered_path)
+        prefix = name[:-len("_filtered.xlsx")]
+        summary_path = os.path.join(folder, f"{prefix}_summary.xlsx")
+        filtered_df = pd.read_excel(filtered_path)
+        grouped_df = pd.read_excel(summary_path) if os.path.exists(summary_path) else pd.DataFrame()
+        currencies = filtered_df["Currency"].dropna().astype(str).unique() if "Currency" in filtered_df else []
+        currency = currencies[0] if len(currencies) == 1 else None
+        return self.record_run(prefix, filtered_df, grouped_df, currency=currency,
+                               invoice_file=os.path.basename(filtered_path))
+
+
+def history_store_from_config(config):
+    """Return the HistoryStore for config["history"], or None if disabled"""
+    history_config = config.get("history", {})
+    if not history_config.get("enabled", True):
+        return None
+    return HistoryStore(history_config.get("path", DEFAULT_HISTORY_PATH))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or fill the proposal history")
+    parser.add_argument("--config", default=app_config.CONFIG_PATH, help="config file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    imports = commands.add_parser("import", help="record existing *_filtered.xlsx outputs")
+    imports.add_argument("paths", nargs="+", help="filtered workbooks or glob patterns")
+    for name, help_text in (("totals", "totals per supplier"), ("entities", "totals per Diageo/Tolaram"),
+                            ("supplier", "one supplier's runs"), ("lines", "one supplier's invoice lines"),
+                            ("runs", "recorded runs")):
+        command = commands.add_parser(name, help=help_text)
+        if name in ("supplier", "lines"):
+            command.add_argument("supplier", help="supplier code")
+        command.add_argument("--since", help="first run date, yyyy-mm-dd")
+        command.add_argument("--until", help="last run date, yyyy-mm-dd")
+        if name in ("totals", "supplier", "lines"):
+            command.add_argument("--entity", help="Diageo/Tolaram value")
+        if name != "runs":
+            command.add_argument("--currency", help="currency code")
+    args = parser.parse_args(argv)
+
+    config = app_config.load_config(args.config)
+    store = HistoryStore(config.get("history", {}).get("path", DEFAULT_HISTORY_PATH))
+    if args.command == "import":
+        paths = [path for pattern in args.paths for path in sorted(glob.glob(pattern))]
+        for path in paths:
+            run_id = store.import_outputs(path)
+            print(f"Recorded {path} as run {run_id}")
+        return 0
+
+    if args.command == "totals":
+        frame = store.supplier_totals(args.since, args.until, entity=args.entity, currency=args.currency)
+    elif args.command == "entities":
+        frame = store.entity_totals(args.since, args.until, args.currency)
+    elif args.command == "supplier":
+        frame = store.supplier_history(args.supplier, args.since, args.until, args.entity, currency=args.currency)
+    elif args.command == "lines":
+        frame = store.invoice_lines(args.supplier, args.since, args.until, args.entity, currency=args.currency)
+    else:
+        frame = store.runs(args.since, args.until)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(frame.to_string(index=False) if len(frame) else "No matching history")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,20 @@
-import pandas as pd
+import time
 from tkinter import Tk, Label, Button, filedialog, messagebox
 import os
 
+from startup import BackgroundLoader, benchmark_path, eager_imports, run_startup_benchmark
+
+def import_pandas():
+    # Loaded in the background after the window is drawn
+    import pandas
+    # Deliberate preload: to_excel imports openpyxl on first save, so import
+    # it here, off the GUI thread, instead of when the user clicks Process
+    import openpyxl  # noqa: F401
+    return pandas
+
 def process_file(file_path):
     try:
+        pd = pandas_loader.get()
         # Load the Excel file
         df = pd.read_excel(file_path, header=1)
         df.columns = df.columns.str.strip()
@@ -58,6 +69,10 @@ def upload_file():
         process_file(file_path)
 
 # GUI setup
+imported_at = None
+if eager_imports():
+    import_pandas()
+    imported_at = time.time()
 root = Tk()
 root.title("Invoice Filter and Summary Tool")
 root.geometry("400x200")
@@ -66,5 +81,9 @@ Label(root, text="Upload your workings_file.xlsx", font=("Arial", 12)).pack(pady
 Button(root, text="Choose File", command=upload_file, font=("Arial", 12)).pack()
 Button(root, text="Exit", command=root.quit, font=("Arial", 12)).pack(pady=10)
 
+pandas_loader = BackgroundLoader(import_pandas).start()
+if benchmark_path():
+    run_startup_benchmark(root, pandas_loader, benchmark_path(), imported_at)
+
 root.mainloop()
 # https://convertico.com/
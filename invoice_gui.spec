@@ -10,7 +10,8 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Optional pandas extras the app never uses; they only slow unpacking
+    excludes=['matplotlib', 'scipy', 'IPython', 'pytest'],
     noarchive=False,
     optimize=0,
 )
@@ -26,7 +27,8 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # UPX-packed DLLs have to be decompressed on every launch
+    upx=False,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=False,
@@ -0,0 +1,248 @@
+"""Proposal outputs in the formats listed in config["output"]["formats"].
+
+    xlsx     workbooks with the accounting number format (default)
+    csv      one CSV file per table
+    parquet  one Parquet file per table (needs pyarrow)
+    arrow    one Arrow IPC file per table (needs pyarrow)
+
+A run writes up to six tables: the filtered rows, the supplier summary,
+the deferred suppliers, the possible duplicates, the rejected rows and the
+per-rule exclusion counts. The xlsx tables go to the {prefix}_filtered,
+_summary, _deferred, _duplicates and _rejected workbooks, or with
+output.single_workbook to the sheets of one {prefix}_proposal.xlsx. The
+other formats write {prefix}_{table}.{ext} files, with text and categorical
+columns as strings, so machine consumers never have to parse a workbook.
+
+Every table is opened once and appended to, so the streaming pipeline
+writes all of its outputs in the same pass over the extract.
+"""
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+from duplicate_check import duplicate_check_from_config
+from excel_writer import EXCEL_MAX_ROWS, SheetWriter, open_workbook
+from payment_priority import prioritizer_from_config
+
+FORMATS = ("xlsx", "csv", "parquet", "arrow")
+
+# table -> (sheet name in the single workbook, file name suffix)
+TABLES = {
+    "summary": ("Summary", "summary"),
+    "deferred": ("Deferred", "deferred"),
+    "duplicates": ("Possible duplicates", "duplicates"),
+    "filtered": ("Filtered", "filtered"),
+    "rejected": ("Rejected rows", "rejected"),
+    "counts": ("Exclusion counts", "exclusion_counts"),
+}
+
+TEXT_DTYPE = pd.StringDtype(na_value=np.nan)
+
+
+def output_formats(config):
+    """The output.formats list, checked; a comma-separated string also works"""
+    formats = config["output"].get("formats") or ["xlsx"]
+    if isinstance(formats, str):
+        formats = formats.split(",")
+    formats = list(dict.fromkeys(str(fmt).strip().lower() for fmt in formats if str(fmt).strip()))
+    unknown = [fmt for fmt in formats if fmt not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output.formats {', '.join(unknown)}; choose from {', '.join(FORMATS)}")
+    return formats or ["xlsx"]
+
+
+def workbook_layout(config, tables):
+    """table -> (workbook path, sheet name) for the xlsx outputs"""
+    output = config["output"]
+    prefix = output["file_prefix"]
+    folder = output["output_folder"]
+    if output.get("single_workbook", False):
+        path = os.path.join(folder, f"{prefix}_proposal.xlsx")
+        return {table: (path, TABLES[table][0]) for table in tables}
+    rejected = os.path.join(folder, f"{prefix}_rejected.xlsx")
+    layout = {
+        "summary": (os.path.join(folder, f"{prefix}_summary.xlsx"), "Sheet1"),
+        "deferred": (os.path.join(folder, f"{prefix}_deferred.xlsx"), "Deferred"),
+        "duplicates": (os.path.join(folder, f"{prefix}_duplicates.xlsx"), "Possible duplicates"),
+        "filtered": (os.path.join(folder, f"{prefix}_filtered.xlsx"), "Sheet1"),
+        "rejected": (rejected, "Rejected rows"),
+        "counts": (rejected, "Exclusion counts"),
+    }
+    return {table: layout[table] for table in tables}
+
+
+def _text_columns(df):
+    """df with object and categorical columns as strings, which Arrow can type"""
+    converted = {
+        col: df[col].astype(object).astype(TEXT_DTYPE)
+        for col in df.columns
+        if df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype)
+    }
+    return df.assign(**converted) if converted else df
+
+
+class _CsvTable:
+    def __init__(self, path, template):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        template.iloc[:0].to_csv(self.file, index=False)
+
+    def write(self, df):
+        df.to_csv(self.file, index=False, header=False)
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowTable:
+    def __init__(self, path, template, fmt):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = pa.Schema.from_pandas(_text_columns(template.iloc[:0]), preserve_index=False)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, df):
+        if len(df):
+            table = self.pa.Table.from_pandas(_text_columns(df), schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+class _SheetTable:
+    """One table as a sheet, continued in a CSV once the sheet is full"""
+
+    def __init__(self, workbook, template, worksheet, overflow_path, log):
+        self.sheet = SheetWriter(workbook, template, worksheet=worksheet)
+        self.overflow_path = overflow_path
+        self.overflow = None
+        self.log = log
+
+    def write(self, df):
+        if self.overflow is None and self.sheet.rows + len(df) < EXCEL_MAX_ROWS:
+            self.sheet.write(df)
+            return
+        if self.overflow is None:
+            self.log(f"Rows past the Excel sheet limit go to {self.overflow_path}")
+            self.overflow = _CsvTable(self.overflow_path, df)
+        self.overflow.write(df)
+
+    def close(self):
+        if self.overflow is not None:
+            self.overflow.close()
+
+
+class ProposalWriter:
+    """The output tables of one run, in every configured format.
+
+    write(table, df) appends rows, opening the table with df's columns on
+    the first call; open(table, template) opens a table that may get no
+    rows. finish(table) closes the table's files, and a workbook once all
+    of its tables are finished.
+    """
+
+    def __init__(self, config, log=print):
+        output = config["output"]
+        self.formats = output_formats(config)
+        if ("parquet" in self.formats or "arrow" in self.formats) and importlib.util.find_spec("pyarrow") is None:
+            raise RuntimeError("output.formats parquet and arrow need pyarrow: pip install pyarrow")
+        self.log = log
+        self.constant_memory = output.get("constant_memory", True)
+        tables = ["summary", "filtered"]
+        if duplicate_check_from_config(config) is not None:
+            tables.insert(1, "duplicates")
+        if prioritizer_from_config(config) is not None:
+            tables.insert(1, "deferred")
+        if output.get("rejected_rows", False):
+            tables += ["rejected", "counts"]
+        self.layout = workbook_layout(config, tables) if "xlsx" in self.formats else {}
+        self.stems = {
+            table: os.path.join(output["output_folder"], f"{output['file_prefix']}_{TABLES[table][1]}")
+            for table in tables
+        }
+        self.paths = {
+            table: [self.layout[table][0] if fmt == "xlsx" else f"{stem}.{fmt}" for fmt in self.formats]
+            for table, stem in self.stems.items()
+        }
+        self.workbooks = {}
+        self.worksheets = {}
+        self.tables = {}
+        self.finished = set()
+
+    def describe(self, table):
+        """The files table goes to, for log messages"""
+        return ", ".join(self.paths[table])
+
+    def written_paths(self):
+        """Every file of the tables opened so far, each once"""
+        return list(dict.fromkeys(path for table, paths in self.paths.items() if table in self.tables for path in paths))
+
+    def _workbook(self, path):
+        if path not in self.workbooks:
+            workbook = open_workbook(path, self.constant_memory)
+            # Add every sheet of the workbook up front, so the sheet order
+            # does not depend on which table gets rows first
+            self.worksheets[path] = {
+                table: workbook.add_worksheet(sheet_name)
+                for table, (table_path, sheet_name) in self.layout.items() if table_path == path
+            }
+            self.workbooks[path] = workbook
+        return self.workbooks[path]
+
+    def open(self, table, template):
+        """Open table with template's columns and dtypes, if it is not open yet"""
+        if table in self.tables:
+            return
+        sinks = []
+        for fmt, path in zip(self.formats, self.paths[table]):
+            if fmt == "xlsx":
+                workbook = self._workbook(path)
+                overflow = f"{self.stems[table]}_rows.csv"
+                sinks.append(_SheetTable(workbook, template, self.worksheets[path][table], overflow, self.log))
+            elif fmt == "csv":
+                sinks.append(_CsvTable(path, template))
+            else:
+                sinks.append(_ArrowTable(path, template, fmt))
+        self.tables[table] = sinks
+
+    def write(self, table, df):
+        """Append df's rows to table"""
+        self.open(table, df)
+        for sink in self.tables[table]:
+            sink.write(df)
+
+    def finish(self, table):
+        """Close table's files, and its workbook once all of the workbook's tables are done"""
+        for sink in self.tables.get(table, []):
+            sink.close()
+        self.finished.add(table)
+        if table in self.layout:
+            path = self.layout[table][0]
+            if all(other in self.finished for other in self.worksheets.get(path, {})):
+                self.workbooks[path].close()
+
+    def close(self):
+        """Close anything still open, after an error"""
+        for table, sinks in self.tables.items():
+            if table in self.finished:
+                continue
+            for sink in sinks:
+                try:
+                    sink.close()
+                except Exception:
+                    pass
+        for workbook in self.workbooks.values():
+            if workbook.fileclosed:
+                continue
+            try:
+                workbook.close()
+            except Exception:
+                pass
@@ -0,0 +1,155 @@
+"""Bank upload batches built from the supplier summary.
+
+Every supplier with something to pay is one payment line. Payables are
+credits, so the payment is minus the summary's batches.amount_column
+(default Payable after WHT); suppliers whose total is not a credit are left
+out. The lines are packed into as few batches as possible that keep to
+batches.max_lines lines and batches.max_value in total (either may be 0 for
+no limit), separately for each value of batches.split_by, by default one
+set of batches per Diageo/Tolaram entity.
+
+Packing is best-fit decreasing on whole cents: the largest payment goes
+first, and each one goes to the open batch it leaves with the least value
+to spare, found by bisection over the open batches ordered by what they
+have left. Thousands of suppliers pack in milliseconds. A payment above
+max_value cannot share a batch and gets one of its own, with a warning.
+
+Each batch is written to {prefix}_batch_NNN.csv (or .xlsx) in the output
+folder, and {prefix}_batches lists them with their line counts and totals.
+"""
+import bisect
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from excel_writer import save_with_accounting_format
+
+BATCH_FORMATS = ("csv", "xlsx")
+
+
+def pack(cents, max_lines=0, max_value=0):
+    """Best-fit decreasing bin packing; returns a batch number per payment.
+
+    cents are positive integer amounts. Batches are numbered from 0 in the
+    order they are opened.
+    """
+    batch_of = np.empty(len(cents), dtype=np.int64)
+    # (value left, batch) of the batches that can still take a line, sorted
+    open_batches = []
+    lines = []
+    capacity = max_value or float("inf")
+    for position in np.argsort(-cents, kind="stable"):
+        value = int(cents[position])
+        index = bisect.bisect_left(open_batches, (value, -1))
+        if value > capacity or index == len(open_batches):
+            batch, left = len(lines), capacity
+            lines.append(0)
+        else:
+            left, batch = open_batches.pop(index)
+        lines[batch] += 1
+        batch_of[position] = batch
+        left -= value
+        if left >= 0 and (not max_lines or lines[batch] < max_lines):
+            bisect.insort(open_batches, (left, batch))
+    return batch_of
+
+
+class BatchBuilder:
+    def __init__(self, max_lines=0, max_value=0, amount_column="Payable after WHT",
+                 split_by=None, file_format="csv"):
+        if max_lines and max_lines < 1:
+            raise ValueError(f"batches.max_lines must be at least 1, not {max_lines}")
+        if max_value and max_value < 0:
+            raise ValueError(f"batches.max_value must be positive, not {max_value}")
+        if file_format not in BATCH_FORMATS:
+            raise ValueError(
+                f"Unknown batches.format {file_format!r}; choose one of {', '.join(BATCH_FORMATS)}"
+            )
+        self.max_lines = int(max_lines or 0)
+        self.max_value = max_value or 0
+        self.amount_column = amount_column
+        self.split_by = list(split_by or [])
+        self.file_format = file_format
+
+    def build(self, grouped_df, log=print):
+        """Return (payment lines with their Batch, one row per batch)"""
+        amounts = -pd.to_numeric(grouped_df[self.amount_column], errors="coerce").fillna(0)
+        payable = amounts > 0
+        skipped = int((~payable).sum())
+        if skipped:
+            log(f"{skipped} suppliers have no credit balance to pay and are left out of the batches")
+        lines_df = grouped_df[payable.to_numpy()].copy()
+        cents = np.round(amounts[payable].to_numpy() * 100).astype(np.int64)
+        # Banks take whole cents, and the batches are packed on the same amounts
+        lines_df["Payment amount"] = cents / 100
+        max_cents = round(self.max_value * 100)
+
+        split_by = [col for col in self.split_by if col in lines_df.columns]
+        batch = np.zeros(len(lines_df), dtype=np.int64)
+        offset = 0
+        if split_by:
+            parts = lines_df.groupby(split_by, sort=True, dropna=False, observed=True).indices.values()
+        else:
+            parts = [np.arange(len(lines_df))]
+        for positions in parts:
+            part_batches = pack(cents[positions], self.max_lines, max_cents)
+            batch[positions] = part_batches + offset + 1
+            offset += int(part_batches.max(initial=-1)) + 1
+        lines_df.insert(0, "Batch", batch)
+        lines_df = lines_df.sort_values("Batch", kind="stable").reset_index(drop=True)
+
+        over = lines_df[lines_df["Payment amount"] > self.max_value] if self.max_value else lines_df.iloc[:0]
+        for _, row in over.iterrows():
+            log(f"Warning: {row.get('Supplier', '')} pays {row['Payment amount']:,.2f}, above the "
+                f"batch limit of {self.max_value:,.2f}; it has batch {row['Batch']} to itself")
+
+        manifest = lines_df.groupby("Batch", sort=True).agg(
+            **{col: (col, "first") for col in split_by},
+            Lines=("Batch", "size"),
+            Total=("Payment amount", "sum"),
+        ).reset_index()
+        manifest["Total"] = manifest["Total"].round(2)
+        return lines_df, manifest
+
+    def write(self, lines_df, manifest, output_folder, prefix, constant_memory=True):
+        """Write one file per batch and the batch list; returns the batch file paths.
+
+        Batch files left by an earlier run with the same prefix are removed
+        first, so a rerun that needs fewer batches leaves none to upload twice.
+        """
+        extension = self.file_format
+        stale_files = f"{glob.escape(prefix)}_batch_[0-9][0-9][0-9].{extension}"
+        for stale in glob.glob(os.path.join(glob.escape(output_folder), stale_files)):
+            os.remove(stale)
+
+        def save(df, path):
+            if extension == "csv":
+                df.to_csv(path, index=False)
+            else:
+                save_with_accounting_format(df, path, constant_memory=constant_memory)
+
+        paths = []
+        files = []
+        for number, batch_df in lines_df.groupby("Batch", sort=True):
+            path = os.path.join(output_folder, f"{prefix}_batch_{number:03d}.{extension}")
+            save(batch_df.drop(columns="Batch"), path)
+            paths.append(path)
+            files.append(os.path.basename(path))
+        save(manifest.assign(File=files), os.path.join(output_folder, f"{prefix}_batches.{extension}"))
+        return paths
+
+
+def batch_builder_from_config(config):
+    """Return the configured BatchBuilder, or None if batching is disabled"""
+    settings = config.get("batches", {})
+    if not settings.get("enabled", False):
+        return None
+    return BatchBuilder(
+        settings.get("max_lines", 0),
+        settings.get("max_value", 0),
+        settings.get("amount_column", "Payable after WHT"),
+        settings.get("split_by", ["Diageo/Tolaram"]),
+        settings.get("format", "csv"),
+    )
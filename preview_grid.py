@@ -0,0 +1,303 @@
+"""In-app preview of result DataFrames.
+
+FrameView keeps a sorted, filtered list of row positions into a DataFrame
+and formats only the rows asked for. PreviewGrid shows it in a ttk.Treeview
+that owns just enough items to fill its height. Scrolling re-fills those
+items from the view, so tens of thousands of rows cost no more to show than
+a screenful. Nothing is written to disk.
+
+This module only imports tkinter; pandas is already loaded by the time a
+frame is shown.
+"""
+import math
+import tkinter as tk
+from tkinter import ttk
+
+ALL_COLUMNS = "(all columns)"
+WHEEL_ROWS = 3
+
+
+def format_value(value):
+    """Display text for one cell: blanks for missing, brackets for negatives"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        return f"({abs(value):,.2f})" if value < 0 else f"{value:,.2f}"
+    if hasattr(value, "strftime"):
+        return "" if value != value else value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def result_frames(result):
+    """(title, DataFrame) pairs to preview from a run_pipeline result.
+
+    Streaming runs keep no filtered frame, so the filtered tab is left out.
+    """
+    if "partitions" not in result:
+        frames = [("Filtered", result["filtered_df"]), ("Summary", result["grouped_df"]),
+                  ("Deferred", result.get("deferred_df")), ("Possible duplicates", result.get("duplicates_df")),
+                  ("Batches", result.get("batches_df"))]
+    else:
+        frames = []
+        for currency, outputs in result["partitions"].items():
+            frames.append((f"{currency} filtered", outputs["filtered_df"]))
+            frames.append((f"{currency} summary", outputs["grouped_df"]))
+            frames.append((f"{currency} deferred", outputs.get("deferred_df")))
+            frames.append((f"{currency} duplicates", outputs.get("duplicates_df")))
+            frames.append((f"{currency} batches", outputs.get("batches_df")))
+    return [(title, df) for title, df in frames if df is not None]
+
+
+class FrameView:
+    def __init__(self, df):
+        self.df = df
+        self.filters = {}
+        self.sort_column = None
+        self.ascending = True
+        self.positions = list(range(len(df)))
+        self.refresh()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def set_filter(self, column, text):
+        """Keep rows whose column contains text (case-insensitive); "" clears it.
+
+        column ALL_COLUMNS matches text in any column.
+        """
+        if text:
+            self.filters[column] = text
+        else:
+            self.filters.pop(column, None)
+        self.refresh()
+
+    def clear_filters(self):
+        self.filters = {}
+        self.refresh()
+
+    def sort_by(self, column):
+        """Sort by column; sorting the same column again reverses the order"""
+        if self.sort_column == column:
+            self.ascending = not self.ascending
+        else:
+            self.sort_column, self.ascending = column, True
+        self.refresh()
+
+    def _matches(self, column, text):
+        from filter_plan import evaluate_on_uniques
+
+        needle = text.lower()
+        contains = lambda values: values.astype(str).str.lower().str.contains(needle, regex=False)
+        return evaluate_on_uniques(self.df[column], contains)
+
+    def refresh(self):
+        """Recompute the visible row positions from the filters and sort"""
+        frame = self.df.reset_index(drop=True)
+        keep = None
+        for column, text in self.filters.items():
+            columns = list(self.df.columns) if column == ALL_COLUMNS else [column]
+            matched = None
+            for name in columns:
+                hits = self._matches(name, text)
+                matched = hits if matched is None else matched | hits
+            keep = matched if keep is None else keep & matched
+        if keep is not None:
+            frame = frame[keep]
+
+        if self.sort_column is not None:
+            values = frame[self.sort_column]
+            if hasattr(values, "cat"):
+                values = values.astype(object)
+            try:
+                ordered = values.sort_values(ascending=self.ascending, kind="stable", na_position="last")
+            except TypeError:
+                # Mixed types, such as integer and text supplier codes
+                ordered = values.sort_values(
+                    ascending=self.ascending, kind="stable", na_position="last",
+                    key=lambda v: v.where(v.isna(), v.astype(str))
+                )
+            frame = frame.loc[ordered.index]
+        self.positions = frame.index.tolist()
+
+    def rows(self, start, count):
+        """Formatted rows for view positions start .. start + count"""
+        block = self.df.iloc[self.positions[start:start + count]]
+        columns = [block[col].tolist() for col in block.columns]
+        return [tuple(format_value(value) for value in row) for row in zip(*columns)]
+
+
+class PreviewGrid(ttk.Frame):
+    def __init__(self, master, column_width=120, **kwargs):
+        super().__init__(master, **kwargs)
+        self.column_width = column_width
+        self.view = None
+        self.offset = 0
+        self.items = []
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="none", height=1)
+        self.vbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scroll)
+        self.hbar = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.hbar.set)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vbar.grid(row=0, column=1, sticky="ns")
+        self.hbar.grid(row=1, column=0, sticky="ew")
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", self.on_resize)
+        # Windows and macOS send <MouseWheel>, X11 sends buttons 4 and 5
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_by(-WHEEL_ROWS if e.delta > 0 else WHEEL_ROWS, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-WHEEL_ROWS, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(WHEEL_ROWS, "units"))
+
+    def show(self, view):
+        """Display a FrameView, resetting the scroll position"""
+        self.view = view
+        self.offset = 0
+        columns = [f"c{i}" for i in range(len(view.df.columns))]
+        self.tree.delete(*self.tree.get_children())
+        self.items = []
+        self.tree.configure(columns=columns)
+        for cid, name in zip(columns, view.df.columns):
+            self.tree.heading(cid, text=str(name), command=lambda name=name: self.sort_by(name))
+            self.tree.column(cid, width=self.column_width, stretch=False)
+        self.on_resize()
+
+    def sort_by(self, column):
+        self.view.sort_by(column)
+        for cid, name in zip(self.tree["columns"], self.view.df.columns):
+            arrow = ""
+            if name == self.view.sort_column:
+                arrow = " ▲" if self.view.ascending else " ▼"
+            self.tree.heading(cid, text=f"{name}{arrow}")
+        self.offset = 0
+        self.render()
+
+    def visible_rows(self):
+        """How many rows fit in the tree's current height"""
+        style = ttk.Style(self)
+        row_height = int(style.lookup("Treeview", "rowheight") or 20)
+        # Leave room for the heading row
+        return max(1, self.tree.winfo_height() // row_height - 1)
+
+    def on_resize(self, event=None):
+        if self.view is None:
+            return
+        wanted = self.visible_rows()
+        while len(self.items) < wanted:
+            self.items.append(self.tree.insert("", tk.END, values=()))
+        while len(self.items) > wanted:
+            self.tree.delete(self.items.pop())
+        self.render()
+
+    def on_scroll(self, action, amount, unit=None):
+        """Scrollbar callback: ("moveto", fraction) or ("scroll", n, units|pages)"""
+        if self.view is None:
+            return
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.view))
+            self.render()
+        else:
+            self.scroll_by(int(amount), unit)
+
+    def scroll_by(self, amount, unit):
+        if self.view is None:
+            return
+        step = len(self.items) if unit == "pages" else 1
+        self.offset += amount * step
+        self.render()
+
+    def render(self):
+        """Fill the tree's items with the rows at the current offset"""
+        total = len(self.view)
+        page = len(self.items)
+        self.offset = max(0, min(self.offset, total - page))
+        rows = self.view.rows(self.offset, page)
+        for index, item in enumerate(self.items):
+            self.tree.item(item, values=rows[index] if index < len(rows) else ())
+        if total:
+            self.vbar.set(self.offset / total, min(1.0, (self.offset + page) / total))
+        else:
+            self.vbar.set(0.0, 1.0)
+
+
+class PreviewPanel(ttk.Frame):
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.views = {}
+
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(toolbar, text="Show:").pack(side=tk.LEFT)
+        self.dataset = tk.StringVar()
+        self.dataset_box = ttk.Combobox(toolbar, textvariable=self.dataset, state="readonly", width=22)
+        self.dataset_box.pack(side=tk.LEFT, padx=(2, 10))
+        self.dataset_box.bind("<<ComboboxSelected>>", lambda e: self.select(self.dataset.get()))
+
+        ttk.Label(toolbar, text="Filter:").pack(side=tk.LEFT)
+        self.filter_column = tk.StringVar(value=ALL_COLUMNS)
+        self.column_box = ttk.Combobox(toolbar, textvariable=self.filter_column, state="readonly", width=24)
+        self.column_box.pack(side=tk.LEFT, padx=2)
+        self.filter_text = tk.StringVar()
+        entry = ttk.Entry(toolbar, textvariable=self.filter_text, width=24)
+        entry.pack(side=tk.LEFT, padx=2)
+        entry.bind("<Return>", lambda e: self.apply_filter())
+        ttk.Button(toolbar, text="Apply", command=self.apply_filter).pack(side=tk.LEFT, padx=2)
+        ttk.Button(toolbar, text="Clear", command=self.clear_filters).pack(side=tk.LEFT, padx=2)
+        self.count_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.count_var).pack(side=tk.RIGHT)
+
+        self.grid_view = PreviewGrid(self)
+        self.grid_view.pack(fill=tk.BOTH, expand=True)
+
+    def load(self, frames):
+        """Show a list of (title, DataFrame) pairs, replacing earlier results"""
+        self.views = {title: FrameView(df) for title, df in frames}
+        self.dataset_box.configure(values=list(self.views))
+        if self.views:
+            self.select(next(iter(self.views)))
+
+    def select(self, title):
+        self.dataset.set(title)
+        view = self.views[title]
+        self.column_box.configure(values=[ALL_COLUMNS] + [str(col) for col in view.df.columns])
+        self.filter_column.set(ALL_COLUMNS)
+        self.filter_text.set("")
+        self.grid_view.show(view)
+        self.update_count()
+
+    def current(self):
+        return self.views.get(self.dataset.get())
+
+    def apply_filter(self):
+        view = self.current()
+        if view is None:
+            return
+        column = self.filter_column.get()
+        if column != ALL_COLUMNS:
+            # The combobox holds text; map it back to the real column label
+            column = next(col for col in view.df.columns if str(col) == column)
+        view.set_filter(column, self.filter_text.get().strip())
+        self.grid_view.offset = 0
+        self.grid_view.render()
+        self.update_count()
+
+    def clear_filters(self):
+        view = self.current()
+        if view is None:
+            return
+        self.filter_text.set("")
+        view.clear_filters()
+        self.grid_view.render()
+        self.update_count()
+
+    def update_count(self):
+        view = self.current()
+        if view is None:
+            self.count_var.set("")
+            return
+        filters = ", ".join(f"{col}~{text!r}" for col, text in view.filters.items())
+        suffix = f" (filtered: {filters})" if filters else ""
+        self.count_var.set(f"{len(view):,} of {len(view.df):,} rows{suffix}")
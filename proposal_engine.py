@@ -0,0 +1,683 @@
+"""Payment proposal pipeline shared by the GUIs and the command-line tools.
+
+The same load -> filter -> group -> save steps used to live inside each Tk
+front-end. They are plain functions here that take the config dict and a
+log callable, so they can run on a GUI worker thread, in a batch process
+pool or anywhere else without a window.
+"""
+import copy
+import glob
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from balance_index import balance_index_from_config
+from compute_backend import backend_from_config
+from duplicate_check import duplicate_check_from_config
+from filter_plan import compile_filter_plan, normalize_text_columns
+from history_store import history_store_from_config
+from output_writer import ProposalWriter, output_formats
+from payment_batches import batch_builder_from_config
+from payment_priority import prioritizer_from_config, summary_aggregations
+from stage_profiler import StageProfiler
+from workbook_cache import cache_from_config, file_hash
+from workbook_loader import BALANCE_COLUMNS, read_columns, required_columns
+
+
+def read_workbook(path, config, header=0, columns=None, log=print, content_hash=None):
+    """Read an Excel sheet, reusing the parsed copy if the file is unchanged.
+
+    content_hash is the file's file_hash, if the caller already has it.
+    """
+    cache = cache_from_config(config)
+    if cache is None:
+        if columns is not None:
+            return read_columns(path, columns, header=header)
+        return pd.read_excel(path, header=header)
+    df, hit = cache.read_excel(path, header=header, columns=columns, content_hash=content_hash)
+    log(f"Cache {'hit' if hit else 'miss'}: {os.path.basename(path)}")
+    return df
+
+
+def _load_workbook_job(path, config, header, columns, content_hash=None):
+    """Read one workbook; returns (df, CPU seconds, log messages).
+
+    Runs in a worker process, so log lines are collected and replayed by
+    the caller instead of being printed from the child.
+    """
+    messages = []
+    cpu_started = time.process_time()
+    df = read_workbook(
+        path, config, header=header, columns=columns, log=messages.append, content_hash=content_hash
+    )
+    return df, time.process_time() - cpu_started, messages
+
+
+def _stop_pool(pool):
+    """Cancel a pool's queued jobs and stop its workers, even mid-parse"""
+    if hasattr(pool, "terminate_workers"):
+        pool.terminate_workers()
+        return
+    # Before Python 3.14 the executor has no public way to stop a running job
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def load_workbooks(specs, config, log=print, check_cancelled=None, hashes=None):
+    """Load several workbooks, parsing them concurrently in separate processes.
+
+    specs maps a name to (path, header, columns). Workbooks already in the
+    parsed-sheet cache are read in this process; only the ones that need a
+    real Excel parse go to the process pool. With check_cancelled, every
+    parse goes to the pool, and check_cancelled is polled while they run;
+    if it raises, the worker processes are stopped before it propagates.
+    hashes maps paths to the file_hash the caller already computed; each
+    file is hashed at most once. Returns name -> DataFrame.
+    """
+    started = time.perf_counter()
+    cache = cache_from_config(config)
+    parallel = config.get("input", {}).get("parallel_load", True)
+    hashes = dict(hashes or {})
+    if cache is not None:
+        for path, _, _ in specs.values():
+            if path not in hashes:
+                hashes[path] = file_hash(path)
+    to_parse = {
+        name: spec for name, spec in specs.items()
+        if cache is None or not cache.contains(
+            spec[0], header=spec[1], columns=spec[2], content_hash=hashes.get(spec[0])
+        )
+    }
+
+    frames = {}
+    cpu_seconds = 0.0
+    if to_parse and (check_cancelled is not None or (parallel and len(to_parse) > 1)):
+        workers = len(to_parse) if parallel else 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                name: pool.submit(_load_workbook_job, path, config, header, columns, hashes.get(path))
+                for name, (path, header, columns) in to_parse.items()
+            }
+            if check_cancelled is not None:
+                try:
+                    pending = set(futures.values())
+                    while pending:
+                        check_cancelled()
+                        _, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                except BaseException:
+                    _stop_pool(pool)
+                    raise
+            for name, future in futures.items():
+                try:
+                    frames[name], seconds, messages = future.result()
+                except Exception as e:
+                    path = to_parse[name][0]
+                    raise RuntimeError(
+                        f"Could not load {name} workbook {os.path.basename(path)}: {e}"
+                    ) from e
+                cpu_seconds += seconds
+                for message in messages:
+                    log(message)
+
+    for name, (path, header, columns) in specs.items():
+        if name not in frames:
+            frames[name], seconds, messages = _load_workbook_job(
+                path, config, header, columns, hashes.get(path)
+            )
+            cpu_seconds += seconds
+            for message in messages:
+                log(message)
+
+    log(f"Loaded {', '.join(specs)} in {time.perf_counter() - started:.2f}s wall, "
+        f"{cpu_seconds:.2f}s summed CPU")
+    return frames
+
+
+def load_inputs(invoice_path, supplier_path, config, log=print, profiler=None, check_cancelled=None):
+    """Return (invoice_df, supplier_df, suppliers_with_balance).
+
+    When the balance index is enabled the suppliers with a balance come from
+    it and supplier_df is None; the Sub TB is only read if the index has not
+    seen it before, in which case it is parsed alongside the invoices.
+    suppliers_with_balance is None when that filter is turned off.
+    """
+    profiler = profiler or StageProfiler()
+    project = config.get("input", {}).get("project_columns", False)
+    exclude_balances = config["filters"].get("exclude_suppliers_with_balance")
+    balance_index = balance_index_from_config(config) if exclude_balances else None
+    hashes = {}
+
+    with profiler.stage("load") as record:
+        specs = {"invoice": (invoice_path, 1, required_columns(config) if project else None)}
+        if balance_index is not None:
+            # Hashed once here for the index and the sheet cache
+            hashes[supplier_path] = file_hash(supplier_path)
+        if balance_index is None or not balance_index.contains(supplier_path, hashes[supplier_path]):
+            specs["supplier"] = (supplier_path, 0, BALANCE_COLUMNS if project else None)
+        frames = load_workbooks(specs, config, log, check_cancelled, hashes)
+        invoice_df = frames["invoice"]
+        invoice_df.columns = invoice_df.columns.str.strip()
+        supplier_df = frames.get("supplier")
+        if supplier_df is not None:
+            supplier_df.columns = supplier_df.columns.str.strip()
+        record["rows_out"] = len(invoice_df)
+
+    # Dictionary-encode the low-cardinality text columns once, up front
+    with profiler.stage("normalize", len(invoice_df)) as record:
+        normalize_text_columns(invoice_df)
+        record["rows_out"] = len(invoice_df)
+
+    if not exclude_balances:
+        return invoice_df, supplier_df, None
+    supplier_df, suppliers = lookup_balances(
+        supplier_path, supplier_df, balance_index, config, log, profiler, hashes.get(supplier_path)
+    )
+    return invoice_df, supplier_df, suppliers
+
+
+def lookup_balances(supplier_path, supplier_df, balance_index, config, log=print, profiler=None,
+                    content_hash=None):
+    """Return (supplier_df, suppliers_with_balance) for the loaded Sub TB.
+
+    With a balance index the suppliers come from it and supplier_df becomes
+    None; supplier_df may already be None when the index has seen the file.
+    content_hash is the Sub TB's file_hash, if the caller already has it.
+    """
+    profiler = profiler or StageProfiler()
+    rows_in = None if supplier_df is None else len(supplier_df)
+    with profiler.stage("balance_lookup", rows_in) as record:
+        if balance_index is None:
+            suppliers = backend_from_config(config).suppliers_with_balance(supplier_df)
+        else:
+            suppliers, status = balance_index.suppliers_with_balance(
+                supplier_path, lambda: supplier_df, content_hash
+            )
+            log(f"Supplier balance index: {status}")
+            supplier_df = None
+        record["rows_out"] = len(suppliers)
+    return supplier_df, suppliers
+
+
+def load_balances(supplier_path, config, log=print, profiler=None, check_cancelled=None):
+    """Return (supplier_df, suppliers_with_balance) without reading the invoices.
+
+    The same rules as load_inputs; both are None when the balance filter is
+    turned off.
+    """
+    profiler = profiler or StageProfiler()
+    if not config["filters"].get("exclude_suppliers_with_balance"):
+        return None, None
+    project = config.get("input", {}).get("project_columns", False)
+    balance_index = balance_index_from_config(config)
+    supplier_df = None
+    hashes = {} if balance_index is None else {supplier_path: file_hash(supplier_path)}
+    if balance_index is None or not balance_index.contains(supplier_path, hashes[supplier_path]):
+        with profiler.stage("load") as record:
+            spec = (supplier_path, 0, BALANCE_COLUMNS if project else None)
+            supplier_df = load_workbooks({"supplier": spec}, config, log, check_cancelled, hashes)["supplier"]
+            supplier_df.columns = supplier_df.columns.str.strip()
+            record["rows_out"] = len(supplier_df)
+    return lookup_balances(
+        supplier_path, supplier_df, balance_index, config, log, profiler, hashes.get(supplier_path)
+    )
+
+
+def get_suppliers_with_balance(supplier_df, config=None):
+    """Identify suppliers where sum of (Debit + Credit) > 0, on config's compute backend"""
+    return backend_from_config(config or {}).suppliers_with_balance(supplier_df)
+
+
+def apply_filters(invoice_df, supplier_df, config, log=print, suppliers_with_balance=None, profiler=None):
+    """Apply all configured filters as one compiled, single-pass plan"""
+    backend = backend_from_config(config)
+    lookup = backend.suppliers_with_balance
+    if suppliers_with_balance is not None:
+        lookup = lambda _: suppliers_with_balance
+    plan = compile_filter_plan(config["filters"], lookup)
+    return plan.apply(invoice_df, supplier_df, log=log, profiler=profiler, backend=backend)
+
+
+def explain_filters(invoice_df, supplier_df, config, log=print, suppliers_with_balance=None, profiler=None):
+    """Filter with exclusion reasons.
+
+    Returns (filtered_df, rejected_df, counts_df). rejected_df holds the
+    excluded rows with their "Exclusion mask" bits and decoded "Exclusion
+    reasons"; counts_df has one row per rule.
+    """
+    backend = backend_from_config(config)
+    lookup = backend.suppliers_with_balance
+    if suppliers_with_balance is not None:
+        lookup = lambda _: suppliers_with_balance
+    plan = compile_filter_plan(config["filters"], lookup)
+    mask = plan.exclusion_mask(invoice_df, supplier_df, log=log, profiler=profiler, backend=backend)
+    rejected = mask != 0
+    rejected_df = invoice_df[rejected].copy()
+    rejected_df["Exclusion mask"] = mask[rejected]
+    rejected_df["Exclusion reasons"] = plan.decode_reasons(mask[rejected])
+    return invoice_df[~rejected], rejected_df, plan.exclusion_counts(mask)
+
+
+def apply_grouping(df, config, log=print):
+    """Apply grouping and aggregation"""
+    grouping = config["grouping"]
+    log(f"Grouping by: {', '.join(grouping['by'])}")
+    return backend_from_config(config).group(df, grouping["by"], summary_aggregations(config))
+
+
+def profile_path(config):
+    """Return the stage profile path, next to the filtered output"""
+    prefix = config["output"]["file_prefix"]
+    return os.path.join(config["output"]["output_folder"], f"{prefix}_profile.json")
+
+
+def currency_partitions(filters, invoice_df):
+    """Return the currencies to process separately, or None for a single run.
+
+    filters["currency"] may be one code, a list or comma-separated string of
+    codes, or "ALL" for every currency in invoice_df (largest first).
+    """
+    currency = filters.get("currency")
+    if isinstance(currency, str):
+        if currency.strip().upper() in ("ALL", "*"):
+            counts = invoice_df["Currency"].value_counts()
+            return [str(code) for code in counts[counts > 0].index]
+        if "," not in currency:
+            return None
+        currency = currency.split(",")
+    if not isinstance(currency, (list, tuple)):
+        return None
+    return [str(code).strip() for code in currency if str(code).strip()] or None
+
+
+def partition_config(config, currency):
+    """Copy of config for one currency partition, with its own file prefix"""
+    config = copy.deepcopy(config)
+    config["filters"]["currency"] = currency
+    config["output"]["file_prefix"] = f"{config['output']['file_prefix']}_{currency}"
+    return config
+
+
+def _ignore_stage(name):
+    pass
+
+
+def prioritize(grouped_df, config, log=print, profiler=None, stage=_ignore_stage):
+    """Keep the suppliers that fit in the available cash, if prioritization is enabled.
+
+    Returns (the suppliers to pay, the deferred suppliers), or
+    (grouped_df, None).
+    """
+    prioritizer = prioritizer_from_config(config)
+    if prioritizer is None:
+        return grouped_df, None
+    profiler = profiler or StageProfiler()
+    currency = config["filters"].get("currency")
+    log("Prioritizing payments within the available cash...")
+    with profiler.stage("priority", len(grouped_df)) as record:
+        grouped_df, deferred_df = prioritizer.apply(
+            grouped_df, currency if isinstance(currency, str) else None, log
+        )
+        record["rows_out"] = len(grouped_df)
+    stage("priority")
+    return grouped_df, deferred_df
+
+
+def paid_lines(filtered_df, grouped_df, by):
+    """The filtered lines of the suppliers in grouped_df"""
+    lines = pd.MultiIndex.from_frame(filtered_df[by])
+    return filtered_df[lines.isin(pd.MultiIndex.from_frame(grouped_df[by]))]
+
+
+def save_batches(grouped_df, config, log=print, profiler=None, stage=_ignore_stage):
+    """Pack the summary into bank upload batches and write them, if batching is enabled.
+
+    Returns (one row per batch, batch file paths), or (None, []).
+    """
+    builder = batch_builder_from_config(config)
+    if builder is None:
+        return None, []
+    profiler = profiler or StageProfiler()
+    log("Packing payment batches...")
+    with profiler.stage("batches", len(grouped_df)) as record:
+        lines_df, batches_df = builder.build(grouped_df, log)
+        paths = builder.write(
+            lines_df, batches_df, config["output"]["output_folder"], config["output"]["file_prefix"],
+            config["output"].get("constant_memory", True)
+        )
+        record["rows_out"] = len(batches_df)
+    log(f"{len(lines_df)} payments in {len(batches_df)} batches written")
+    stage("batches")
+    return batches_df, paths
+
+
+def process_frame(invoice_df, supplier_df, config, log=print, suppliers_with_balance=None,
+                  profiler=None, stage=_ignore_stage):
+    """Filter, group and save one set of invoices.
+
+    stage(name) is called after each step. Returns the output paths, row
+    counts and the filtered, grouped and possible duplicates frames.
+    """
+    profiler = profiler or StageProfiler()
+
+    log("Applying filters...")
+    rejected_df = None
+    if config["output"].get("rejected_rows", False):
+        filtered_df, rejected_df, counts_df = explain_filters(
+            invoice_df, supplier_df, config, log, suppliers_with_balance, profiler
+        )
+    else:
+        filtered_df = apply_filters(
+            invoice_df, supplier_df, config, log, suppliers_with_balance, profiler
+        )
+    stage("filter")
+
+    duplicates_df = None
+    duplicates = duplicate_check_from_config(config)
+    if duplicates is not None:
+        log("Checking for duplicate invoices...")
+        with profiler.stage("duplicates", len(filtered_df)) as record:
+            filtered_df, duplicates_df = duplicates.apply(filtered_df, log)
+            record["rows_out"] = len(duplicates_df)
+        stage("duplicates")
+
+    log("Grouping data...")
+    with profiler.stage("group", len(filtered_df)) as record:
+        grouped_df = apply_grouping(filtered_df, config, log)
+        record["rows_out"] = len(grouped_df)
+    stage("group")
+
+    grouped_df, deferred_df = prioritize(grouped_df, config, log, profiler, stage)
+
+    writer = ProposalWriter(config, log)
+    try:
+        log(f"Saving filtered data to: {writer.describe('filtered')}")
+        with profiler.stage("save_filtered", len(filtered_df)) as record:
+            writer.write("filtered", filtered_df)
+            writer.finish("filtered")
+            record["rows_out"] = len(filtered_df)
+        stage("save_filtered")
+
+        log(f"Saving summary data to: {writer.describe('summary')}")
+        with profiler.stage("save_summary", len(grouped_df)) as record:
+            writer.write("summary", grouped_df)
+            writer.finish("summary")
+            record["rows_out"] = len(grouped_df)
+        stage("save_summary")
+
+        if deferred_df is not None:
+            log(f"Saving deferred suppliers to: {writer.describe('deferred')}")
+            with profiler.stage("save_deferred", len(deferred_df)) as record:
+                writer.write("deferred", deferred_df)
+                writer.finish("deferred")
+                record["rows_out"] = len(deferred_df)
+            stage("save_deferred")
+
+        if duplicates_df is not None:
+            log(f"Saving possible duplicates to: {writer.describe('duplicates')}")
+            with profiler.stage("save_duplicates", len(duplicates_df)) as record:
+                writer.write("duplicates", duplicates_df)
+                writer.finish("duplicates")
+                record["rows_out"] = len(duplicates_df)
+            stage("save_duplicates")
+
+        if rejected_df is not None:
+            log(f"Saving rejected rows to: {writer.describe('rejected')}")
+            with profiler.stage("save_rejected", len(rejected_df)) as record:
+                writer.write("rejected", rejected_df)
+                writer.write("counts", counts_df)
+                writer.finish("rejected")
+                writer.finish("counts")
+                record["rows_out"] = len(rejected_df)
+            stage("save_rejected")
+    finally:
+        writer.close()
+
+    batches_df, batch_paths = save_batches(grouped_df, config, log, profiler, stage)
+
+    return {
+        "filtered_path": writer.paths["filtered"][0],
+        "summary_path": writer.paths["summary"][0],
+        "rejected_path": None if rejected_df is None else writer.paths["rejected"][0],
+        "output_paths": writer.written_paths(),
+        "rows_in": len(invoice_df),
+        "rows_filtered": len(filtered_df),
+        "rows_rejected": None if rejected_df is None else len(rejected_df),
+        "rows_paid": None if deferred_df is None else len(
+            paid_lines(filtered_df, grouped_df, config["grouping"]["by"])
+        ),
+        "groups": len(grouped_df),
+        "duplicates": None if duplicates_df is None else len(duplicates_df),
+        "deferred": None if deferred_df is None else len(deferred_df),
+        "batches": None if batches_df is None else len(batches_df),
+        "batch_paths": batch_paths,
+        "filtered_df": filtered_df,
+        "grouped_df": grouped_df,
+        "duplicates_df": duplicates_df,
+        "deferred_df": deferred_df,
+        "batches_df": batches_df,
+    }
+
+
+def _partition_job(part_df, config, suppliers_with_balance):
+    """Process one currency partition in a worker process.
+
+    Returns (outputs, profile records, log messages); the caller replays the
+    messages.
+    """
+    messages = []
+    profiler = StageProfiler(messages.append)
+    outputs = process_frame(part_df, None, config, messages.append, suppliers_with_balance, profiler)
+    return outputs, profiler.records, messages
+
+
+def process_partitions(invoice_df, currencies, config, log=print, suppliers_with_balance=None,
+                       profiler=None):
+    """Split invoice_df by Currency once and process each partition.
+
+    Partitions run in parallel worker processes unless
+    output.parallel_currencies is off. Each one writes its own
+    {prefix}_{currency}_filtered/summary pair. Returns currency -> outputs.
+    """
+    profiler = profiler or StageProfiler()
+    with profiler.stage("partition", len(invoice_df)) as record:
+        # One groupby pass instead of one boolean scan per currency
+        parts = {
+            str(currency): part
+            for currency, part in invoice_df.groupby("Currency", observed=True, sort=False)
+            if str(currency) in currencies
+        }
+        record["rows_out"] = sum(len(part) for part in parts.values())
+    for currency in currencies:
+        if currency not in parts:
+            log(f"No {currency} invoices, skipped")
+    currencies = [currency for currency in currencies if currency in parts]
+    log(f"Processing {len(currencies)} currency partitions: {', '.join(currencies)}")
+
+    def collect(currency, job_result):
+        outputs, records, messages = job_result
+        for message in messages:
+            log(f"[{currency}] {message}")
+        for record in records:
+            profiler.records.append(dict(record, stage=f"{currency}/{record['stage']}"))
+        return outputs
+
+    results = {}
+    parallel = config["output"].get("parallel_currencies", True)
+    if parallel and len(currencies) > 1:
+        workers = min(len(currencies), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                currency: pool.submit(
+                    _partition_job, parts[currency], partition_config(config, currency),
+                    suppliers_with_balance
+                )
+                for currency in currencies
+            }
+            for currency, future in futures.items():
+                try:
+                    results[currency] = collect(currency, future.result())
+                except Exception as e:
+                    raise RuntimeError(f"Could not process the {currency} partition: {e}") from e
+    else:
+        for currency in currencies:
+            results[currency] = collect(currency, _partition_job(
+                parts[currency], partition_config(config, currency), suppliers_with_balance
+            ))
+    return results
+
+
+def run_frame(invoice_df, supplier_df, config, log=print, suppliers_with_balance=None,
+              profiler=None, stage=_ignore_stage):
+    """Process loaded invoices as one run or one run per currency partition"""
+    result = {"output_folder": config["output"]["output_folder"], "rows_in": len(invoice_df)}
+    currencies = currency_partitions(config["filters"], invoice_df)
+    if currencies is None:
+        result.update(process_frame(
+            invoice_df, supplier_df, config, log, suppliers_with_balance, profiler, stage
+        ))
+        return result
+    partitions = process_partitions(
+        invoice_df, currencies, config, log, suppliers_with_balance, profiler
+    )
+    stage("partitions")
+    result["partitions"] = partitions
+    for key in ("rows_filtered", "rows_rejected", "rows_paid", "groups", "duplicates", "deferred", "batches"):
+        counts = [outputs[key] for outputs in partitions.values() if outputs[key] is not None]
+        result[key] = sum(counts) if counts else None
+    return result
+
+
+def record_history(result, invoice_path, supplier_path, config, log=print, profiler=None):
+    """Add a run_pipeline result to the proposal history, if it is enabled"""
+    history = history_store_from_config(config)
+    if history is None:
+        return
+    profiler = profiler or StageProfiler()
+    prefix = config["output"]["file_prefix"]
+    if "partitions" in result:
+        runs = [(currency, outputs) for currency, outputs in result["partitions"].items()]
+    else:
+        currency = config["filters"].get("currency")
+        runs = [(currency if isinstance(currency, str) else None, result)]
+    with profiler.stage("history", result["rows_filtered"]) as record:
+        for currency, outputs in runs:
+            filtered_df, lines = outputs["filtered_df"], outputs["rows_filtered"]
+            if outputs["deferred_df"] is not None:
+                # Deferred suppliers are not part of the proposal
+                lines = outputs["rows_paid"]
+                if filtered_df is not None:
+                    filtered_df = paid_lines(filtered_df, outputs["grouped_df"], config["grouping"]["by"])
+            history.record_run(
+                prefix, filtered_df, outputs["grouped_df"], currency=currency,
+                invoice_file=os.path.basename(invoice_path), supplier_file=os.path.basename(supplier_path),
+                lines=lines
+            )
+        record["rows_out"] = result["rows_filtered"]
+    log(f"Recorded {len(runs)} run(s) in the proposal history: {history.path}")
+
+
+def output_snapshot(config):
+    """{path: modification time} of the files with the run's file prefix"""
+    output = config["output"]
+    pattern = os.path.join(glob.escape(output["output_folder"]), f"{glob.escape(output['file_prefix'])}_*")
+    return {path: os.path.getmtime(path) for path in glob.glob(pattern)}
+
+
+def remove_partial_outputs(config, before, log=print):
+    """Delete the prefix's files created or rewritten since the before snapshot"""
+    removed = 0
+    for path, modified in output_snapshot(config).items():
+        if before.get(path) != modified:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                log(f"Could not remove {path}: {e}")
+    if removed:
+        log(f"Removed {removed} output files of the cancelled run")
+
+
+def run_pipeline(invoice_path, supplier_path, config, log=print, check_cancelled=None):
+    """Load, filter, group and save one day's files.
+
+    check_cancelled, if given, is called between stages and while the
+    workbooks are read, and may raise to stop the run; the output files the
+    run had already written are then removed.
+    Every stage is profiled; the records are logged as they finish and
+    written to {prefix}_profile.json. When filters.currency names several
+    currencies the workbook is still read once and each currency gets its
+    own outputs, listed under "partitions". With input.streaming the
+    invoices are read and filtered in chunks instead (see
+    streaming_pipeline). Outputs are written in the output.formats (see
+    output_writer). The run is also added to the proposal history.
+    Returns a dict with the output paths, row counts, per-stage seconds and
+    the profile records.
+    """
+    timings = {}
+    profiler = StageProfiler(log)
+    started = time.perf_counter()
+    marks = [started]
+
+    cancelled = []
+
+    def cancel_point():
+        try:
+            check_cancelled()
+        except BaseException:
+            cancelled.append(True)
+            raise
+
+    cancellable = cancel_point if check_cancelled is not None else None
+
+    def mark(name):
+        now = time.perf_counter()
+        timings[name] = now - marks[-1]
+        marks.append(now)
+
+    def stage(name):
+        mark(name)
+        if cancellable is not None:
+            cancellable()
+
+    # Reject bad output, priority and batch settings before the slow load, not after it
+    output_formats(config)
+    prioritizer_from_config(config)
+    batch_builder_from_config(config)
+    os.makedirs(config["output"]["output_folder"], exist_ok=True)
+    before = output_snapshot(config) if cancellable is not None else {}
+
+    try:
+        if config.get("input", {}).get("streaming", False):
+            # Imported here because streaming_pipeline builds on this module
+            from streaming_pipeline import run_streaming
+
+            log("Streaming invoice data in chunks...")
+            result = run_streaming(invoice_path, supplier_path, config, log, profiler, stage, cancellable)
+        else:
+            log("Loading invoice and supplier data...")
+            invoice_df, supplier_df, suppliers_with_balance = load_inputs(
+                invoice_path, supplier_path, config, log, profiler, cancellable
+            )
+            stage("load")
+            result = run_frame(invoice_df, supplier_df, config, log, suppliers_with_balance, profiler, stage)
+    except BaseException:
+        if cancelled:
+            remove_partial_outputs(config, before, log)
+        raise
+
+    # The outputs are complete from here on, so the run is no longer cancelled
+    record_history(result, invoice_path, supplier_path, config, log, profiler)
+    mark("history")
+
+    total = time.perf_counter() - started
+    result["profile_path"] = profiler.write_json(
+        profile_path(config),
+        invoice_file=os.path.basename(invoice_path),
+        supplier_file=os.path.basename(supplier_path),
+        total_seconds=round(total, 4),
+    )
+    result.update(timings=timings, profile=profiler.records, total=total)
+    return result
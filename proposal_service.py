@@ -0,0 +1,335 @@
+"""Local HTTP service that generates payment proposals from uploaded workbooks.
+
+Analysts POST a workings file and a Sub TB to /proposals and get a zip of the
+filtered and summary outputs (plus the rejected rows with
+output.rejected_rows, and the stage profile) back, in the output.formats of
+the config.
+Requests are handled concurrently: each one is queued on a pool of
+long-lived worker processes that keep pandas imported, the parsed-sheet
+cache and the Sub TB balance lookups warm between requests.
+
+Examples:
+    python proposal_service.py --port 8765 --workers 4
+    curl -F workings=@workings_file.xlsx -F tb=@"Sub TB 28.05.2025.XLSX" \\
+         -F prefix=20250528 -o proposal.zip http://127.0.0.1:8765/proposals
+    curl -F workings=@workings_file.xlsx -F tb=@balance_sheet.xlsx \\
+         -F config=@usd_override.yaml -o usd.zip http://127.0.0.1:8765/proposals
+    curl http://127.0.0.1:8765/metrics
+
+Form fields for POST /proposals:
+    workings  the invoice workbook (required)
+    tb        the Sub TB workbook (required)
+    config    YAML or JSON laid over the service config; only the filters,
+              grouping and output sections may be overridden (optional)
+    prefix    output file prefix, default today's date and the request id;
+              the history keeps one run per prefix and currency, so
+              reusing a prefix replaces that run (optional)
+
+GET /metrics reports request counts and latency percentiles over the last
+service.metrics_window requests, split into queue wait and processing, and
+the mean seconds per pipeline stage. GET /health answers once the workers
+are up.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+import app_config
+from batch_cli import STAGES, run_job
+
+OVERRIDABLE_SECTIONS = ("filters", "grouping", "output")
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_multipart(content_type, body):
+    """Return field name -> (filename or None, bytes) from a multipart/form-data body"""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    if not message.is_multipart():
+        raise RequestError(HTTPStatus.BAD_REQUEST, "expected a multipart/form-data upload")
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return fields
+
+
+def config_override(text):
+    """Parse a YAML/JSON override, keeping to the sections clients may change"""
+    try:
+        override = yaml.safe_load(text) or {}
+    except yaml.YAMLError as e:
+        raise RequestError(HTTPStatus.BAD_REQUEST, f"config is not valid YAML or JSON: {e}")
+    if not isinstance(override, dict):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "config must be a mapping")
+    refused = sorted(set(override) - set(OVERRIDABLE_SECTIONS))
+    if refused:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST,
+            f"config sections {', '.join(refused)} cannot be overridden; "
+            f"allowed: {', '.join(OVERRIDABLE_SECTIONS)}"
+        )
+    return override
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class LatencyMetrics:
+    def __init__(self, window):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def end(self, record):
+        with self._lock:
+            self.in_flight -= 1
+            if record["status"] >= 400:
+                self.errors += 1
+            self._recent.append(record)
+
+    def snapshot(self):
+        with self._lock:
+            recent = list(self._recent)
+            counts = {"requests": self.requests, "errors": self.errors, "in_flight": self.in_flight}
+        report = dict(counts, uptime_seconds=round(time.time() - self.started, 1), window=len(recent))
+        for key in ("total_seconds", "queue_seconds", "process_seconds"):
+            values = sorted(round(record[key], 4) for record in recent if record.get(key) is not None)
+            report[key] = {
+                "p50": percentile(values, 0.5),
+                "p90": percentile(values, 0.9),
+                "p99": percentile(values, 0.99),
+                "max": values[-1] if values else None,
+            }
+        timed = [record["timings"] for record in recent if record.get("timings")]
+        report["stage_mean_seconds"] = {
+            stage: round(sum(timings.get(stage, 0) for timings in timed) / len(timed), 4)
+            for stage in STAGES
+        } if timed else {}
+        return report
+
+
+def _service_job(job, config):
+    """Run one request in a worker; returns (start time, run_job outcome)"""
+    return time.time(), run_job(job, config)
+
+
+def _warm_up():
+    # Running any function from this module makes a new worker import it, and
+    # with it pandas and the engine, before the first request arrives
+    return os.getpid()
+
+
+def zip_outputs(folder):
+    """Zip every file in folder; workbooks and Parquet files are already compressed, so they are stored"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in sorted(os.listdir(folder)):
+            compression = zipfile.ZIP_STORED if name.lower().endswith((".xlsx", ".parquet")) \
+                else zipfile.ZIP_DEFLATED
+            archive.write(os.path.join(folder, name), name, compress_type=compression)
+    return buffer.getvalue()
+
+
+class ProposalService:
+    def __init__(self, config, workers):
+        self.config = config
+        self.service = config.get("service", {})
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.metrics = LatencyMetrics(self.service.get("metrics_window", 1000))
+        self.max_upload = int(self.service.get("max_upload_mb", 200) * 1024 * 1024)
+
+    def warm_up(self):
+        pids = {future.result() for future in [self.pool.submit(_warm_up) for _ in range(self.workers)]}
+        return len(pids)
+
+    def request_config(self, fields, output_folder):
+        config = self.config
+        if "config" in fields:
+            config = app_config.merge_config(config, config_override(fields["config"][1]))
+        # Outputs always go to the request's own folder
+        config = app_config.merge_config(config, {"output": {"output_folder": output_folder}})
+        return config
+
+    def propose(self, fields, request_id):
+        """Run the pipeline for one upload; returns (zip bytes, record for the metrics)"""
+        for name in ("workings", "tb"):
+            if name not in fields or not fields[name][1]:
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"missing upload field {name!r}")
+        prefix = fields["prefix"][1].decode("utf-8").strip() if "prefix" in fields else ""
+        # Concurrent uploads must not replace each other's history
+        prefix = os.path.basename(prefix) or f"{datetime.now().strftime('%Y%m%d')}_{request_id}"
+
+        with tempfile.TemporaryDirectory(prefix="proposal_") as workdir:
+            paths = {}
+            for name in ("workings", "tb"):
+                filename, data = fields[name]
+                paths[name] = os.path.join(workdir, f"{name}_{os.path.basename(filename or name + '.xlsx')}")
+                with open(paths[name], "wb") as f:
+                    f.write(data)
+            output_folder = os.path.join(workdir, "out")
+            config = self.request_config(fields, output_folder)
+
+            submitted = time.time()
+            started, (_, result, error) = self.pool.submit(
+                _service_job, (paths["workings"], paths["tb"], prefix), config
+            ).result()
+            finished = time.time()
+            record = {"queue_seconds": started - submitted, "process_seconds": finished - started}
+            if error is not None:
+                raise RequestError(HTTPStatus.UNPROCESSABLE_ENTITY, error)
+            record["timings"] = result["timings"]
+            summary = {key: result.get(key) for key in ("rows_in", "rows_filtered", "rows_rejected", "groups",
+                                                        "duplicates", "deferred", "batches")}
+            summary.update(timings=result["timings"], total=result["total"])
+            with open(os.path.join(output_folder, "result.json"), "w") as f:
+                json.dump(summary, f, indent=2)
+            return zip_outputs(output_folder), record
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ProposalHandler(BaseHTTPRequestHandler):
+    server_version = "ProposalService/1.0"
+    # HTTP/1.1 answers curl's "Expect: 100-continue" instead of making it wait a second
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload, indent=2).encode("utf-8"), "application/json", headers)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(HTTPStatus.OK, {"status": "ok", "workers": self.service.workers})
+        elif self.path == "/metrics":
+            self.send_json(HTTPStatus.OK, self.service.metrics.snapshot())
+        else:
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": f"no such endpoint {self.path}"})
+
+    def read_upload(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+        if int(length) > self.service.max_upload:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                               f"upload is larger than {self.service.max_upload // (1024 * 1024)} MB")
+        body = self.rfile.read(int(length))
+        return parse_multipart(self.headers.get("Content-Type", ""), body)
+
+    def do_POST(self):
+        if self.path != "/proposals":
+            self.send_json(HTTPStatus.NOT_FOUND, {"error": f"no such endpoint {self.path}"})
+            return
+        request_id = uuid.uuid4().hex[:12]
+        metrics = self.service.metrics
+        metrics.begin()
+        started = time.perf_counter()
+        record = {"status": HTTPStatus.OK}
+        try:
+            body, timing = self.service.propose(self.read_upload(), request_id)
+            record.update(timing)
+            record["total_seconds"] = time.perf_counter() - started
+            server_timing = ", ".join(
+                [f"queue;dur={record['queue_seconds'] * 1000:.1f}"]
+                + [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in record["timings"].items()]
+                + [f"total;dur={record['total_seconds'] * 1000:.1f}"]
+            )
+            self.send_body(HTTPStatus.OK, body, "application/zip", {
+                "Content-Disposition": 'attachment; filename="proposal.zip"',
+                "X-Request-Id": request_id,
+                "Server-Timing": server_timing,
+            })
+        except RequestError as e:
+            record["status"] = e.status
+            self.send_json(e.status, {"error": str(e), "request_id": request_id})
+        except Exception as e:
+            record["status"] = HTTPStatus.INTERNAL_SERVER_ERROR
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e), "request_id": request_id})
+        finally:
+            record.setdefault("total_seconds", time.perf_counter() - started)
+            metrics.end(record)
+            self.log_message("%s %s %.2fs", request_id, int(record["status"]), record["total_seconds"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve payment proposals over HTTP")
+    parser.add_argument("--config", default=app_config.CONFIG_PATH, help="config file (default: %(default)s)")
+    parser.add_argument("--host", help="address to listen on (default: config service.host)")
+    parser.add_argument("--port", type=int, help="port to listen on (default: config service.port)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: config service.workers)")
+    args = parser.parse_args(argv)
+
+    # run_job turns off the per-run process pools; requests are the unit of parallelism
+    config = app_config.load_config(args.config)
+    settings = config.get("service", {})
+    host = args.host or settings.get("host", "127.0.0.1")
+    port = args.port or settings.get("port", 8765)
+    workers = max(1, args.workers or settings.get("workers") or os.cpu_count() or 1)
+
+    service = ProposalService(config, workers)
+    print(f"Starting {workers} workers...", flush=True)
+    service.warm_up()
+    server = ThreadingHTTPServer((host, port), ProposalHandler)
+    server.service = service
+    print(f"Serving proposals on http://{host}:{port}/proposals (Ctrl+C to stop)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped")
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Per-stage profiling records for the proposal pipeline.
+
+Each profiled stage produces one record with wall time, CPU time, rows in
+and out and how much the process's peak resident memory grew while the
+stage ran. Records are logged as they finish and can be written out as JSON
+next to the pipeline's outputs.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def _peak_rss_windows():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown"""
+    try:
+        if sys.platform == "win32":
+            return _peak_rss_windows()
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+def format_record(record):
+    """One log line for a stage record"""
+    parts = [f"{record['wall_seconds']:.3f}s wall", f"{record['cpu_seconds']:.3f}s CPU"]
+    if record["rows_in"] is not None or record["rows_out"] is not None:
+        rows_in = "?" if record["rows_in"] is None else f"{record['rows_in']:,}"
+        rows_out = "?" if record["rows_out"] is None else f"{record['rows_out']:,}"
+        parts.append(f"rows {rows_in} -> {rows_out}")
+    if record["peak_rss_delta_mb"] is not None:
+        parts.append(f"peak RSS +{record['peak_rss_delta_mb']:.1f} MB")
+    return f"[profile] {record['stage']}: {', '.join(parts)}"
+
+
+class StageProfiler:
+    def __init__(self, log=None):
+        self.log = log
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Profile the enclosed block as one stage.
+
+        Yields the record dict; set record["rows_out"] (and rows_in, if it
+        was not known up front) inside the block.
+        """
+        record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+        rss_before = peak_rss()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            rss_after = peak_rss()
+            record["wall_seconds"] = round(time.perf_counter() - started, 4)
+            record["cpu_seconds"] = round(time.process_time() - cpu_started, 4)
+            record["peak_rss_delta_mb"] = (
+                None if rss_before is None or rss_after is None
+                else round((rss_after - rss_before) / 2 ** 20, 1)
+            )
+            self.records.append(record)
+            if self.log is not None:
+                self.log(format_record(record))
+
+    def write_json(self, path, **details):
+        """Write the records and any extra run details to path"""
+        report = {"created": datetime.now().isoformat(timespec="seconds"), **details,
+                  "stages": self.records}
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        return path
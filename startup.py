@@ -0,0 +1,96 @@
+"""Fast start-up helpers for the GUIs.
+
+The window is drawn first; pandas, openpyxl and the rest of the processing
+code are imported on a background thread while the user picks files.
+
+Running a GUI with --startup-benchmark PATH records when the window appeared
+and when the background imports finished (as epoch seconds), writes them to
+PATH as JSON and exits. benchmark_startup.py drives this for the scripts and
+the frozen executables.
+"""
+import json
+import sys
+import threading
+import time
+
+BENCHMARK_FLAG = "--startup-benchmark"
+EAGER_FLAG = "--eager-imports"
+
+
+class BackgroundLoader:
+    def __init__(self, load, on_done=None):
+        # load() runs on a daemon thread; its return value is kept for get()
+        self._load = load
+        self._on_done = on_done
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        self.started_at = time.time()
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self._value = self._load()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.finished_at = time.time()
+            if self._on_done is not None:
+                self._on_done(self._error)
+            self._done.set()
+
+    def ready(self):
+        """True once the load has finished, successfully or not"""
+        return self._done.is_set()
+
+    def get(self):
+        """Wait for the load to finish and return its result, re-raising errors"""
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def benchmark_path(argv=None):
+    """Output path given after --startup-benchmark, or None"""
+    argv = sys.argv if argv is None else argv
+    if BENCHMARK_FLAG in argv:
+        index = argv.index(BENCHMARK_FLAG)
+        if index + 1 < len(argv):
+            return argv[index + 1]
+    return None
+
+
+def eager_imports(argv=None):
+    """True if --eager-imports asks for the old import-everything-first start"""
+    return EAGER_FLAG in (sys.argv if argv is None else argv)
+
+
+def run_startup_benchmark(root, loader, path, imported_at=None):
+    """Record window and import timings to path, then close the app.
+
+    Call before root.mainloop(). imported_at is when an eager start finished
+    its imports, before the window was created.
+    """
+    marks = {"frozen": bool(getattr(sys, "frozen", False)), "eager": imported_at is not None}
+
+    def window_shown():
+        root.update_idletasks()
+        marks["window_shown"] = time.time()
+        root.after(10, wait_for_imports)
+
+    def wait_for_imports():
+        if not loader.ready():
+            root.after(10, wait_for_imports)
+            return
+        marks["imports_ready"] = imported_at or loader.finished_at
+        with open(path, "w") as f:
+            json.dump(marks, f)
+        root.destroy()
+
+    root.after(0, window_shown)
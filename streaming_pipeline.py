@@ -0,0 +1,511 @@
+"""Streaming version of the proposal pipeline for extracts larger than memory.
+
+With input.streaming on, the invoice sheet is read in chunks of
+input.chunk_rows rows (workbook_loader.SheetChunks). Each chunk is filtered
+with the compiled filter plan, its kept and rejected rows are appended to
+the output files straight away, and only running aggregates per group
+key are kept, plus the few columns of the kept rows that the duplicate
+check reads. Peak memory follows the chunk size and the number of groups,
+not the size of the extract. duplicates.hold needs the whole filtered frame
+before grouping, so it is not available here.
+
+The outputs match the in-memory pipeline: chunks get the dtypes a
+whole-sheet read gives, float sums carry pandas' compensated summation from
+one chunk to the next, and groups come out in pandas' sort order. The
+filtered rows are not kept, so results have "filtered_df": None.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from compute_backend import backend_from_config
+from duplicate_check import duplicate_check_from_config
+from filter_plan import compile_filter_plan, normalize_text_columns
+from output_writer import ProposalWriter
+from payment_priority import summary_aggregations
+from proposal_engine import load_balances, partition_config, prioritize, save_batches
+from stage_profiler import StageProfiler
+from workbook_loader import DEFAULT_CHUNK_ROWS, SheetChunks, required_columns
+
+# Aggregations GroupAccumulator can carry from chunk to chunk
+STREAM_AGGREGATIONS = ("first", "last", "count", "min", "max", "sum", "mean")
+
+
+def _quiet(message):
+    pass
+
+
+def _ignore_stage(name):
+    pass
+
+
+def kahan_add(total, compensation, nobs, groups, values):
+    """Add values to per-group compensated sums, row by row in order.
+
+    Runs the same recurrence as pandas' groupby sum and mean kernels, so
+    carrying total and compensation across chunks gives the bit-identical
+    result of one pass over all rows. Rows are taken one occurrence per
+    group at a time, so each step is a vectorized update of distinct groups.
+    """
+    present = ~np.isnan(values)
+    groups, values = groups[present], values[present]
+    np.add.at(nobs, groups, 1)
+    order = np.argsort(groups, kind="stable")
+    groups, values = groups[order], values[order]
+    if not len(groups):
+        return
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(groups)])
+    with np.errstate(invalid="ignore"):
+        for k in range(sizes.max()):
+            rows = starts[sizes > k] + k
+            g, v = groups[rows], values[rows]
+            y = v - compensation[g]
+            t = total[g] + y
+            c = t - total[g] - y
+            # pandas resets the compensation once a sum reaches +-inf
+            c[np.isnan(c)] = 0
+            compensation[g] = c
+            total[g] = t
+
+
+class GroupAccumulator:
+    """Running groupby(by).agg(aggregations), fed one chunk at a time.
+
+    categories maps each Categorical column to its labels in order of first
+    appearance over the whole extract, as encode_categorical would have
+    built them on the full frame.
+    """
+
+    def __init__(self, by, aggregations, categories):
+        unsupported = {
+            col: func for col, func in aggregations.items()
+            if not isinstance(func, str) or func not in STREAM_AGGREGATIONS
+        }
+        if unsupported:
+            raise ValueError(
+                f"Streaming mode cannot aggregate {unsupported}; "
+                f"use one of {', '.join(STREAM_AGGREGATIONS)} or turn input.streaming off"
+            )
+        self.by = list(by)
+        self.aggregations = dict(aggregations)
+        self.categories = categories
+        self.dtypes = None
+        # key tuple -> group number, in order of first appearance
+        self.groups = {}
+        self.values = {}
+        self.present = {}
+        self.totals = {}
+        self.sizes = np.zeros(0, dtype=np.int64)
+
+    def _start(self, df):
+        self.dtypes = {col: df[col].dtype for col in self.by + list(self.aggregations)}
+        for col, func in self.aggregations.items():
+            dtype = self.dtypes[col]
+            if func in ("sum", "mean") and not (
+                pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype)
+            ):
+                raise ValueError(f"Streaming mode can only {func} numeric columns; {col} is {dtype}")
+            if func in ("first", "last", "min", "max"):
+                self.values[col] = np.empty(0, dtype=object)
+                self.present[col] = np.zeros(0, dtype=bool)
+            elif func == "mean" or (func == "sum" and dtype.kind == "f"):
+                # total, compensation, non-missing rows
+                self.totals[col] = (np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64))
+            else:
+                self.totals[col] = np.zeros(0, dtype=np.int64)
+
+    def _grow(self, size):
+        def grown(array):
+            return np.concatenate([array, np.zeros(size - len(array), dtype=array.dtype)])
+
+        for col in self.values:
+            self.values[col] = np.concatenate([self.values[col], np.full(size - len(self.values[col]), None)])
+            self.present[col] = grown(self.present[col])
+        for col, state in self.totals.items():
+            self.totals[col] = tuple(map(grown, state)) if isinstance(state, tuple) else grown(state)
+        self.sizes = grown(self.sizes)
+
+    def add(self, df):
+        """Fold one chunk of filtered rows into the running aggregates"""
+        if self.dtypes is None:
+            self._start(df)
+        if not len(df):
+            return
+        grouper = df.groupby(self.by, sort=False, observed=True, dropna=True)
+        sizes = grouper.size()
+        keys = sizes.index.tolist() if len(self.by) > 1 else [(key,) for key in sizes.index.tolist()]
+        ids = np.array([self.groups.setdefault(key, len(self.groups)) for key in keys], dtype=np.int64)
+        self._grow(len(self.groups))
+        np.add.at(self.sizes, ids, sizes.to_numpy())
+        row_groups = grouper.ngroup().to_numpy()
+        keyed = ~np.isnan(row_groups)
+        row_ids = ids[row_groups[keyed].astype(np.int64)]
+
+        pandas_funcs = {
+            col: func for col, func in self.aggregations.items()
+            if func in ("first", "last", "min", "max", "count")
+            or (func == "sum" and not isinstance(self.totals[col], tuple))
+        }
+        partial = grouper.agg(pandas_funcs) if pandas_funcs else None
+        for col, func in self.aggregations.items():
+            if col not in pandas_funcs:
+                total, compensation, nobs = self.totals[col]
+                values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)[keyed]
+                kahan_add(total, compensation, nobs, row_ids, values)
+                continue
+            chunk_values = partial[col]
+            if func in ("count", "sum"):
+                np.add.at(self.totals[col], ids, chunk_values.to_numpy(dtype=np.int64))
+                continue
+            found = chunk_values.notna().to_numpy()
+            values = np.array(chunk_values.tolist(), dtype=object)
+            current, present = self.values[col], self.present[col]
+            if func == "first":
+                take = found & ~present[ids]
+            elif func == "last":
+                take = found
+            else:
+                better = np.array([
+                    not had or (value < old if func == "min" else value > old)
+                    for value, old, had in zip(values, current[ids], present[ids])
+                ], dtype=bool)
+                take = found & better
+            current[ids[take]] = values[take]
+            present[ids[take]] = True
+
+    def lines(self, grouped_df):
+        """The number of rows added for the groups in grouped_df"""
+        keys = zip(*(grouped_df[col].tolist() for col in self.by))
+        return int(sum(self.sizes[self.groups[key]] for key in keys))
+
+    def _categorical(self, col, values):
+        # encode_categorical's categories are an object Index
+        return pd.Categorical(values, categories=pd.Index(list(self.categories[col]), dtype=object))
+
+    def _series(self, col, values, dtype=None):
+        dtype = self.dtypes[col] if dtype is None else dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            return pd.Series(self._categorical(col, values), name=col)
+        if dtype == object:
+            # pandas turns object results holding only strings into str
+            strings = [value for value in values if value is not None]
+            if strings and all(isinstance(value, str) for value in strings):
+                dtype = pd.StringDtype(na_value=np.nan)
+        return pd.Series(values, dtype=dtype, name=col)
+
+    def result(self):
+        """The grouped frame, as groupby(by, as_index=False).agg(aggregations) returns it"""
+        if self.dtypes is None:
+            raise ValueError("No rows were added")
+        keys = list(zip(*self.groups)) if self.groups else [[] for _ in self.by]
+        key_frame = pd.DataFrame({
+            col: pd.Series(self._categorical(col, values))
+            if isinstance(self.dtypes[col], pd.CategoricalDtype)
+            else pd.Series(values, dtype=self.dtypes[col])
+            for col, values in zip(self.by, keys)
+        })
+        # Let pandas sort and type the keys, exactly as in the in-memory path
+        positions = pd.Series(np.arange(len(key_frame))).groupby(
+            [key_frame[col] for col in self.by], sort=True, observed=True
+        ).first()
+        order = positions.to_numpy()
+
+        result = {col: pd.Series(positions.index.get_level_values(col), name=col) for col in self.by}
+        for col, func in self.aggregations.items():
+            if func in ("first", "last", "min", "max"):
+                missing = None if self.dtypes[col] == object else np.nan
+                values = np.where(self.present[col], self.values[col], missing)[order]
+                result[col] = self._series(col, list(values))
+            elif func == "count":
+                result[col] = self._series(col, self.totals[col][order], np.dtype("int64"))
+            elif func == "mean":
+                total, _, nobs = self.totals[col]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    means = np.where(nobs > 0, total / nobs, np.nan)
+                result[col] = self._series(col, means[order], np.dtype("float64"))
+            elif isinstance(self.totals[col], tuple):
+                result[col] = self._series(col, self.totals[col][0][order], np.dtype("float64"))
+            else:
+                result[col] = self._series(col, self.totals[col][order], np.dtype("int64"))
+        return pd.DataFrame(result)
+
+
+class StreamOutputs:
+    """The filtered, rejected, duplicates and summary outputs of one streaming run or partition"""
+
+    def __init__(self, config, suppliers_with_balance, categories, backend, log=print):
+        self.config = config
+        self.plan = compile_filter_plan(config["filters"], lambda _: suppliers_with_balance)
+        self.backend = backend
+        self.with_rejected = config["output"].get("rejected_rows", False)
+        self.writer = ProposalWriter(config, log)
+        grouping = config["grouping"]
+        self.groups = GroupAccumulator(grouping["by"], summary_aggregations(config), categories)
+        self.duplicates = duplicate_check_from_config(config)
+        # The kept rows' duplicate check columns, checked once all chunks are in
+        self.duplicate_rows = []
+        self.counts_df = None
+        self.rows_in = 0
+        self.rows_filtered = 0
+        self.rows_rejected = 0
+
+    def add(self, chunk):
+        """Filter one chunk, write its rows and fold the kept rows into the groups"""
+        self.rows_in += len(chunk)
+        if self.with_rejected:
+            mask = self.plan.exclusion_mask(chunk, None, log=_quiet, backend=self.backend)
+            rejected = mask != 0
+            kept = chunk[~rejected]
+            rejected_df = chunk[rejected].copy()
+            rejected_df["Exclusion mask"] = mask[rejected]
+            rejected_df["Exclusion reasons"] = self.plan.decode_reasons(mask[rejected])
+            self.writer.write("rejected", rejected_df)
+            self.rows_rejected += len(rejected_df)
+            counts = self.plan.exclusion_counts(mask)
+            if self.counts_df is None:
+                self.counts_df = counts
+            else:
+                for col in ("Rows excluded", "Only reason"):
+                    self.counts_df[col] += counts[col]
+        else:
+            kept = self.plan.apply(chunk, None, log=_quiet, backend=self.backend)
+        self.writer.write("filtered", kept)
+        self.rows_filtered += len(kept)
+        self.groups.add(kept)
+        if self.duplicates is not None and len(kept):
+            self.duplicate_rows.append(kept[[col for col in self.duplicates.columns if col in kept.columns]])
+
+    def finish(self, template, log=print, profiler=None, stage=_ignore_stage):
+        """Close the row outputs, write the summary; returns process_frame's outputs.
+
+        template is an empty frame with the extract's columns, used for the
+        headers of outputs that never got a row.
+        """
+        profiler = profiler or StageProfiler()
+        if self.with_rejected:
+            for rule in self.plan.rules:
+                row = self.counts_df.loc[self.counts_df["Bit"] == rule.bit].iloc[0] \
+                    if self.counts_df is not None else None
+                failed = 0 if row is None else int(row["Rows excluded"])
+                log(f"{rule.description}: {failed} rows fail this rule")
+        log(f"{self.rows_in - self.rows_filtered} rows excluded, {self.rows_filtered} remaining")
+
+        writer = self.writer
+        if "filtered" not in writer.tables:
+            writer.open("filtered", template)
+            self.groups.add(template)
+
+        duplicates_df = None
+        if self.duplicates is not None:
+            log("Checking for duplicate invoices...")
+            with profiler.stage("duplicates", self.rows_filtered) as record:
+                rows = pd.concat(self.duplicate_rows, ignore_index=True) if self.duplicate_rows else \
+                    template[[col for col in self.duplicates.columns if col in template.columns]]
+                self.duplicate_rows = []
+                _, duplicates_df = self.duplicates.apply(rows, log)
+                record["rows_out"] = len(duplicates_df)
+            stage("duplicates")
+
+        log("Grouping data...")
+        with profiler.stage("group", self.rows_filtered) as record:
+            grouped_df = self.groups.result()
+            record["rows_out"] = len(grouped_df)
+        stage("group")
+
+        grouped_df, deferred_df = prioritize(grouped_df, self.config, log, profiler, stage)
+
+        log(f"Saving filtered data to: {writer.describe('filtered')}")
+        with profiler.stage("save_filtered", self.rows_filtered) as record:
+            writer.finish("filtered")
+            record["rows_out"] = self.rows_filtered
+        stage("save_filtered")
+
+        log(f"Saving summary data to: {writer.describe('summary')}")
+        with profiler.stage("save_summary", len(grouped_df)) as record:
+            writer.write("summary", grouped_df)
+            writer.finish("summary")
+            record["rows_out"] = len(grouped_df)
+        stage("save_summary")
+
+        if deferred_df is not None:
+            log(f"Saving deferred suppliers to: {writer.describe('deferred')}")
+            with profiler.stage("save_deferred", len(deferred_df)) as record:
+                writer.write("deferred", deferred_df)
+                writer.finish("deferred")
+                record["rows_out"] = len(deferred_df)
+            stage("save_deferred")
+
+        if duplicates_df is not None:
+            log(f"Saving possible duplicates to: {writer.describe('duplicates')}")
+            with profiler.stage("save_duplicates", len(duplicates_df)) as record:
+                writer.write("duplicates", duplicates_df)
+                writer.finish("duplicates")
+                record["rows_out"] = len(duplicates_df)
+            stage("save_duplicates")
+
+        if self.with_rejected:
+            log(f"Saving rejected rows to: {writer.describe('rejected')}")
+            with profiler.stage("save_rejected", self.rows_rejected) as record:
+                writer.open("rejected", template.assign(**{
+                    "Exclusion mask": pd.Series(dtype=self.plan.mask_dtype),
+                    "Exclusion reasons": pd.Series(dtype=object),
+                }))
+                counts_df = self.counts_df if self.counts_df is not None else \
+                    self.plan.exclusion_counts(np.zeros(0, dtype=self.plan.mask_dtype))
+                writer.write("counts", counts_df)
+                writer.finish("rejected")
+                writer.finish("counts")
+                record["rows_out"] = self.rows_rejected
+            stage("save_rejected")
+
+        batches_df, batch_paths = save_batches(grouped_df, self.config, log, profiler, stage)
+
+        return {
+            "filtered_path": writer.paths["filtered"][0],
+            "summary_path": writer.paths["summary"][0],
+            "rejected_path": writer.paths["rejected"][0] if self.with_rejected else None,
+            "output_paths": writer.written_paths(),
+            "rows_in": self.rows_in,
+            "rows_filtered": self.rows_filtered,
+            "rows_rejected": self.rows_rejected if self.with_rejected else None,
+            "rows_paid": None if deferred_df is None else self.groups.lines(grouped_df),
+            "groups": len(grouped_df),
+            "duplicates": None if duplicates_df is None else len(duplicates_df),
+            "deferred": None if deferred_df is None else len(deferred_df),
+            "batches": None if batches_df is None else len(batches_df),
+            "batch_paths": batch_paths,
+            "filtered_df": None,
+            "grouped_df": grouped_df,
+            "duplicates_df": duplicates_df,
+            "deferred_df": deferred_df,
+            "batches_df": batches_df,
+        }
+
+    def close(self):
+        """Close any output still open, after an error"""
+        self.writer.close()
+
+
+def streamed_currencies(filters):
+    """("all", None), ("list", [codes]) or ("single", None) for filters["currency"]"""
+    currency = filters.get("currency")
+    if isinstance(currency, str):
+        if currency.strip().upper() in ("ALL", "*"):
+            return "all", None
+        if "," not in currency:
+            return "single", None
+        currency = currency.split(",")
+    if not isinstance(currency, (list, tuple)):
+        return "single", None
+    codes = [str(code).strip() for code in currency if str(code).strip()]
+    return ("list", codes) if codes else ("single", None)
+
+
+def run_streaming(invoice_path, supplier_path, config, log=print, profiler=None, stage=_ignore_stage,
+                  check_cancelled=None):
+    """Filter, group and save one day's files without loading the extract whole.
+
+    check_cancelled, if given, is also polled while the workbooks are read
+    and between chunks, and may raise to stop the run.
+
+    Returns the same result keys as the in-memory part of run_pipeline,
+    including "partitions" when filters.currency names several currencies.
+    """
+    profiler = profiler or StageProfiler()
+    input_config = config.get("input", {})
+    chunk_rows = input_config.get("chunk_rows") or DEFAULT_CHUNK_ROWS
+    columns = required_columns(config) if input_config.get("project_columns", False) else None
+
+    duplicates = duplicate_check_from_config(config)
+    if duplicates is not None and duplicates.hold:
+        raise ValueError("duplicates.hold needs every filtered row before grouping; "
+                         "turn off input.streaming or duplicates.hold")
+
+    supplier_df, suppliers_with_balance = load_balances(supplier_path, config, log, profiler, check_cancelled)
+    started = time.perf_counter()
+    with profiler.stage("scan") as record:
+        chunks = SheetChunks(invoice_path, header=1, columns=columns, chunk_rows=chunk_rows,
+                             check_cancelled=check_cancelled)
+        record["rows_out"] = chunks.rows
+    log(f"Scanned {os.path.basename(invoice_path)}: {chunks.rows} rows in {chunks.chunks} chunks "
+        f"of up to {chunk_rows} rows ({time.perf_counter() - started:.2f}s)")
+    stage("load")
+
+    mode, codes = streamed_currencies(config["filters"])
+    backend = backend_from_config(config)
+    # Categorical labels in order of first appearance over the whole extract
+    categories = {}
+    currency_rows = {}
+    sinks = {}
+
+    def sink_for(currency):
+        if currency not in sinks:
+            sink_config = config if currency is None else partition_config(config, currency)
+            sink_log = log if currency is None else (lambda message: log(f"[{currency}] {message}"))
+            sinks[currency] = StreamOutputs(sink_config, suppliers_with_balance, categories, backend, sink_log)
+        return sinks[currency]
+
+    template = None
+    try:
+        with chunks, profiler.stage("stream", chunks.rows) as record:
+            for number, chunk in enumerate(chunks, start=1):
+                if check_cancelled is not None:
+                    check_cancelled()
+                chunk.columns = chunk.columns.str.strip()
+                normalize_text_columns(chunk)
+                for col in chunk.columns:
+                    if isinstance(chunk[col].dtype, pd.CategoricalDtype):
+                        categories.setdefault(col, {}).update(dict.fromkeys(chunk[col].cat.categories))
+                if template is None:
+                    template = chunk.iloc[:0]
+                if mode == "single":
+                    sink_for(None).add(chunk)
+                else:
+                    for currency, count in chunk["Currency"].value_counts(sort=False).items():
+                        if count:
+                            currency_rows[str(currency)] = currency_rows.get(str(currency), 0) + int(count)
+                    for currency, part in chunk.groupby("Currency", observed=True, sort=False):
+                        if mode == "all" or str(currency) in codes:
+                            sink_for(str(currency)).add(part)
+                log(f"Chunk {number}/{chunks.chunks}: {len(chunk)} rows, "
+                    f"{sum(sink.rows_filtered for sink in sinks.values())} kept so far")
+            record["rows_out"] = sum(sink.rows_filtered for sink in sinks.values())
+        stage("filter")
+
+        if template is None:
+            template = pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in chunks.dtypes.items()})
+            template.columns = template.columns.str.strip()
+        result = {"output_folder": config["output"]["output_folder"], "rows_in": chunks.rows}
+        if mode == "single":
+            result.update(sink_for(None).finish(template, log, profiler, stage))
+            return result
+
+        if mode == "all":
+            # Largest currency first, as currency_partitions orders them
+            codes = [code for code, _ in sorted(currency_rows.items(), key=lambda item: -item[1])]
+        for currency in codes:
+            if currency not in sinks:
+                log(f"No {currency} invoices, skipped")
+        currencies = [currency for currency in codes if currency in sinks]
+        log(f"Processing {len(currencies)} currency partitions: {', '.join(currencies)}")
+        partitions = {}
+        for currency in currencies:
+            partition_profiler = StageProfiler()
+            partitions[currency] = sinks[currency].finish(
+                template, lambda message, currency=currency: log(f"[{currency}] {message}"),
+                partition_profiler
+            )
+            for partition_record in partition_profiler.records:
+                profiler.records.append(dict(partition_record, stage=f"{currency}/{partition_record['stage']}"))
+        stage("partitions")
+        result["partitions"] = partitions
+        for key in ("rows_filtered", "rows_rejected", "rows_paid", "groups", "duplicates", "deferred", "batches"):
+            counts = [outputs[key] for outputs in partitions.values() if outputs[key] is not None]
+            result[key] = sum(counts) if counts else None
+        return result
+    finally:
+        for sink in sinks.values():
+            sink.close()
@@ -0,0 +1,203 @@
+"""Watch a folder and process each new workings file / Sub TB pair.
+
+The watcher polls the folder (and its immediate subfolders) for a workings
+file and a Sub TB in the same directory. A file only counts once its size
+and modification time have not changed for settle_seconds and it opens as
+a complete .xlsx, so copies still in progress are left alone. When either
+file of a pair changes, the pair is run through the same pipeline as the
+GUI's Process button and the outputs go to output.output_folder.
+
+The process stays up between files: pandas stays imported, parsed sheets
+stay in the sheet cache and Sub TB lookups stay in memory, so each new pair
+only pays for its own compute.
+
+Examples:
+    python watch_folder.py --folder "//share/payments/incoming"
+    python watch_folder.py --folder incoming --once
+
+Files in a subfolder use the subfolder name as the file prefix; files in the
+watched folder itself use today's date (yyyymmdd).
+"""
+import argparse
+import copy
+import fnmatch
+import json
+import os
+import sys
+import time
+import zipfile
+from datetime import datetime
+
+import app_config
+import proposal_engine
+from workbook_cache import file_hash
+
+DEFAULTS = {
+    "folder": "incoming",
+    "workings_pattern": "*workings*.xls*",
+    "tb_pattern": "*sub tb*.xls*",
+    "poll_seconds": 5,
+    "settle_seconds": 10,
+    "state_file": "watch_state.json",
+}
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def is_complete(path):
+    """True if path can be opened and reads as a whole workbook.
+
+    A half-copied .xlsx is missing its zip central directory; a file still
+    locked by the copying program cannot be opened at all.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.read(1)
+        return not path.lower().endswith(".xlsx") or zipfile.is_zipfile(path)
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    def __init__(self, config, watch_config):
+        self.config = config
+        self.watch = watch_config
+        # path -> (size, mtime, first seen with that size and mtime)
+        self.seen = {}
+        # (path, size, mtime) -> content hash, so settled files are hashed once
+        self.hashes = {}
+        self.state = self.load_state()
+
+    def load_state(self):
+        """directory -> [workings hash, TB hash] of the last pair processed"""
+        if os.path.exists(self.watch["state_file"]):
+            with open(self.watch["state_file"]) as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        with open(self.watch["state_file"], "w") as f:
+            json.dump(self.state, f, indent=2)
+
+    def is_settled(self, path, now):
+        """True once path has kept its size and mtime for settle_seconds"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        signature = (stat.st_size, stat.st_mtime)
+        previous = self.seen.get(path)
+        if previous is None or previous[:2] != signature:
+            self.seen[path] = signature + (now,)
+            return False
+        return now - previous[2] >= self.watch["settle_seconds"] and is_complete(path)
+
+    def hash_of(self, path):
+        key = (path,) + self.seen[path][:2]
+        if key not in self.hashes:
+            self.hashes[key] = file_hash(path)
+        return self.hashes[key]
+
+    def newest(self, folder, pattern):
+        """Newest file in folder whose lower-cased name matches pattern"""
+        matches = [
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if not name.startswith("~$") and fnmatch.fnmatch(name.lower(), pattern.lower())
+        ]
+        return max(matches, key=os.path.getmtime) if matches else None
+
+    def ready_pairs(self):
+        """Yield (folder, workings, tb) pairs that are settled and not yet processed"""
+        root = self.watch["folder"]
+        folders = [root] + sorted(
+            entry.path for entry in os.scandir(root) if entry.is_dir()
+        )
+        now = time.monotonic()
+        for folder in folders:
+            workings = self.newest(folder, self.watch["workings_pattern"])
+            tb = self.newest(folder, self.watch["tb_pattern"])
+            if workings is None or tb is None:
+                continue
+            # Check both, so each file's settle clock starts on this scan
+            settled = [self.is_settled(workings, now), self.is_settled(tb, now)]
+            if not all(settled):
+                continue
+            hashes = [self.hash_of(workings), self.hash_of(tb)]
+            if self.state.get(folder) != hashes:
+                yield folder, workings, tb, hashes
+
+    def prefix_for(self, folder):
+        if os.path.abspath(folder) == os.path.abspath(self.watch["folder"]):
+            return datetime.now().strftime("%Y%m%d")
+        return os.path.basename(folder)
+
+    def process(self, folder, workings, tb, hashes):
+        config = copy.deepcopy(self.config)
+        config["output"]["file_prefix"] = self.prefix_for(folder)
+        log(f"Processing {os.path.basename(workings)} + {os.path.basename(tb)} "
+            f"as {config['output']['file_prefix']}")
+        try:
+            result = proposal_engine.run_pipeline(
+                workings, tb, config, log=lambda message: log(f"  {message}")
+            )
+            log(f"Done in {result['total']:.2f}s: {result['rows_filtered']} rows, "
+                f"{result['groups']} suppliers -> {result['output_folder']}")
+        except Exception as e:
+            log(f"ERROR processing {folder}: {e}")
+        # Failed pairs are recorded too; they are retried when either file changes
+        self.state[folder] = hashes
+        self.save_state()
+
+    def poll(self):
+        """Process every ready pair once; returns how many were processed"""
+        count = 0
+        for folder, workings, tb, hashes in self.ready_pairs():
+            self.process(folder, workings, tb, hashes)
+            count += 1
+        return count
+
+    def run(self):
+        log(f"Watching {os.path.abspath(self.watch['folder'])} "
+            f"every {self.watch['poll_seconds']}s (Ctrl+C to stop)")
+        while True:
+            self.poll()
+            time.sleep(self.watch["poll_seconds"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process new daily files dropped into a folder")
+    parser.add_argument("--config", default=app_config.CONFIG_PATH, help="config file (default: %(default)s)")
+    parser.add_argument("--folder", help="folder to watch (default: config watch.folder)")
+    parser.add_argument("--poll", type=float, help="seconds between scans (default: config watch.poll_seconds)")
+    parser.add_argument("--settle", type=float,
+                        help="seconds a file must stay unchanged (default: config watch.settle_seconds)")
+    parser.add_argument("--once", action="store_true",
+                        help="process what is ready now and exit; files are settled on the second scan")
+    args = parser.parse_args(argv)
+
+    config = app_config.load_config(args.config)
+    watch_config = dict(DEFAULTS, **config.get("watch", {}))
+    for key, value in (("folder", args.folder), ("poll_seconds", args.poll), ("settle_seconds", args.settle)):
+        if value is not None:
+            watch_config[key] = value
+    if not os.path.isdir(watch_config["folder"]):
+        parser.error(f"watch folder {watch_config['folder']} does not exist")
+
+    watcher = FolderWatcher(config, watch_config)
+    if args.once:
+        # The first scan only records sizes; wait out the settle time and scan again
+        watcher.poll()
+        time.sleep(watch_config["settle_seconds"])
+        watcher.poll()
+        return 0
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        log("Stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
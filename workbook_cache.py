@@ -0,0 +1,122 @@
+"""Content-hashed cache of parsed Excel sheets.
+
+Parsing workings_file.xlsx and the balance sheet with openpyxl dominates the
+processing time. Each parsed sheet is stored as Parquet under a key built from
+the file contents, the header row and the sheet name, so re-running on an
+unchanged file skips the Excel parse entirely.
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from workbook_loader import read_columns
+
+DEFAULT_CACHE_FOLDER = ".excel_cache"
+DEFAULT_MAX_SIZE_MB = 500
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(path, header=0, sheet_name=0, columns=None, content_hash=None):
+    """Build the cache key for one sheet (or column projection) of a workbook.
+
+    content_hash is the file's file_hash, if the caller already has it.
+    """
+    parts = [content_hash or file_hash(path), f"header={header}", f"sheet={sheet_name}"]
+    if columns is not None:
+        parts.append("columns=" + "\x1f".join(columns))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class SheetCache:
+    def __init__(self, folder=DEFAULT_CACHE_FOLDER, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.folder = folder
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _entry_paths(self, key):
+        base = os.path.join(self.folder, key)
+        return base + ".parquet", base + ".pkl"
+
+    def get(self, key):
+        """Return the cached DataFrame for key, or None on a miss"""
+        for entry in self._entry_paths(key):
+            if os.path.exists(entry):
+                # Touch the entry so eviction treats it as recently used
+                os.utime(entry, None)
+                if entry.endswith(".parquet"):
+                    return pd.read_parquet(entry)
+                return pd.read_pickle(entry)
+        return None
+
+    def put(self, key, df):
+        """Store a DataFrame under key and evict old entries if over budget"""
+        parquet_path, pickle_path = self._entry_paths(key)
+        # Write to a temporary name first so concurrent readers (batch
+        # workers) never see a half-written entry
+        temp_path = f"{parquet_path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(temp_path, index=False)
+            os.replace(temp_path, parquet_path)
+        except Exception:
+            # SAP extracts mix ints and strings in columns like Supplier,
+            # which Parquet cannot store without changing the values
+            df.to_pickle(temp_path)
+            os.replace(temp_path, pickle_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+    def contains(self, path, header=0, sheet_name=0, columns=None, content_hash=None):
+        """True if the sheet is already cached"""
+        key = cache_key(path, header=header, sheet_name=sheet_name, columns=columns, content_hash=content_hash)
+        return any(os.path.exists(entry) for entry in self._entry_paths(key))
+
+    def read_excel(self, path, header=0, sheet_name=0, columns=None, content_hash=None):
+        """Read a sheet through the cache. Returns (DataFrame, hit)"""
+        key = cache_key(path, header=header, sheet_name=sheet_name, columns=columns, content_hash=content_hash)
+        df = self.get(key)
+        if df is not None:
+            return df, True
+        if columns is not None:
+            df = read_columns(path, columns, header=header, sheet_name=sheet_name)
+        else:
+            df = pd.read_excel(path, header=header, sheet_name=sheet_name)
+        self.put(key, df)
+        return df, False
+
+
+def cache_from_config(config):
+    """Return a SheetCache for config["cache"], or None if caching is off"""
+    cache_config = config.get("cache", {})
+    if not cache_config.get("enabled", True):
+        return None
+    return SheetCache(
+        cache_config.get("folder", DEFAULT_CACHE_FOLDER),
+        cache_config.get("max_size_mb", DEFAULT_MAX_SIZE_MB),
+    )
@@ -0,0 +1,287 @@
+"""Column-projected streaming reader for the SAP workbooks.
+
+apply_filters and apply_grouping only touch a dozen columns of the workings
+file. Instead of building every cell of a wide extract, the loader streams
+rows through openpyxl's read-only iter_rows and keeps only the columns the
+active config needs.
+
+SheetChunks reads a sheet in row chunks for the streaming pipeline, typed
+exactly as a whole-sheet read would type them.
+"""
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+from pandas.api.types import is_numeric_dtype
+
+from duplicate_check import duplicate_check_from_config
+from payment_priority import summary_aggregations
+
+# Columns read by apply_filters
+FILTER_COLUMNS = [
+    "G/L Account: Long Text", "Payment Method", "Currency", "Payment block",
+    "Diageo", "Supplier", "Bank account", "Net Due Date", "Due/Not"
+]
+
+# Columns read by get_suppliers_with_balance
+BALANCE_COLUMNS = ["Supplier", "Clsng Blns Debit", "Clsng Blns Credit"]
+
+DEFAULT_CHUNK_ROWS = 50_000
+# Rows scanned between calls to SheetChunks' check_cancelled
+CANCEL_CHECK_ROWS = 2_000
+
+# Cached formula errors come back from openpyxl as plain strings
+EXCEL_ERRORS = {"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"}
+
+
+def _convert_cell(value):
+    """Mirror the cell conversion pd.read_excel applies to openpyxl values"""
+    if value is None:
+        return ""
+    if isinstance(value, str) and value in EXCEL_ERRORS:
+        return float("nan")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def required_columns(config):
+    """Return the invoice columns needed by the active filters, duplicate check, grouping and priority keys"""
+    grouping = config["grouping"]
+    columns = list(FILTER_COLUMNS)
+    columns += grouping["by"]
+    columns += list(summary_aggregations(config))
+    duplicates = duplicate_check_from_config(config)
+    if duplicates is not None:
+        columns += duplicates.key_columns
+    columns += config.get("input", {}).get("extra_columns", [])
+    # Keep the first occurrence of each name, in order
+    return list(dict.fromkeys(columns))
+
+
+def read_columns(path, columns, header=0, sheet_name=0):
+    """Stream only the named columns of a sheet into a DataFrame.
+
+    header is the 0-based header row, as in pd.read_excel. Header names are
+    matched after stripping whitespace, and the returned frame uses the
+    stripped names. Values are typed the same way pd.read_excel types them.
+    """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet_name, int):
+            worksheet = workbook.worksheets[sheet_name]
+        else:
+            worksheet = workbook[sheet_name]
+
+        rows = worksheet.iter_rows(min_row=header + 1, values_only=True)
+        header_row = next(rows, None) or ()
+        positions = {}
+        for idx, name in enumerate(header_row):
+            if name is not None:
+                positions.setdefault(str(name).strip(), idx)
+
+        missing = [col for col in columns if col not in positions]
+        if missing:
+            raise ValueError(
+                f"Missing columns in {os.path.basename(path)}: {', '.join(missing)}"
+            )
+
+        indexes = [positions[col] for col in columns]
+        data = [list(columns)]
+        for row in rows:
+            values = [_convert_cell(row[i]) if i < len(row) else "" for i in indexes]
+            data.append(values)
+    finally:
+        workbook.close()
+
+    # pd.read_excel drops trailing blank rows before parsing
+    while len(data) > 1 and all(v == "" for v in data[-1]):
+        data.pop()
+
+    # Same type inference and NA handling as pd.read_excel
+    return TextParser(data, header=0).read()
+
+
+class ColumnTypes:
+    """Works out the dtype a whole-sheet parse gives each column, chunk by chunk.
+
+    A column is numeric only if every chunk parses as numbers: float64 if
+    any chunk has floats or blanks, else int64 (or bool). Otherwise the raw
+    cell values are kept, and the column is str or datetime only if every
+    value is a string or a datetime. So a chunk of numeric-looking references
+    does not decide the type of a text column.
+    """
+
+    def __init__(self):
+        # name -> set of numeric dtype kinds, or None once a chunk was not numeric
+        self.numeric = {}
+        # name -> set of pandas inferred kinds of the raw non-blank values
+        self.raw = {}
+
+    def add(self, parsed, raw):
+        """Record one chunk, parsed normally and parsed as raw objects"""
+        for name in parsed.columns:
+            kinds = self.numeric.setdefault(name, set())
+            if kinds is not None:
+                kind = parsed[name].dtype.kind
+                self.numeric[name] = kinds | {kind} if kind in "biuf" else None
+            inferred = pd.api.types.infer_dtype(raw[name], skipna=True)
+            if inferred != "empty":
+                self.raw.setdefault(name, set()).add(inferred)
+
+    def dtype(self, name):
+        kinds = self.numeric.get(name, {"f"})
+        if kinds is not None:
+            if not kinds or "f" in kinds or {"i", "u"} <= kinds:
+                return np.dtype("float64")
+            if "u" in kinds:
+                return np.dtype("uint64")
+            return np.dtype("int64") if "i" in kinds else np.dtype("bool")
+        raw = self.raw.get(name, set())
+        if raw == {"string"}:
+            return pd.StringDtype(na_value=np.nan)
+        if raw and raw <= {"datetime", "datetime64"}:
+            return np.dtype("datetime64[us]")
+        return np.dtype(object)
+
+
+class SheetChunks:
+    """A sheet read in row chunks, typed the way reading it whole would type it.
+
+    Opening makes one streaming pass with openpyxl: converted rows are spilled
+    to a temporary file chunk by chunk while each column's whole-sheet dtype is
+    worked out. Iterating reads the spilled chunks back and parses each one
+    with those dtypes, so the workbook XML is parsed once and only one chunk
+    is ever in memory. Without columns, chunks match pd.read_excel(path,
+    header=header); with columns, they match read_columns. check_cancelled,
+    if given, is called every CANCEL_CHECK_ROWS rows of the scan and may
+    raise to stop it.
+    """
+
+    def __init__(self, path, header=0, columns=None, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_name=0,
+                 check_cancelled=None):
+        self.path = path
+        self.check_cancelled = check_cancelled
+        self.chunk_rows = chunk_rows
+        self.projected = columns is not None
+        self.rows = 0
+        self.chunks = 0
+        self.spill = tempfile.TemporaryFile(prefix="sheet_chunks_")
+        self.types = ColumnTypes()
+        try:
+            self._scan(header, columns, sheet_name)
+        except BaseException:
+            self.close()
+            raise
+
+    def _parse(self, header_row, rows, dtype=None):
+        data = [header_row] + rows
+        # pd.read_excel keeps blank lines; read_columns leaves the parser default
+        return TextParser(data, header=0, dtype=dtype, skip_blank_lines=self.projected).read()
+
+    def _scan(self, header, columns, sheet_name):
+        workbook = load_workbook(self.path, read_only=True, data_only=True, keep_links=False)
+        try:
+            worksheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+            worksheet.reset_dimensions()
+            rows = worksheet.iter_rows(values_only=True)
+            width = 0
+            for _ in range(header):
+                width = max(width, len(self._trimmed(next(rows, ()))))
+            header_row = self._trimmed(next(rows, ()))
+            indexes = None
+            if self.projected:
+                positions = {}
+                for idx, name in enumerate(header_row):
+                    if name != "":
+                        positions.setdefault(str(name).strip(), idx)
+                missing = [col for col in columns if col not in positions]
+                if missing:
+                    raise ValueError(
+                        f"Missing columns in {os.path.basename(self.path)}: {', '.join(missing)}"
+                    )
+                indexes = [positions[col] for col in columns]
+                header_row = list(columns)
+            self.width = len(header_row) if self.projected else max(width, len(header_row))
+
+            chunk, blanks = [], 0
+            for number, row in enumerate(rows, start=1):
+                if self.check_cancelled is not None and not number % CANCEL_CHECK_ROWS:
+                    self.check_cancelled()
+                if indexes is None:
+                    values = self._trimmed(row)
+                else:
+                    values = [_convert_cell(row[i]) if i < len(row) else "" for i in indexes]
+                    if all(v == "" for v in values):
+                        values = []
+                if not values:
+                    # Blank rows only count if a row with data follows them
+                    blanks += 1
+                    continue
+                chunk.extend([] for _ in range(blanks))
+                blanks = 0
+                chunk.append(values)
+                self.width = max(self.width, len(values))
+                if len(chunk) >= self.chunk_rows:
+                    self._spill(header_row, chunk)
+                    chunk = []
+            if chunk:
+                self._spill(header_row, chunk)
+        finally:
+            workbook.close()
+
+        self.header_row = self._padded(header_row)
+        self.columns = list(self._parse(self.header_row, []).columns)
+        # Columns past a chunk's last value were blank in that chunk
+        self.dtypes = {name: self.types.dtype(name) for name in self.columns}
+
+    @staticmethod
+    def _trimmed(row):
+        """Row as pd.read_excel converts it, without trailing empty cells"""
+        values = [_convert_cell(value) for value in row]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def _padded(self, row):
+        return list(row) + [""] * (self.width - len(row))
+
+    def _spill(self, header_row, chunk):
+        width = max(len(header_row), *(len(row) for row in chunk))
+        header_row = list(header_row) + [""] * (width - len(header_row))
+        rows = [row + [""] * (width - len(row)) for row in chunk]
+        parsed = self._parse(header_row, rows)
+        raw = self._parse(header_row, rows, dtype=dict.fromkeys(parsed.columns, object))
+        self.types.add(parsed, raw)
+        self.rows += len(parsed)
+        self.chunks += 1
+        pickle.dump(chunk, self.spill, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self):
+        """Yield the chunks as DataFrames with the whole-sheet dtypes"""
+        self.spill.seek(0)
+        # Non-numeric columns keep the raw cell values, as a whole-sheet parse does
+        raw = {name: object for name, dtype in self.dtypes.items() if not is_numeric_dtype(dtype)}
+        start = 0
+        for _ in range(self.chunks):
+            rows = [self._padded(row) for row in pickle.load(self.spill)]
+            frame = self._parse(self.header_row, rows, dtype=raw or None)
+            for name, dtype in self.dtypes.items():
+                if frame[name].dtype != dtype:
+                    frame[name] = frame[name].astype(dtype)
+            frame.index = pd.RangeIndex(start, start + len(frame))
+            start += len(frame)
+            yield frame
+
+    def close(self):
+        self.spill.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()